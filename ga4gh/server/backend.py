@@ -6,23 +6,51 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import functools
+import json
+
+import ga4gh.server.coverage as coverage
 import ga4gh.server.datamodel as datamodel
+import ga4gh.server.datamodel.reads as reads
+import ga4gh.server.datamodel.references as references
 import ga4gh.server.exceptions as exceptions
 import ga4gh.server.paging as paging
 import ga4gh.server.response_builder as response_builder
+import ga4gh.server.response_cache as response_cache
+import ga4gh.server.timing as timing
 
 import ga4gh.schemas.protocol as protocol
 
+import google.protobuf.message as message
+
+
+JSON_MIMETYPE = "application/json"
+PROTOBUF_MIMETYPE = "application/x-protobuf"
+
 
 class Backend(object):
     """
     Backend for handling the server requests.
     This class provides methods for all of the GA4GH protocol end points.
     """
+    # Searches over interval iterators, whose cursors can be kept open
+    # between pages.
+    _cursorRequestClasses = (
+        protocol.SearchReadsRequest, protocol.SearchVariantsRequest,
+        protocol.SearchVariantAnnotationsRequest)
+
     def __init__(self, dataRepository):
         self._requestValidation = False
         self._defaultPageSize = 100
         self._maxResponseLength = 2**20  # 1 MiB
+        self._virtualOffsetPageTokens = False
+        self._cigarReferenceSequences = False
+        self._cursorCache = None
+        self._coverageTileCache = None
+        self._streamingResponses = False
+        self._responseCache = None
+        self._responseCacheEndpoints = set()
+        self._metrics = None
         self._dataRepository = dataRepository
 
     def getDataRepository(self):
@@ -50,6 +78,109 @@ class Backend(object):
         """
         self._maxResponseLength = maxResponseLength
 
+    def setVirtualOffsetPageTokens(self, virtualOffsetPageTokens):
+        """
+        Sets whether variant searches issue page tokens holding the
+        virtual file offset of the next record.
+        """
+        self._virtualOffsetPageTokens = virtualOffsetPageTokens
+
+    def setCigarReferenceSequences(self, cigarReferenceSequences):
+        """
+        Sets whether reads searches fill in the reference bases of the
+        CIGAR units of the reads.
+        """
+        self._cigarReferenceSequences = cigarReferenceSequences
+
+    def setCursorCache(self, maxSize, timeToLive):
+        """
+        Sets the maximum number of interval search cursors to keep open
+        between pages, and the number of seconds an idle cursor is kept.
+        A maxSize of zero disables the cursor cache.
+        """
+        self._cursorCache = None
+        if maxSize > 0:
+            self._cursorCache = paging.CursorCache(maxSize, timeToLive)
+
+    def getCursorCache(self):
+        """
+        Returns the cursor cache used by this backend, or None if it is
+        disabled.
+        """
+        return self._cursorCache
+
+    def setCoverageTileCache(self, directory, maxTiles):
+        """
+        Sets the directory in which the tiles of reads coverage are
+        cached, and the maximum number of tiles kept there. A directory
+        of None disables the tile cache.
+        """
+        self._coverageTileCache = None
+        if directory is not None:
+            self._coverageTileCache = coverage.CoverageTileCache(
+                directory, maxTiles)
+
+    def setStreamingResponses(self, streamingResponses):
+        """
+        Sets whether search requests return a generator over the pieces
+        of the JSON response, which are produced as the search runs,
+        rather than the complete response string.
+        """
+        self._streamingResponses = streamingResponses
+
+    def setResponseCache(self, maxSize, timeToLive, endpoints):
+        """
+        Sets the maximum total size in bytes of the responses to cache,
+        the number of seconds for which a response is kept, and the names
+        of the request classes (e.g. "SearchVariantsRequest") whose
+        responses are cached. A maxSize of zero disables the response
+        cache.
+        """
+        self._responseCache = None
+        self._responseCacheEndpoints = set(endpoints)
+        if maxSize > 0:
+            self._responseCache = response_cache.ResponseCache(
+                maxSize, timeToLive)
+
+    def getResponseCache(self):
+        """
+        Returns the response cache used by this backend, or None if it is
+        disabled.
+        """
+        return self._responseCache
+
+    def setMetrics(self, metrics):
+        """
+        Sets the metrics.Metrics object in which this backend records the
+        page size and number of items of search responses, along with the
+        use of its caches. If metrics is None, nothing is recorded.
+        """
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.addCollector(self._collectCacheMetrics)
+
+    def _collectCacheMetrics(self):
+        """
+        Returns the metrics describing the use of the cursor and response
+        caches, in the form expected by metrics.Metrics.addCollector.
+        """
+        ret = []
+        caches = [
+            ("cursor", self._cursorCache), ("response", self._responseCache)]
+        for name, cache in caches:
+            if cache is None:
+                continue
+            for counter, value in [
+                    ("hits", cache.getHitCount()),
+                    ("misses", cache.getMissCount()),
+                    ("evictions", cache.getEvictionCount())]:
+                ret.append((
+                    "ga4gh_{}_cache_{}_total".format(name, counter),
+                    "counter",
+                    "Number of {} in the {} cache.".format(counter, name),
+                    [([], value)]))
+        return ret
+
     def startProfile(self):
         """
         Profiling hook. Called at the start of the runSearchRequest method
@@ -286,37 +417,34 @@ class Backend(object):
             request, variantSet.getNumVariantAnnotationSets(),
             variantSet.getVariantAnnotationSetByIndex)
 
-    def readsGenerator(self, request):
+    def readsGenerator(
+            self, request, fieldMask=None, readSampler=None,
+            qualityEncoding=None):
         """
         Returns a generator over the (read, nextPageToken) pairs defined
-        by the specified request
+        by the specified request. If a fieldMask is given, the fields of
+        the reads that are not in it may be left unset. If a readSampler
+        is given, only the reads it keeps are returned. If a
+        qualityEncoding is given, the reads are returned as
+        EncodedQualitiesValues holding their qualities in this encoding.
+        """
+        container, reference = self._getReadsSearchTarget(request)
+        return paging.ReadsIntervalIterator(
+            request, container, reference, fieldMask,
+            self._getReferenceWindow(reference), readSampler,
+            qualityEncoding)
+
+    def _getReadsSearchTarget(self, request):
+        """
+        Returns the (container, reference) pair searched by the specified
+        SearchReadsRequest, where container is the read group it names,
+        or the read group set if it names all of its read groups.
         """
         if not request.reference_id:
             raise exceptions.UnmappedReadsNotSupported()
         if len(request.read_group_ids) < 1:
             raise exceptions.BadRequestException(
                 "At least one readGroupId must be specified")
-        elif len(request.read_group_ids) == 1:
-            return self._readsGeneratorSingle(request)
-        else:
-            return self._readsGeneratorMultiple(request)
-
-    def _readsGeneratorSingle(self, request):
-        compoundId = datamodel.ReadGroupCompoundId.parse(
-            request.read_group_ids[0])
-        dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
-        readGroupSet = dataset.getReadGroupSet(compoundId.read_group_set_id)
-        referenceSet = readGroupSet.getReferenceSet()
-        if referenceSet is None:
-            raise exceptions.ReadGroupSetNotMappedToReferenceSetException(
-                    readGroupSet.getId())
-        reference = referenceSet.getReference(request.reference_id)
-        readGroup = readGroupSet.getReadGroup(compoundId.read_group_id)
-        intervalIterator = paging.ReadsIntervalIterator(
-            request, readGroup, reference)
-        return intervalIterator
-
-    def _readsGeneratorMultiple(self, request):
         compoundId = datamodel.ReadGroupCompoundId.parse(
             request.read_group_ids[0])
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
@@ -326,26 +454,38 @@ class Backend(object):
             raise exceptions.ReadGroupSetNotMappedToReferenceSetException(
                     readGroupSet.getId())
         reference = referenceSet.getReference(request.reference_id)
+        if len(request.read_group_ids) == 1:
+            readGroup = readGroupSet.getReadGroup(compoundId.read_group_id)
+            return readGroup, reference
         readGroupIds = readGroupSet.getReadGroupIds()
         if set(readGroupIds) != set(request.read_group_ids):
             raise exceptions.BadRequestException(
                 "If multiple readGroupIds are specified, "
                 "they must be all of the readGroupIds in a ReadGroupSet")
-        intervalIterator = paging.ReadsIntervalIterator(
-            request, readGroupSet, reference)
-        return intervalIterator
+        return readGroupSet, reference
+
+    def _getReferenceWindow(self, reference):
+        """
+        Returns the ReferenceWindow from which a reads search on the
+        specified reference fills in the reference bases of CIGAR units,
+        or None if they are not filled in.
+        """
+        if not self._cigarReferenceSequences:
+            return None
+        return references.ReferenceWindow(reference)
 
-    def variantsGenerator(self, request):
+    def variantsGenerator(self, request, fieldMask=None):
         """
         Returns a generator over the (variant, nextPageToken) pairs defined
-        by the specified request.
+        by the specified request. If a fieldMask is given, the fields of
+        the variants that are not in it may be left unset.
         """
         compoundId = datamodel.VariantSetCompoundId \
             .parse(request.variant_set_id)
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         variantSet = dataset.getVariantSet(compoundId.variant_set_id)
         intervalIterator = paging.VariantsIntervalIterator(
-            request, variantSet)
+            request, variantSet, self._virtualOffsetPageTokens, fieldMask)
         return intervalIterator
 
     def variantAnnotationsGenerator(self, request):
@@ -565,49 +705,252 @@ class Backend(object):
     #
     ###########################################################
 
-    def runGetRequest(self, obj):
+    def _parseRequest(self, requestStr, requestClass, mimetype):
+        """
+        Returns the instance of the specified requestClass held in the
+        specified string, which is serialised in the format given by the
+        specified mimetype.
+        """
+        if mimetype == PROTOBUF_MIMETYPE:
+            request = requestClass()
+            try:
+                request.ParseFromString(requestStr)
+            except message.DecodeError:
+                raise exceptions.InvalidProtobufException(
+                    requestClass.__name__)
+            return request
+        try:
+            return protocol.fromJson(requestStr, requestClass)
+        except protocol.json_format.ParseError:
+            raise exceptions.InvalidJsonException(requestStr)
+
+    def _serializeResponse(self, protocolElement, mimetype):
+        """
+        Returns the specified protocol element serialised in the format
+        given by the specified mimetype.
+        """
+        if mimetype == PROTOBUF_MIMETYPE:
+            return protocolElement.SerializeToString()
+        return protocol.toJson(protocolElement)
+
+    def runGetRequest(self, obj, mimetype=JSON_MIMETYPE):
         """
         Runs a get request by converting the specified datamodel
         object into its protocol representation.
         """
         protocolElement = obj.toProtocolElement()
-        jsonString = protocol.toJson(protocolElement)
-        return jsonString
+        return self._serializeResponse(protocolElement, mimetype)
+
+    def _getCursorKey(self, request, fieldMask=None, generatorKey=None):
+        """
+        Returns the key identifying the cursors of the specified request
+        with the specified field mask and object generator options in the
+        cursor cache, or None if its cursors are not cached. The key is
+        independent of the page token and page size.
+        """
+        if (self._cursorCache is None or
+                not isinstance(request, self._cursorRequestClasses)):
+            return None
+        normalisedRequest = type(request)()
+        normalisedRequest.CopyFrom(request)
+        normalisedRequest.page_token = ""
+        normalisedRequest.page_size = 0
+        return (
+            type(request).__name__, normalisedRequest.SerializeToString(),
+            self._getFieldMaskKey(fieldMask), generatorKey or "")
+
+    def _getFieldMaskKey(self, fieldMask):
+        """
+        Returns the string identifying the specified field mask in cache
+        keys.
+        """
+        if fieldMask is None:
+            return ""
+        return ",".join(sorted(fieldMask)) + ","
+
+    def _getResponseCacheKey(
+            self, request, responseMimetype, fieldMask=None,
+            qualityEncoding=None, generatorKey=None):
+        """
+        Returns the key identifying the response to the specified request
+        with the specified field mask, quality encoding and object
+        generator options in the response cache, or None if the response
+        is not cached. The request is keyed
+        by its serialised protobuf form, so that requests differing only in
+        the formatting of their JSON share a key.
+        """
+        requestClassName = type(request).__name__
+        if (self._responseCache is None or
+                requestClassName not in self._responseCacheEndpoints):
+            return None
+        return (
+            requestClassName, responseMimetype, request.SerializeToString(),
+            self._getFieldMaskKey(fieldMask), qualityEncoding or "",
+            generatorKey or "")
+
+    def _getCachedResponse(self, cacheKey):
+        """
+        Returns the response cached under the specified key, or None if
+        there is no such response or caching is disabled.
+        """
+        if cacheKey is None:
+            return None
+        return self._responseCache.get(
+            cacheKey, self.getDataRepository().getVersionStamp())
+
+    def _cacheResponse(self, cacheKey, responseString):
+        """
+        Caches the specified response under the specified key, unless the
+        key is None.
+        """
+        if cacheKey is not None:
+            self._responseCache.put(
+                cacheKey, self.getDataRepository().getVersionStamp(),
+                responseString)
 
     def runSearchRequest(
-            self, requestStr, requestClass, responseClass, objectGenerator):
+            self, requestStr, requestClass, responseClass, objectGenerator,
+            requestMimetype=JSON_MIMETYPE, responseMimetype=JSON_MIMETYPE,
+            fields=None, qualityEncoding=None, generatorKey=None):
         """
         Runs the specified request. The request is a string containing
-        a JSON representation of an instance of the specified requestClass.
-        We return a string representation of an instance of the specified
-        responseClass in JSON format. Objects are filled into the page list
+        a representation of an instance of the specified requestClass,
+        in JSON or serialised protobuf format according to the specified
+        requestMimetype. We return a string representation of an instance
+        of the specified responseClass in the format given by the
+        specified responseMimetype. Objects are filled into the page list
         using the specified object generator, which must return
         (object, nextPageToken) pairs, and be able to resume iteration from
         any point using the nextPageToken attribute of the request object.
+        If streaming responses are enabled, a generator over the pieces of
+        a JSON response is returned instead of a string. If fields are
+        given, as a comma-separated list of the fields of the objects, the
+        object generator must accept a fieldMask argument, and only these
+        fields of the objects are returned. If a qualityEncoding is given,
+        the base qualities of the objects are written to JSON responses as
+        strings in this encoding. The generatorKey is a string identifying
+        any options bound into the object generator, which distinguishes
+        its responses in the caches.
         """
         self.startProfile()
-        try:
-            request = protocol.fromJson(requestStr, requestClass)
-        except protocol.json_format.ParseError:
-            raise exceptions.InvalidJsonException(requestStr)
+        with timing.stage("parse"):
+            request = self._parseRequest(
+                requestStr, requestClass, requestMimetype)
+            fieldMask = None
+            if fields is not None:
+                fieldMask = response_builder.parseFieldMask(
+                    responseClass, fields)
         # TODO How do we detect when the page size is not set?
         if not request.page_size:
             request.page_size = self._defaultPageSize
         if request.page_size < 0:
             raise exceptions.BadPageSizeException(request.page_size)
-        responseBuilder = response_builder.SearchResponseBuilder(
-            responseClass, request.page_size, self._maxResponseLength)
+        cacheKey = self._getResponseCacheKey(
+            request, responseMimetype, fieldMask, qualityEncoding,
+            generatorKey)
+        responseString = self._getCachedResponse(cacheKey)
+        if responseString is not None:
+            self.endProfile()
+            return responseString
+        streaming = (
+            self._streamingResponses and responseMimetype == JSON_MIMETYPE)
+        if streaming:
+            responseBuilder = response_builder.StreamingSearchResponseBuilder(
+                responseClass, request.page_size, self._maxResponseLength,
+                fieldMask, qualityEncoding)
+        else:
+            responseBuilder = response_builder.SearchResponseBuilder(
+                responseClass, request.page_size, self._maxResponseLength,
+                fieldMask, qualityEncoding)
+        cursorKey = self._getCursorKey(request, fieldMask, generatorKey)
+        iterator = None
+        if cursorKey is not None and request.page_token:
+            iterator = self._cursorCache.take(cursorKey, request.page_token)
+        if iterator is None:
+            with timing.stage("fetch"):
+                if fieldMask is None:
+                    iterator = objectGenerator(request)
+                else:
+                    iterator = objectGenerator(request, fieldMask=fieldMask)
+        steps = self._fillSearchResponse(responseBuilder, iterator, cursorKey)
+        if streaming:
+            # Add the first value before anything is written, so that
+            # errors in setting up the search are still reported with
+            # the appropriate HTTP status.
+            next(steps, None)
+            return self._streamSearchResponse(
+                request, responseBuilder, steps, cacheKey)
+        for _ in steps:
+            pass
+        self._observeSearch(request, responseBuilder)
+        with timing.stage("serialize"):
+            if responseMimetype == PROTOBUF_MIMETYPE:
+                responseString = \
+                    responseBuilder.getSerializedBinaryResponse()
+            else:
+                responseString = responseBuilder.getSerializedResponse()
+        self._cacheResponse(cacheKey, responseString)
+        self.endProfile()
+        return responseString
+
+    def _fillSearchResponse(self, responseBuilder, iterator, cursorKey):
+        """
+        Adds the objects from the specified iterator over (object,
+        nextPageToken) pairs to the specified response builder until it
+        is full, yielding after each object is added. The iterator is
+        then kept in the cursor cache under the specified key, if it can
+        be resumed. The time spent reading from the iterator and adding
+        to the builder is charged to the fetch and build timing stages.
+        """
         nextPageToken = None
-        for obj, nextPageToken in objectGenerator(request):
-            responseBuilder.addValue(obj)
+        while True:
+            with timing.stage("fetch"):
+                pair = next(iterator, None)
+            if pair is None:
+                break
+            obj, nextPageToken = pair
+            with timing.stage("build"):
+                responseBuilder.addValue(obj)
+            yield
             if responseBuilder.isFull():
                 break
+        if cursorKey is not None and nextPageToken is not None:
+            self._cursorCache.add(cursorKey, nextPageToken, iterator)
         responseBuilder.setNextPageToken(nextPageToken)
-        responseString = responseBuilder.getSerializedResponse()
+
+    def _observeSearch(self, request, responseBuilder):
+        """
+        Records the page size of the specified request and the number of
+        items in the response built by the specified builder, if metrics
+        are enabled.
+        """
+        if self._metrics is not None:
+            self._metrics.observeSearch(
+                type(request).__name__, request.page_size,
+                responseBuilder.getNumElements())
+
+    def _streamSearchResponse(
+            self, request, responseBuilder, steps, cacheKey):
+        """
+        Yields the pieces of the JSON response to the specified request
+        built by the specified streaming response builder as the specified
+        steps of the search add values to it. The complete response is
+        then cached under the specified key, unless it is None.
+        """
+        pieces = [responseBuilder.takeSerializedValues()]
+        yield pieces[-1]
+        for _ in steps:
+            pieces.append(responseBuilder.takeSerializedValues())
+            yield pieces[-1]
+        pieces.append(responseBuilder.getSerializedResponse())
+        yield pieces[-1]
+        self._observeSearch(request, responseBuilder)
+        self._cacheResponse(cacheKey, "".join(pieces))
         self.endProfile()
-        return responseString
 
-    def runListReferenceBases(self, requestJson):
+    def runListReferenceBases(
+            self, requestJson, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Runs a listReferenceBases request for the specified ID and
         request arguments.
@@ -617,12 +960,13 @@ class Backend(object):
         if not requestJson:
             request = protocol.ListReferenceBasesRequest()
         else:
-            try:
-                request = protocol.fromJson(
-                    requestJson,
-                    protocol.ListReferenceBasesRequest)
-            except protocol.json_format.ParseError:
-                raise exceptions.InvalidJsonException(requestJson)
+            request = self._parseRequest(
+                requestJson, protocol.ListReferenceBasesRequest,
+                requestMimetype)
+        cacheKey = self._getResponseCacheKey(request, responseMimetype)
+        responseString = self._getCachedResponse(cacheKey)
+        if responseString is not None:
+            return responseString
         compoundId = datamodel.ReferenceCompoundId.parse(request.reference_id)
         referenceSet = self.getDataRepository().getReferenceSet(
             compoundId.reference_set_id)
@@ -648,11 +992,13 @@ class Backend(object):
         response.sequence = sequence
         if nextPageToken:
             response.next_page_token = nextPageToken
-        return protocol.toJson(response)
+        responseString = self._serializeResponse(response, responseMimetype)
+        self._cacheResponse(cacheKey, responseString)
+        return responseString
 
     # Get requests.
 
-    def runGetCallSet(self, id_):
+    def runGetCallSet(self, id_, mimetype=JSON_MIMETYPE):
         """
         Returns a callset with the given id
         """
@@ -660,14 +1006,14 @@ class Backend(object):
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         variantSet = dataset.getVariantSet(compoundId.variant_set_id)
         callSet = variantSet.getCallSet(id_)
-        return self.runGetRequest(callSet)
+        return self.runGetRequest(callSet, mimetype)
 
-    def runGetInfo(self, request):
+    def runGetInfo(self, request, mimetype=JSON_MIMETYPE):
         """
         Returns information about the service including protocol version.
         """
-        return protocol.toJson(protocol.GetInfoResponse(
-            protocol_version=protocol.version))
+        return self._serializeResponse(protocol.GetInfoResponse(
+            protocol_version=protocol.version), mimetype)
 
     def runAddAnnouncement(self, flaskrequest):
         """
@@ -710,7 +1056,9 @@ class Backend(object):
         return protocol.toJson(
             protocol.AnnouncePeerResponse(success=True))
 
-    def runListPeers(self, request):
+    def runListPeers(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Takes a ListPeersRequest and returns a ListPeersResponse using
         a page_token and page_size if provided.
@@ -719,9 +1067,10 @@ class Backend(object):
             request,
             protocol.ListPeersRequest,
             protocol.ListPeersResponse,
-            self.peersGenerator)
+            self.peersGenerator,
+            requestMimetype, responseMimetype)
 
-    def runGetVariant(self, id_):
+    def runGetVariant(self, id_, mimetype=JSON_MIMETYPE):
         """
         Returns a variant with the given id
         """
@@ -732,28 +1081,27 @@ class Backend(object):
         # TODO variant is a special case here, as it's returning a
         # protocol element rather than a datamodel object. We should
         # fix this for consistency.
-        jsonString = protocol.toJson(gaVariant)
-        return jsonString
+        return self._serializeResponse(gaVariant, mimetype)
 
-    def runGetBiosample(self, id_):
+    def runGetBiosample(self, id_, mimetype=JSON_MIMETYPE):
         """
         Runs a getBiosample request for the specified ID.
         """
         compoundId = datamodel.BiosampleCompoundId.parse(id_)
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         biosample = dataset.getBiosample(id_)
-        return self.runGetRequest(biosample)
+        return self.runGetRequest(biosample, mimetype)
 
-    def runGetIndividual(self, id_):
+    def runGetIndividual(self, id_, mimetype=JSON_MIMETYPE):
         """
         Runs a getIndividual request for the specified ID.
         """
         compoundId = datamodel.BiosampleCompoundId.parse(id_)
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         individual = dataset.getIndividual(id_)
-        return self.runGetRequest(individual)
+        return self.runGetRequest(individual, mimetype)
 
-    def runGetFeature(self, id_):
+    def runGetFeature(self, id_, mimetype=JSON_MIMETYPE):
         """
         Returns JSON string of the feature object corresponding to
         the feature compoundID passed in.
@@ -762,19 +1110,18 @@ class Backend(object):
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         featureSet = dataset.getFeatureSet(compoundId.feature_set_id)
         gaFeature = featureSet.getFeature(compoundId)
-        jsonString = protocol.toJson(gaFeature)
-        return jsonString
+        return self._serializeResponse(gaFeature, mimetype)
 
-    def runGetReadGroupSet(self, id_):
+    def runGetReadGroupSet(self, id_, mimetype=JSON_MIMETYPE):
         """
         Returns a readGroupSet with the given id_
         """
         compoundId = datamodel.ReadGroupSetCompoundId.parse(id_)
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         readGroupSet = dataset.getReadGroupSet(id_)
-        return self.runGetRequest(readGroupSet)
+        return self.runGetRequest(readGroupSet, mimetype)
 
-    def runGetReadGroup(self, id_):
+    def runGetReadGroup(self, id_, mimetype=JSON_MIMETYPE):
         """
         Returns a read group with the given id_
         """
@@ -782,9 +1129,9 @@ class Backend(object):
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         readGroupSet = dataset.getReadGroupSet(compoundId.read_group_set_id)
         readGroup = readGroupSet.getReadGroup(id_)
-        return self.runGetRequest(readGroup)
+        return self.runGetRequest(readGroup, mimetype)
 
-    def runGetReference(self, id_):
+    def runGetReference(self, id_, mimetype=JSON_MIMETYPE):
         """
         Runs a getReference request for the specified ID.
         """
@@ -792,50 +1139,50 @@ class Backend(object):
         referenceSet = self.getDataRepository().getReferenceSet(
             compoundId.reference_set_id)
         reference = referenceSet.getReference(id_)
-        return self.runGetRequest(reference)
+        return self.runGetRequest(reference, mimetype)
 
-    def runGetReferenceSet(self, id_):
+    def runGetReferenceSet(self, id_, mimetype=JSON_MIMETYPE):
         """
         Runs a getReferenceSet request for the specified ID.
         """
         referenceSet = self.getDataRepository().getReferenceSet(id_)
-        return self.runGetRequest(referenceSet)
+        return self.runGetRequest(referenceSet, mimetype)
 
-    def runGetVariantSet(self, id_):
+    def runGetVariantSet(self, id_, mimetype=JSON_MIMETYPE):
         """
         Runs a getVariantSet request for the specified ID.
         """
         compoundId = datamodel.VariantSetCompoundId.parse(id_)
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         variantSet = dataset.getVariantSet(id_)
-        return self.runGetRequest(variantSet)
+        return self.runGetRequest(variantSet, mimetype)
 
-    def runGetFeatureSet(self, id_):
+    def runGetFeatureSet(self, id_, mimetype=JSON_MIMETYPE):
         """
         Runs a getFeatureSet request for the specified ID.
         """
         compoundId = datamodel.FeatureSetCompoundId.parse(id_)
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         featureSet = dataset.getFeatureSet(id_)
-        return self.runGetRequest(featureSet)
+        return self.runGetRequest(featureSet, mimetype)
 
-    def runGetContinuousSet(self, id_):
+    def runGetContinuousSet(self, id_, mimetype=JSON_MIMETYPE):
         """
         Runs a getContinuousSet request for the specified ID.
         """
         compoundId = datamodel.ContinuousSetCompoundId.parse(id_)
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         continuousSet = dataset.getContinuousSet(id_)
-        return self.runGetRequest(continuousSet)
+        return self.runGetRequest(continuousSet, mimetype)
 
-    def runGetDataset(self, id_):
+    def runGetDataset(self, id_, mimetype=JSON_MIMETYPE):
         """
         Runs a getDataset request for the specified ID.
         """
         dataset = self.getDataRepository().getDataset(id_)
-        return self.runGetRequest(dataset)
+        return self.runGetRequest(dataset, mimetype)
 
-    def runGetVariantAnnotationSet(self, id_):
+    def runGetVariantAnnotationSet(self, id_, mimetype=JSON_MIMETYPE):
         """
         Runs a getVariantSet request for the specified ID.
         """
@@ -843,9 +1190,9 @@ class Backend(object):
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         variantSet = dataset.getVariantSet(compoundId.variant_set_id)
         variantAnnotationSet = variantSet.getVariantAnnotationSet(id_)
-        return self.runGetRequest(variantAnnotationSet)
+        return self.runGetRequest(variantAnnotationSet, mimetype)
 
-    def runGetRnaQuantification(self, id_):
+    def runGetRnaQuantification(self, id_, mimetype=JSON_MIMETYPE):
         """
         Runs a getRnaQuantification request for the specified ID.
         """
@@ -854,18 +1201,18 @@ class Backend(object):
         rnaQuantificationSet = dataset.getRnaQuantificationSet(
             compoundId.rna_quantification_set_id)
         rnaQuantification = rnaQuantificationSet.getRnaQuantification(id_)
-        return self.runGetRequest(rnaQuantification)
+        return self.runGetRequest(rnaQuantification, mimetype)
 
-    def runGetRnaQuantificationSet(self, id_):
+    def runGetRnaQuantificationSet(self, id_, mimetype=JSON_MIMETYPE):
         """
         Runs a getRnaQuantificationSet request for the specified ID.
         """
         compoundId = datamodel.RnaQuantificationSetCompoundId.parse(id_)
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         rnaQuantificationSet = dataset.getRnaQuantificationSet(id_)
-        return self.runGetRequest(rnaQuantificationSet)
+        return self.runGetRequest(rnaQuantificationSet, mimetype)
 
-    def runGetExpressionLevel(self, id_):
+    def runGetExpressionLevel(self, id_, mimetype=JSON_MIMETYPE):
         """
         Runs a getExpressionLevel request for the specified ID.
         """
@@ -876,119 +1223,227 @@ class Backend(object):
         rnaQuantification = rnaQuantificationSet.getRnaQuantification(
             compoundId.rna_quantification_id)
         expressionLevel = rnaQuantification.getExpressionLevel(compoundId)
-        return self.runGetRequest(expressionLevel)
+        return self.runGetRequest(expressionLevel, mimetype)
 
     # Search requests.
 
-    def runSearchReadGroupSets(self, request):
+    def runSearchReadGroupSets(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Runs the specified SearchReadGroupSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchReadGroupSetsRequest,
             protocol.SearchReadGroupSetsResponse,
-            self.readGroupSetsGenerator)
+            self.readGroupSetsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchIndividuals(self, request):
+    def runSearchIndividuals(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Runs the specified search SearchIndividualsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchIndividualsRequest,
             protocol.SearchIndividualsResponse,
-            self.individualsGenerator)
+            self.individualsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchBiosamples(self, request):
+    def runSearchBiosamples(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Runs the specified SearchBiosamplesRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchBiosamplesRequest,
             protocol.SearchBiosamplesResponse,
-            self.biosamplesGenerator)
-
-    def runSearchReads(self, request):
-        """
-        Runs the specified SearchReadsRequest.
-        """
+            self.biosamplesGenerator,
+            requestMimetype, responseMimetype)
+
+    def runSearchReads(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE, fields=None,
+            qualityEncoding=None, maxReadsPerWindow=None, windowSize=None):
+        """
+        Runs the specified SearchReadsRequest, returning only the specified
+        comma-separated list of the fields of the reads, if given. If a
+        qualityEncoding is given, the qualities of the reads are written
+        to JSON responses as strings in this encoding. If
+        maxReadsPerWindow is given, the reads are downsampled to at most
+        this many reads starting in each window of windowSize bases.
+        """
+        generatorArgs = {}
+        generatorKeys = []
+        if maxReadsPerWindow is not None:
+            readSampler = reads.ReadSampler(maxReadsPerWindow, windowSize)
+            generatorArgs["readSampler"] = readSampler
+            generatorKeys.append(readSampler.getKey())
+        if (qualityEncoding in response_builder.QUALITY_ENCODINGS and
+                responseMimetype == JSON_MIMETYPE):
+            # The qualities are encoded as the reads are converted, so
+            # they are never set in the ReadAlignments. Protobuf
+            # responses hold them as usual.
+            generatorArgs["qualityEncoding"] = qualityEncoding
+            generatorKeys.append(qualityEncoding)
+        readsGenerator = functools.partial(
+            self.readsGenerator, **generatorArgs)
+        generatorKey = ",".join(generatorKeys) or None
         return self.runSearchRequest(
             request, protocol.SearchReadsRequest,
             protocol.SearchReadsResponse,
-            self.readsGenerator)
-
-    def runSearchReferenceSets(self, request):
+            readsGenerator,
+            requestMimetype, responseMimetype, fields, qualityEncoding,
+            generatorKey)
+
+    def runReadsCoverage(
+            self, requestStr, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
+        """
+        Returns the binned coverage of the reads selected by the specified
+        JSON SearchReadsRequest, which may also hold the binSize of the
+        bins. The response is a JSON object holding the referenceId, the
+        start of the first bin, the binSize and the list of mean depths
+        of the bins.
+        """
+        if (requestMimetype != JSON_MIMETYPE or
+                responseMimetype != JSON_MIMETYPE):
+            raise exceptions.UnsupportedMediaTypeException()
+        try:
+            requestDict = json.loads(requestStr)
+            binSize = requestDict.pop("binSize", coverage.DEFAULT_BIN_SIZE)
+        except (ValueError, AttributeError):
+            raise exceptions.InvalidJsonException(requestStr)
+        request = self._parseRequest(
+            json.dumps(requestDict), protocol.SearchReadsRequest,
+            requestMimetype)
+        container, reference = self._getReadsSearchTarget(request)
+        start = request.start
+        end = request.end
+        if end == 0:
+            end = reference.getLength()
+        reference.checkQueryRange(start, end)
+        if (not isinstance(binSize, int) or isinstance(binSize, bool) or
+                binSize < 1):
+            raise exceptions.BadCoverageRequestException(
+                binSize, None, coverage.MAX_BINS)
+        numBins = (end - 1) // binSize - start // binSize + 1
+        if numBins > coverage.MAX_BINS:
+            raise exceptions.BadCoverageRequestException(
+                binSize, numBins, coverage.MAX_BINS)
+        binStart, depths = coverage.getBinnedCoverage(
+            container, reference, start, end, binSize,
+            self._coverageTileCache)
+        return json.dumps({
+            "referenceId": reference.getId(),
+            "start": binStart,
+            "binSize": binSize,
+            "depths": depths,
+        })
+
+    def runSearchReferenceSets(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Runs the specified SearchReferenceSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchReferenceSetsRequest,
             protocol.SearchReferenceSetsResponse,
-            self.referenceSetsGenerator)
+            self.referenceSetsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchReferences(self, request):
+    def runSearchReferences(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Runs the specified SearchReferenceRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchReferencesRequest,
             protocol.SearchReferencesResponse,
-            self.referencesGenerator)
+            self.referencesGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchVariantSets(self, request):
+    def runSearchVariantSets(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Runs the specified SearchVariantSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchVariantSetsRequest,
             protocol.SearchVariantSetsResponse,
-            self.variantSetsGenerator)
+            self.variantSetsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchVariantAnnotationSets(self, request):
+    def runSearchVariantAnnotationSets(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Runs the specified SearchVariantAnnotationSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchVariantAnnotationSetsRequest,
             protocol.SearchVariantAnnotationSetsResponse,
-            self.variantAnnotationSetsGenerator)
+            self.variantAnnotationSetsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchVariants(self, request):
+    def runSearchVariants(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE, fields=None):
         """
-        Runs the specified SearchVariantRequest.
+        Runs the specified SearchVariantRequest, returning only the
+        specified comma-separated list of the fields of the variants, if
+        given.
         """
         return self.runSearchRequest(
             request, protocol.SearchVariantsRequest,
             protocol.SearchVariantsResponse,
-            self.variantsGenerator)
+            self.variantsGenerator,
+            requestMimetype, responseMimetype, fields)
 
-    def runSearchVariantAnnotations(self, request):
+    def runSearchVariantAnnotations(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Runs the specified SearchVariantAnnotationsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchVariantAnnotationsRequest,
             protocol.SearchVariantAnnotationsResponse,
-            self.variantAnnotationsGenerator)
+            self.variantAnnotationsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchCallSets(self, request):
+    def runSearchCallSets(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Runs the specified SearchCallSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchCallSetsRequest,
             protocol.SearchCallSetsResponse,
-            self.callSetsGenerator)
+            self.callSetsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchDatasets(self, request):
+    def runSearchDatasets(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Runs the specified SearchDatasetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchDatasetsRequest,
             protocol.SearchDatasetsResponse,
-            self.datasetsGenerator)
+            self.datasetsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchFeatureSets(self, request):
+    def runSearchFeatureSets(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Returns a SearchFeatureSetsResponse for the specified
         SearchFeatureSetsRequest object.
@@ -996,9 +1451,12 @@ class Backend(object):
         return self.runSearchRequest(
             request, protocol.SearchFeatureSetsRequest,
             protocol.SearchFeatureSetsResponse,
-            self.featureSetsGenerator)
+            self.featureSetsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchFeatures(self, request):
+    def runSearchFeatures(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Returns a SearchFeaturesResponse for the specified
         SearchFeaturesRequest object.
@@ -1009,9 +1467,12 @@ class Backend(object):
         return self.runSearchRequest(
             request, protocol.SearchFeaturesRequest,
             protocol.SearchFeaturesResponse,
-            self.featuresGenerator)
+            self.featuresGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchContinuousSets(self, request):
+    def runSearchContinuousSets(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Returns a SearchContinuousSetsResponse for the specified
         SearchContinuousSetsRequest object.
@@ -1019,9 +1480,12 @@ class Backend(object):
         return self.runSearchRequest(
             request, protocol.SearchContinuousSetsRequest,
             protocol.SearchContinuousSetsResponse,
-            self.continuousSetsGenerator)
+            self.continuousSetsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchContinuous(self, request):
+    def runSearchContinuous(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Returns a SearchContinuousResponse for the specified
         SearchContinuousRequest object.
@@ -1032,27 +1496,39 @@ class Backend(object):
         return self.runSearchRequest(
             request, protocol.SearchContinuousRequest,
             protocol.SearchContinuousResponse,
-            self.continuousGenerator)
+            self.continuousGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchGenotypePhenotypes(self, request):
+    def runSearchGenotypePhenotypes(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         return self.runSearchRequest(
             request, protocol.SearchGenotypePhenotypeRequest,
             protocol.SearchGenotypePhenotypeResponse,
-            self.genotypesPhenotypesGenerator)
+            self.genotypesPhenotypesGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchPhenotypes(self, request):
+    def runSearchPhenotypes(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         return self.runSearchRequest(
             request, protocol.SearchPhenotypesRequest,
             protocol.SearchPhenotypesResponse,
-            self.phenotypesGenerator)
+            self.phenotypesGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchPhenotypeAssociationSets(self, request):
+    def runSearchPhenotypeAssociationSets(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         return self.runSearchRequest(
             request, protocol.SearchPhenotypeAssociationSetsRequest,
             protocol.SearchPhenotypeAssociationSetsResponse,
-            self.phenotypeAssociationSetsGenerator)
+            self.phenotypeAssociationSetsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchRnaQuantificationSets(self, request):
+    def runSearchRnaQuantificationSets(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Returns a SearchRnaQuantificationSetsResponse for the specified
         SearchRnaQuantificationSetsRequest object.
@@ -1060,9 +1536,12 @@ class Backend(object):
         return self.runSearchRequest(
             request, protocol.SearchRnaQuantificationSetsRequest,
             protocol.SearchRnaQuantificationSetsResponse,
-            self.rnaQuantificationSetsGenerator)
+            self.rnaQuantificationSetsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchRnaQuantifications(self, request):
+    def runSearchRnaQuantifications(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Returns a SearchRnaQuantificationResponse for the specified
         SearchRnaQuantificationRequest object.
@@ -1070,9 +1549,12 @@ class Backend(object):
         return self.runSearchRequest(
             request, protocol.SearchRnaQuantificationsRequest,
             protocol.SearchRnaQuantificationsResponse,
-            self.rnaQuantificationsGenerator)
+            self.rnaQuantificationsGenerator,
+            requestMimetype, responseMimetype)
 
-    def runSearchExpressionLevels(self, request):
+    def runSearchExpressionLevels(
+            self, request, requestMimetype=JSON_MIMETYPE,
+            responseMimetype=JSON_MIMETYPE):
         """
         Returns a SearchExpressionLevelResponse for the specified
         SearchExpressionLevelRequest object.
@@ -1080,4 +1562,5 @@ class Backend(object):
         return self.runSearchRequest(
             request, protocol.SearchExpressionLevelsRequest,
             protocol.SearchExpressionLevelsResponse,
-            self.expressionLevelsGenerator)
+            self.expressionLevelsGenerator,
+            requestMimetype, responseMimetype)
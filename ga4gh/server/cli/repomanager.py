@@ -7,7 +7,9 @@ from __future__ import unicode_literals
 
 import glob
 import json
+import multiprocessing
 import os
+import sqlite3
 import sys
 import textwrap
 import traceback
@@ -93,6 +95,12 @@ class RepoManager(object):
         finally:
             self._repo.close()
 
+    def _printReferenceProgress(self, referenceName, numDone, numReferences):
+        print(
+            "Computed the checksum of reference '{}' ({}/{})".format(
+                referenceName, numDone, numReferences),
+            file=sys.stderr)
+
     def _openRepo(self):
         if not self._repo.exists():
             raise exceptions.RepoManagerException(
@@ -186,7 +194,10 @@ class RepoManager(object):
         if name is None:
             name = getNameFromPath(self._args.filePath)
         referenceSet = references.HtslibReferenceSet(name)
-        referenceSet.populateFromFile(filePath)
+        referenceSet.populateFromFile(
+            filePath, self._args.numProcesses, self._printReferenceProgress)
+        if self._args.referenceStore:
+            referenceSet.compileReferenceStore()
         referenceSet.setDescription(self._args.description)
         if self._args.species is not None:
             referenceSet.setSpeciesFromJson(self._args.species)
@@ -225,6 +236,11 @@ class RepoManager(object):
             name = getNameFromPath(dataUrl)
         readGroupSet = reads.HtslibReadGroupSet(dataset, name)
         readGroupSet.populateFromFile(dataUrl, indexFile)
+        if self._args.coverageIndex:
+            if not os.path.exists(dataUrl):
+                raise exceptions.RepoManagerException(
+                    "The --coverageIndex option requires a local BAM file")
+            readGroupSet.buildCoverageIndex()
         referenceSetName = self._args.referenceSetName
         if referenceSetName is None:
             # Try to find a reference set name from the BAM header.
@@ -313,6 +329,25 @@ class RepoManager(object):
             for annotationSet in variantSet.getVariantAnnotationSets():
                 annotationSet.setOntology(ontology)
                 annotationSets.append(annotationSet)
+        if self._args.effectIndex:
+            if not self._args.addAnnotationSets:
+                raise exceptions.RepoManagerException(
+                    "The --effectIndex option requires --addAnnotationSets")
+            for annotationSet in annotationSets:
+                annotationSet.buildEffectIndexes()
+        if self._args.columnarStore is not None:
+            if len(annotationSets) > 0:
+                raise exceptions.RepoManagerException(
+                    "Annotated variant sets cannot be served from a "
+                    "columnar store")
+            directory = self._getFilePath(
+                self._args.columnarStore, self._args.relativePath)
+            variantSet.compileColumnarStore(directory)
+            columnarVariantSet = variants.ColumnarVariantSet(dataset, name)
+            columnarVariantSet.populateFromStore(directory)
+            columnarVariantSet.setReferenceSet(referenceSet)
+            columnarVariantSet.setAttributes(variantSet.getAttributes())
+            variantSet = columnarVariantSet
 
         # Add the annotation sets and the variant set as an atomic update
         def updateRepo():
@@ -430,6 +465,14 @@ class RepoManager(object):
         self._checkSequenceOntology(ontology)
         featureSet.setOntology(ontology)
         featureSet.populateFromFile(filePath)
+        if self._args.createPageIndex:
+            try:
+                featureSet.createPageIndex()
+            except sqlite3.OperationalError as error:
+                raise exceptions.RepoManagerException(
+                    "Could not index the features of '{}' for paging ({}); "
+                    "regenerate it with scripts/generate_gff3_db.py".format(
+                        filePath, error))
         featureSet.setAttributes(json.loads(self._args.attributes))
         self._updateRepo(self._repo.insertFeatureSet, featureSet)
 
@@ -903,6 +946,18 @@ class RepoManager(object):
         addReferenceSetParser.add_argument(
             "--sourceUri", default=None,
             help="The source URI")
+        addReferenceSetParser.add_argument(
+            "--numProcesses", type=int, default=multiprocessing.cpu_count(),
+            metavar="N",
+            help=(
+                "The number of processes computing the checksums of the "
+                "references (default: the number of CPUs)"))
+        addReferenceSetParser.add_argument(
+            "--referenceStore", action="store_true",
+            help=(
+                "Compile the bases of the FASTA file into a memory-mapped "
+                "reference store alongside it, from which reference bases "
+                "are served."))
 
         removeReferenceSetParser = common_cli.addSubparser(
             subparsers, "remove-referenceset",
@@ -936,6 +991,12 @@ class RepoManager(object):
                 "be automatically inferred by appending '.bai' to the "
                 "file name. If the dataFile is a remote URL the path to "
                 "a local file containing the BAM index must be provided"))
+        addReadGroupSetParser.add_argument(
+            "--coverageIndex", action="store_true",
+            help=(
+                "Build a coverage index alongside the local BAM file, so "
+                "that coverage requests need not read the BAM file, and "
+                "count the aligned reads of each read group."))
 
         addOntologyParser = common_cli.addSubparser(
             subparsers, "add-ontology",
@@ -1004,6 +1065,20 @@ class RepoManager(object):
             help=(
                 "If the supplied VCF file contains annotations, create the "
                 "corresponding VariantAnnotationSet."))
+        addVariantSetParser.add_argument(
+            "--effectIndex", action="store_true",
+            help=(
+                "Build an effect index alongside each annotated local VCF "
+                "file, so that searches for variant annotations filtered "
+                "by effect read only the matching records. Requires "
+                "--addAnnotationSets."))
+        addVariantSetParser.add_argument(
+            "--columnarStore", default=None, metavar="DIRECTORY",
+            help=(
+                "Compile the VCF files into a columnar store in the "
+                "specified directory, and serve the variant set from "
+                "this store rather than from the VCF files. Only the GT "
+                "and GL fields of the calls are kept."))
 
         removeVariantSetParser = common_cli.addSubparser(
             subparsers, "remove-variantset",
@@ -1028,6 +1103,13 @@ class RepoManager(object):
         cls.addReferenceSetNameOption(addFeatureSetParser, "feature set")
         cls.addSequenceOntologyNameOption(addFeatureSetParser, "feature set")
         cls.addClassNameOption(addFeatureSetParser, "feature set")
+        addFeatureSetParser.add_argument(
+            "--createPageIndex", action="store_true",
+            help=(
+                "Add the index used to page through feature searches to a "
+                "DB generated by an older version of "
+                "scripts/generate_gff3_db.py, which lacks it. The DB is "
+                "modified in place, and so must be writable."))
 
         removeFeatureSetParser = common_cli.addSubparser(
             subparsers, "remove-featureset",
@@ -0,0 +1,348 @@
+"""
+A columnar store of variant records, compiled from VCF files so that
+variants can be served without parsing the text of each record. The
+store is a directory holding a JSON manifest and, for each contig, a
+set of column files that are memory-mapped when read:
+
+- start, end: the 0-based coordinates of each record, as int32 values
+  sorted by start;
+- site.index, site: the offsets (uint64) and bytes of the serialised
+  site-level fields of each record;
+- genotype: the allele indexes of each call, as an int16 matrix of
+  records by samples by ploidy;
+- phased: whether each call is phased, as an int8 matrix of records by
+  samples;
+- likelihood: the genotype likelihoods of each call, as a float32
+  matrix of records by samples by number of likelihoods.
+
+Calls with fewer alleles or likelihoods than the width of the matrix
+are padded with GENOTYPE_PADDING and NaN respectively. All values are
+little-endian.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import math
+import mmap
+import os
+import struct
+
+
+FORMAT_VERSION = 2
+MANIFEST_FILE_NAME = "manifest.json"
+# The allele index padding the genotypes of calls of lower ploidy
+GENOTYPE_PADDING = -32768
+# The allele index of a missing allele in a genotype
+MISSING_ALLELE = -1
+
+_int32 = struct.Struct(str("<i"))
+_uint64 = struct.Struct(str("<Q"))
+
+
+def _getColumnPath(directory, prefix, column):
+    return os.path.join(directory, "{}.{}".format(prefix, column))
+
+
+def _packValues(code, values):
+    return struct.pack(str("<{}{}".format(len(values), code)), *values)
+
+
+class _Column(object):
+    """
+    A column file open for writing.
+    """
+    def __init__(self, path, code):
+        self._file = open(path, "wb")
+        self._code = code
+
+    def write(self, values):
+        self._file.write(_packValues(self._code, values))
+
+    def writeBytes(self, data):
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+
+class ColumnarStoreWriter(object):
+    """
+    Writes a columnar store into the specified directory, for the
+    specified list of sample names. Records are written one contig at a
+    time, in order of their start positions.
+    """
+    def __init__(self, directory, sampleNames, metadata=None):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._directory = directory
+        self._sampleNames = list(sampleNames)
+        self._metadata = metadata if metadata is not None else []
+        self._contigs = []
+        self._contig = None
+        self._columns = None
+
+    def beginContig(self, name, ploidy, numLikelihoods):
+        """
+        Starts the records of the specified contig, whose calls have at
+        most the specified numbers of alleles and likelihoods.
+        """
+        if self._contig is not None:
+            self.endContig()
+        prefix = "contig{}".format(len(self._contigs))
+        self._contig = {
+            "name": name, "prefix": prefix, "numRecords": 0,
+            "maxLength": 0, "maxEnd": 0, "ploidy": ploidy,
+            "numLikelihoods": numLikelihoods}
+        self._siteOffset = 0
+        self._lastStart = None
+        self._columns = {}
+        for column, code in [
+                ("start", "i"), ("end", "i"), ("site.index", "Q"),
+                ("site", None), ("genotype", "h"), ("phased", "b"),
+                ("likelihood", "f")]:
+            self._columns[column] = _Column(
+                _getColumnPath(self._directory, prefix, column), code)
+        self._columns["site.index"].write([0])
+
+    def addRecord(self, start, end, site, calls):
+        """
+        Adds a record with the specified coordinates and serialised site
+        fields, holding the specified list of (alleleIndexes, phased,
+        likelihoods) calls, one for each sample in order.
+        """
+        if self._lastStart is not None and start < self._lastStart:
+            raise ValueError(
+                "Records of contig '{}' are not sorted by start".format(
+                    self._contig["name"]))
+        if len(calls) != len(self._sampleNames):
+            raise ValueError("Expected one call for each sample")
+        self._lastStart = start
+        ploidy = self._contig["ploidy"]
+        numLikelihoods = self._contig["numLikelihoods"]
+        genotypes = []
+        phased = []
+        likelihoods = []
+        for alleleIndexes, isPhased, callLikelihoods in calls:
+            genotypes.extend(
+                MISSING_ALLELE if index is None else index
+                for index in alleleIndexes)
+            genotypes.extend(
+                [GENOTYPE_PADDING] * (ploidy - len(alleleIndexes)))
+            phased.append(1 if isPhased else 0)
+            likelihoods.extend(
+                float("nan") if value is None else value
+                for value in callLikelihoods)
+            likelihoods.extend(
+                [float("nan")] * (numLikelihoods - len(callLikelihoods)))
+        self._columns["start"].write([start])
+        self._columns["end"].write([end])
+        self._columns["site"].writeBytes(site)
+        self._siteOffset += len(site)
+        self._columns["site.index"].write([self._siteOffset])
+        self._columns["genotype"].write(genotypes)
+        self._columns["phased"].write(phased)
+        self._columns["likelihood"].write(likelihoods)
+        self._contig["numRecords"] += 1
+        self._contig["maxLength"] = max(
+            self._contig["maxLength"], end - start)
+        self._contig["maxEnd"] = max(self._contig["maxEnd"], end)
+
+    def endContig(self):
+        """
+        Finishes the records of the current contig.
+        """
+        for column in self._columns.values():
+            column.close()
+        self._contigs.append(self._contig)
+        self._contig = None
+        self._columns = None
+
+    def close(self):
+        """
+        Finishes the store by writing its manifest.
+        """
+        if self._contig is not None:
+            self.endContig()
+        manifest = {
+            "formatVersion": FORMAT_VERSION,
+            "sampleNames": self._sampleNames,
+            "metadata": self._metadata,
+            "contigs": self._contigs,
+        }
+        path = os.path.join(self._directory, MANIFEST_FILE_NAME)
+        with open(path, "w") as manifestFile:
+            json.dump(manifest, manifestFile, indent=1)
+
+
+class ColumnarContig(object):
+    """
+    The memory-mapped columns of the records of a contig in a columnar
+    store.
+    """
+    def __init__(self, directory, description, numSamples):
+        self._directory = directory
+        self._prefix = description["prefix"]
+        self._numRecords = description["numRecords"]
+        self._maxLength = description["maxLength"]
+        self._maxEnd = description["maxEnd"]
+        self._ploidy = description["ploidy"]
+        self._numLikelihoods = description["numLikelihoods"]
+        self._numSamples = numSamples
+        self._maps = {}
+        # The values of one sample within a record, and the sizes of the
+        # rows of values of each record.
+        self._genotypeCall = struct.Struct(str("<{}h".format(self._ploidy)))
+        self._phasedCall = struct.Struct(str("<b"))
+        self._likelihoodCall = struct.Struct(str("<{}f".format(
+            self._numLikelihoods)))
+        self._genotypeRowSize = numSamples * self._genotypeCall.size
+        self._phasedRowSize = numSamples * self._phasedCall.size
+        self._likelihoodRowSize = numSamples * self._likelihoodCall.size
+
+    def _getMap(self, column):
+        """
+        Returns the memory map of the specified column, which is mapped
+        on first use.
+        """
+        columnMap = self._maps.get(column)
+        if columnMap is None:
+            path = _getColumnPath(self._directory, self._prefix, column)
+            with open(path, "rb") as columnFile:
+                if os.fstat(columnFile.fileno()).st_size == 0:
+                    columnMap = b""
+                else:
+                    columnMap = mmap.mmap(
+                        columnFile.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[column] = columnMap
+        return columnMap
+
+    def getNumRecords(self):
+        return self._numRecords
+
+    def getMaxEnd(self):
+        """
+        Returns the greatest end position of the records of this contig.
+        """
+        return self._maxEnd
+
+    def getStart(self, index):
+        return _int32.unpack_from(self._getMap("start"), index * 4)[0]
+
+    def getEnd(self, index):
+        return _int32.unpack_from(self._getMap("end"), index * 4)[0]
+
+    def _bisectStart(self, position):
+        """
+        Returns the index of the first record starting at or after the
+        specified position.
+        """
+        low, high = 0, self._numRecords
+        while low < high:
+            middle = (low + high) // 2
+            if self.getStart(middle) < position:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def getRecordIndexes(self, start, end):
+        """
+        Returns an iterator over the indexes of the records overlapping
+        the interval [start, end), in order of their start positions.
+        """
+        # No record starting more than maxLength before the interval
+        # can overlap it.
+        index = self._bisectStart(start - self._maxLength)
+        while index < self._numRecords:
+            if self.getStart(index) >= end:
+                break
+            if self.getEnd(index) > start:
+                yield index
+            index += 1
+
+    def getSite(self, index):
+        """
+        Returns the serialised site fields of the specified record.
+        """
+        siteIndex = self._getMap("site.index")
+        begin = _uint64.unpack_from(siteIndex, index * 8)[0]
+        end = _uint64.unpack_from(siteIndex, index * 8 + 8)[0]
+        return self._getMap("site")[begin:end]
+
+    def getCalls(self, index, sampleIndexes):
+        """
+        Returns the list of (alleleIndexes, phased, likelihoods) calls of
+        the specified record for the samples at the specified indexes.
+        """
+        genotypeMap = self._getMap("genotype")
+        phasedMap = self._getMap("phased")
+        likelihoodMap = self._getMap("likelihood")
+        genotypeOffset = index * self._genotypeRowSize
+        phasedOffset = index * self._phasedRowSize
+        likelihoodOffset = index * self._likelihoodRowSize
+        calls = []
+        for sampleIndex in sampleIndexes:
+            alleleIndexes = [
+                alleleIndex for alleleIndex in self._genotypeCall.unpack_from(
+                    genotypeMap,
+                    genotypeOffset + sampleIndex * self._genotypeCall.size)
+                if alleleIndex != GENOTYPE_PADDING]
+            phased = self._phasedCall.unpack_from(
+                phasedMap, phasedOffset + sampleIndex)[0]
+            callLikelihoods = list(self._likelihoodCall.unpack_from(
+                likelihoodMap,
+                likelihoodOffset + sampleIndex * self._likelihoodCall.size))
+            while len(callLikelihoods) > 0 and math.isnan(
+                    callLikelihoods[-1]):
+                callLikelihoods.pop()
+            calls.append((alleleIndexes, phased == 1, callLikelihoods))
+        return calls
+
+
+class ColumnarStore(object):
+    """
+    A columnar store of variant records read from the specified
+    directory.
+    """
+    def __init__(self, directory):
+        path = os.path.join(directory, MANIFEST_FILE_NAME)
+        with open(path) as manifestFile:
+            manifest = json.load(manifestFile)
+        if manifest["formatVersion"] != FORMAT_VERSION:
+            raise ValueError(
+                "Unsupported columnar store version {} in '{}'".format(
+                    manifest["formatVersion"], directory))
+        self._directory = directory
+        self._sampleNames = manifest["sampleNames"]
+        self._metadata = manifest["metadata"]
+        self._contigs = {}
+        self._contigNames = []
+        for description in manifest["contigs"]:
+            self._contigNames.append(description["name"])
+            self._contigs[description["name"]] = ColumnarContig(
+                directory, description, len(self._sampleNames))
+
+    def getDirectory(self):
+        return self._directory
+
+    def getSampleNames(self):
+        return self._sampleNames
+
+    def getMetadata(self):
+        """
+        Returns the list of JSON dicts describing the metadata of the
+        variant set this store was compiled from.
+        """
+        return self._metadata
+
+    def getContigNames(self):
+        return self._contigNames
+
+    def getContig(self, name):
+        """
+        Returns the ColumnarContig of the specified name, or None if there
+        are no records for it in this store.
+        """
+        return self._contigs.get(name)
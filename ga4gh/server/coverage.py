@@ -0,0 +1,91 @@
+"""
+Binned read depth over regions of reference, for clients that draw the
+coverage of a read group set without downloading its reads. When an
+on-disk cache shared between requests and server processes is
+configured, the depths are computed and cached in tiles of
+BINS_PER_TILE bins, aligned to the start of the reference; otherwise
+only the bins overlapping each request are computed.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from werkzeug.contrib.cache import FileSystemCache
+
+
+BINS_PER_TILE = 1024
+DEFAULT_BIN_SIZE = 100
+# The largest number of bins returned for a request
+MAX_BINS = 100000
+
+
+class CoverageTileCache(object):
+    """
+    An on-disk cache of the depths of coverage tiles, holding up to
+    maxTiles tiles in the specified directory. Tiles are keyed by the
+    path and modification time of the alignment file they were computed
+    from, and so are never stale.
+    """
+    def __init__(self, directory, maxTiles):
+        if maxTiles <= 0:
+            raise ValueError(
+                "The size of the cache must be a strictly positive value")
+        self._cache = FileSystemCache(
+            directory, threshold=maxTiles, default_timeout=0)
+
+    def get(self, key):
+        """
+        Returns the list of depths cached under the specified key, or
+        None if there is no such tile.
+        """
+        return self._cache.get(key)
+
+    def set(self, key, depths):
+        self._cache.set(key, depths)
+
+
+def getTileKey(readGroupContainer, reference, binSize, tileIndex):
+    """
+    Returns the key identifying the specified tile of the coverage of the
+    specified read group or read group set in the tile cache.
+    """
+    return "{}:{}:{}:{}".format(
+        readGroupContainer.getCoverageSourceKey(), reference.getLocalId(),
+        binSize, tileIndex)
+
+
+def getBinnedCoverage(
+        readGroupContainer, reference, start, end, binSize, tileCache=None):
+    """
+    Returns the (binStart, depths) pair giving the mean depths of the
+    reads of the specified read group or read group set in the bins of
+    binSize bases overlapping the interval [start, end) of the specified
+    reference, where binStart is the start of the first bin. Bins are
+    aligned to the start of the reference, and the last bin is truncated
+    at the end of the reference. Tiles are read from and written to the
+    specified tileCache, if given; without a cache, only the bins
+    overlapping the interval are computed.
+    """
+    binStart = start - start % binSize
+    if tileCache is None:
+        binEnd = min(
+            ((end - 1) // binSize + 1) * binSize, reference.getLength())
+        return binStart, readGroupContainer.getBinnedCoverage(
+            reference, binStart, binEnd, binSize)
+    tileSize = binSize * BINS_PER_TILE
+    firstTileIndex = start // tileSize
+    lastTileIndex = (end - 1) // tileSize
+    depths = []
+    for tileIndex in range(firstTileIndex, lastTileIndex + 1):
+        key = getTileKey(readGroupContainer, reference, binSize, tileIndex)
+        tile = tileCache.get(key)
+        if tile is None:
+            tileStart = tileIndex * tileSize
+            tileEnd = min(tileStart + tileSize, reference.getLength())
+            tile = readGroupContainer.getBinnedCoverage(
+                reference, tileStart, tileEnd, binSize)
+            tileCache.set(key, tile)
+        depths.extend(tile)
+    firstBin = start // binSize - firstTileIndex * BINS_PER_TILE
+    lastBin = (end - 1) // binSize - firstTileIndex * BINS_PER_TILE
+    return binStart, depths[firstBin:lastBin + 1]
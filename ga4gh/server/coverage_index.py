@@ -0,0 +1,312 @@
+"""
+A precomputed index of the read depth of an alignment file, built when a
+read group set is added to the repository so that coverage queries over
+whole references need not read the alignments. The index is a single
+file written next to the alignment file, holding for each reference,
+read group and bin size of a pyramid of bin sizes the mean depths of the
+bins as little-endian float32 values, followed by a JSON description of
+their layout and a fixed-size trailer:
+
+- the bins of each reference are aligned to its start, and the last bin
+  is truncated at its end;
+- only the span of bins from the first to the last bin holding aligned
+  bases is stored, and the depths of the other bins are zero;
+- the trailer holds TRAILER_MAGIC and the offset of the JSON description
+  as a uint64.
+
+Depths count every aligned base (CIGAR M, = and X operations) of the
+reads that are mapped, primary, not duplicates and passing quality
+checks.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+
+
+FORMAT_VERSION = 1
+# Suffix added to the path of an alignment file to give the path of its
+# coverage index.
+COVERAGE_INDEX_SUFFIX = ".coverage"
+DEFAULT_BIN_SIZES = (16, 1024, 65536)
+TRAILER_MAGIC = b"GA4GHCOV"
+# The key of the depths of all the reads in the file, whatever their
+# read group.
+ALL_READS = ""
+
+_trailer = struct.Struct(str("<8sQ"))
+
+
+def getCoverageIndexPath(dataUrl):
+    """
+    Returns the path of the coverage index of the specified alignment
+    file.
+    """
+    return dataUrl + COVERAGE_INDEX_SUFFIX
+
+
+def getFileStamp(dataUrl):
+    """
+    Returns a string identifying the current version of the specified
+    alignment file.
+    """
+    stat = os.stat(dataUrl)
+    return "{}:{}".format(stat.st_size, int(stat.st_mtime))
+
+
+def _getNumBins(length, binSize):
+    return (length + binSize - 1) // binSize
+
+
+class CoverageIndexWriter(object):
+    """
+    Writes the coverage index of the specified alignment file, for the
+    specified list of read group names, to the specified path. The
+    aligned blocks of the reads are added one reference at a time, and
+    bin sizes must each be a multiple of the previous one. The index is
+    written to a temporary file that replaces any existing index when it
+    is closed, so that servers holding the existing index open keep
+    reading it.
+    """
+    def __init__(self, path, dataUrl, readGroupNames,
+                 binSizes=DEFAULT_BIN_SIZES):
+        for smaller, larger in zip(binSizes, binSizes[1:]):
+            if larger % smaller != 0:
+                raise ValueError(
+                    "Each bin size must be a multiple of the previous one")
+        self._path = path
+        self._file = open(path + ".tmp", "wb")
+        self._offset = 0
+        self._fileStamp = getFileStamp(dataUrl)
+        self._binSizes = list(binSizes)
+        self._readGroupKeys = [ALL_READS] + list(readGroupNames)
+        self._readCounts = dict(
+            (key, [0, 0]) for key in self._readGroupKeys)
+        self._references = {}
+        self._referenceName = None
+        self._baseCounts = None
+        self._spans = None
+
+    def beginReference(self, name, length):
+        """
+        Starts the reads of the specified reference.
+        """
+        if self._referenceName is not None:
+            self.endReference()
+        if name in self._references:
+            raise ValueError(
+                "The reads of reference '{}' are not contiguous".format(name))
+        self._referenceName = name
+        self._referenceLength = length
+        numBins = _getNumBins(length, self._binSizes[0])
+        self._baseCounts = dict(
+            (key, array.array(str("I"), [0]) * numBins)
+            for key in self._readGroupKeys)
+        # The [first, last] bins holding aligned bases of each read group
+        self._spans = {}
+
+    def hasReference(self, name):
+        """
+        Returns True if the depths of the specified reference have been
+        added to this index.
+        """
+        return name in self._references or name == self._referenceName
+
+    def addRead(self, readGroupName, blocks):
+        """
+        Adds the aligned bases of a mapped read of the current reference,
+        given as the list of its (start, end) aligned blocks, to the depths
+        of all the reads and of the specified read group, which may be None
+        if the read has no known read group.
+        """
+        binSize = self._binSizes[0]
+        keys = [ALL_READS]
+        if readGroupName is not None and readGroupName in self._baseCounts:
+            keys.append(readGroupName)
+        for key in keys:
+            baseCounts = self._baseCounts[key]
+            for start, end in blocks:
+                end = min(end, self._referenceLength)
+                if start >= end:
+                    continue
+                span = self._spans.setdefault(
+                    key, [start // binSize, (end - 1) // binSize])
+                span[0] = min(span[0], start // binSize)
+                span[1] = max(span[1], (end - 1) // binSize)
+                while start < end:
+                    binEnd = min((start // binSize + 1) * binSize, end)
+                    baseCounts[start // binSize] += binEnd - start
+                    start = binEnd
+
+    def countRead(self, readGroupName, aligned):
+        """
+        Counts an aligned or unaligned read of the specified read group
+        in the read statistics of the index.
+        """
+        index = 0 if aligned else 1
+        self._readCounts[ALL_READS][index] += 1
+        if readGroupName is not None and readGroupName in self._readCounts:
+            self._readCounts[readGroupName][index] += 1
+
+    def endReference(self):
+        """
+        Writes the depths of the current reference.
+        """
+        length = self._referenceLength
+        minBinSize = self._binSizes[0]
+        levels = {}
+        for key, (firstBin, lastBin) in self._spans.items():
+            baseCounts = self._baseCounts[key]
+            levels[key] = []
+            for binSize in self._binSizes:
+                ratio = binSize // minBinSize
+                first = firstBin // ratio
+                depths = array.array(str("f"))
+                for index in range(first, lastBin // ratio + 1):
+                    binStart = index * binSize
+                    count = sum(baseCounts[index * ratio:(index + 1) * ratio])
+                    depths.append(
+                        count / (min(binStart + binSize, length) - binStart))
+                if sys.byteorder == "big":
+                    depths.byteswap()
+                depths.tofile(self._file)
+                levels[key].append([self._offset, first, len(depths)])
+                self._offset += 4 * len(depths)
+        self._references[self._referenceName] = {
+            "length": length, "levels": levels}
+        self._referenceName = None
+        self._baseCounts = None
+        self._spans = None
+
+    def close(self):
+        """
+        Finishes the index by writing its description and trailer.
+        """
+        if self._referenceName is not None:
+            self.endReference()
+        description = {
+            "formatVersion": FORMAT_VERSION,
+            "fileStamp": self._fileStamp,
+            "binSizes": self._binSizes,
+            "readGroups": self._readGroupKeys,
+            "readCounts": self._readCounts,
+            "references": self._references,
+        }
+        self._file.write(json.dumps(description).encode("utf-8"))
+        self._file.write(_trailer.pack(TRAILER_MAGIC, self._offset))
+        self._file.close()
+        os.rename(self._file.name, self._path)
+
+
+class CoverageIndex(object):
+    """
+    The memory-mapped coverage index read from the specified path.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as indexFile:
+            size = os.fstat(indexFile.fileno()).st_size
+            if size < _trailer.size:
+                raise ValueError("Invalid coverage index '{}'".format(path))
+            self._map = mmap.mmap(
+                indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, offset = _trailer.unpack_from(self._map, size - _trailer.size)
+        if magic != TRAILER_MAGIC:
+            raise ValueError("Invalid coverage index '{}'".format(path))
+        description = json.loads(
+            self._map[offset:size - _trailer.size].decode("utf-8"))
+        if description["formatVersion"] != FORMAT_VERSION:
+            raise ValueError(
+                "Unsupported coverage index version {} in '{}'".format(
+                    description["formatVersion"], path))
+        self._fileStamp = description["fileStamp"]
+        self._binSizes = description["binSizes"]
+        self._readGroupKeys = description["readGroups"]
+        self._readCounts = description["readCounts"]
+        self._references = description["references"]
+
+    def close(self):
+        self._map.close()
+
+    def isCurrent(self, dataUrl):
+        """
+        Returns True if this index was built from the current version of
+        the specified alignment file.
+        """
+        return self._fileStamp == getFileStamp(dataUrl)
+
+    def getBinSizes(self):
+        return self._binSizes
+
+    def getReadCounts(self, readGroupName=None):
+        """
+        Returns the (aligned, unaligned) numbers of reads of the specified
+        read group, or of the whole file if readGroupName is None.
+        """
+        key = ALL_READS if readGroupName is None else readGroupName
+        aligned, unaligned = self._readCounts[key]
+        return aligned, unaligned
+
+    def _getDepths(self, readGroupName, referenceName, binSize, first, last):
+        """
+        Returns the list of the mean depths of the bins of the specified
+        size with indexes in [first, last) of the specified reference.
+        """
+        key = ALL_READS if readGroupName is None else readGroupName
+        levels = self._references[referenceName]["levels"].get(key)
+        depths = [0] * (last - first)
+        if levels is None:
+            return depths
+        offset, spanFirst, spanLength = levels[self._binSizes.index(binSize)]
+        begin = max(first, spanFirst)
+        end = min(last, spanFirst + spanLength)
+        if begin < end:
+            depths[begin - first:end - first] = struct.unpack_from(
+                str("<{}f".format(end - begin)), self._map,
+                offset + 4 * (begin - spanFirst))
+        return depths
+
+    def getBinnedCoverage(
+            self, readGroupName, referenceName, start, end, binSize):
+        """
+        Returns the list of the mean depths of the reads of the specified
+        read group, or of the whole file if readGroupName is None, in the
+        bins of binSize bases covering the interval [start, end) of the
+        specified reference. Returns None if the depths cannot be computed
+        from the bins of this index, which is the case unless binSize is
+        a multiple of one of its bin sizes and the interval is aligned to
+        its bins.
+        """
+        key = ALL_READS if readGroupName is None else readGroupName
+        if (key not in self._readGroupKeys or
+                referenceName not in self._references):
+            return None
+        length = self._references[referenceName]["length"]
+        if end > length:
+            return None
+        levelBinSize = None
+        for size in self._binSizes:
+            if (binSize % size == 0 and start % size == 0 and
+                    (end % size == 0 or end == length)):
+                levelBinSize = size
+        if levelBinSize is None:
+            return None
+        first = start // levelBinSize
+        levelDepths = self._getDepths(
+            readGroupName, referenceName, levelBinSize, first,
+            _getNumBins(end, levelBinSize))
+        depths = []
+        for binStart in range(start, end, binSize):
+            binEnd = min(binStart + binSize, end)
+            count = 0
+            for levelBinStart in range(binStart, binEnd, levelBinSize):
+                levelBinEnd = min(levelBinStart + levelBinSize, length)
+                count += levelDepths[levelBinStart // levelBinSize - first] * (
+                    levelBinEnd - levelBinStart)
+            depths.append(count / (binEnd - binStart))
+        return depths
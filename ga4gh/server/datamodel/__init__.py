@@ -31,6 +31,13 @@ class PysamFileHandleCache(object):
         self._memoTable = dict()
         # Initialize the value even if it will be set up by the config
         self._maxCacheSize = 50
+        self._hitCount = 0
+        self._missCount = 0
+        self._evictionCount = 0
+        # The numbers of live cursors reading from each handle, keyed by
+        # the id of the handle, and the evicted handles they keep open.
+        self._pinCounts = dict()
+        self._evictedHandles = dict()
 
     def setMaxCacheSize(self, size):
         """
@@ -62,9 +69,33 @@ class PysamFileHandleCache(object):
         Returns the name of the file that has been removed.
         """
         (dataFile, handle) = self._cache.pop()
-        handle.close()
+        if id(handle) in self._pinCounts:
+            # Cursors that are suspended between pages are still reading
+            # from the handle, which is closed when the last one unpins it.
+            self._evictedHandles[id(handle)] = handle
+        else:
+            handle.close()
         return dataFile
 
+    def pin(self, handle):
+        """
+        Marks the specified handle as being read by a cursor, so that it
+        is not closed when it is evicted until the cursor unpins it.
+        """
+        self._pinCounts[id(handle)] = self._pinCounts.get(id(handle), 0) + 1
+
+    def unpin(self, handle):
+        """
+        Releases a pin on the specified handle, closing it if it has been
+        evicted and no other cursor is reading from it.
+        """
+        count = self._pinCounts.pop(id(handle)) - 1
+        if count > 0:
+            self._pinCounts[id(handle)] = count
+        elif id(handle) in self._evictedHandles:
+            del self._evictedHandles[id(handle)]
+            handle.close()
+
     def getFileHandle(self, dataFile, openMethod):
         """
         Returns handle associated to the filename. If the file is
@@ -73,10 +104,12 @@ class PysamFileHandleCache(object):
         it in the cache and return the corresponding handle.
         """
         if dataFile in self._memoTable:
+            self._hitCount += 1
             handle = self._memoTable[dataFile]
             self._update(dataFile, handle)
             return handle
         else:
+            self._missCount += 1
             try:
                 handle = openMethod(dataFile)
             except ValueError:
@@ -87,8 +120,21 @@ class PysamFileHandleCache(object):
             if len(self._memoTable) > self._maxCacheSize:
                 dataFile = self._removeLru()
                 del self._memoTable[dataFile]
+                self._evictionCount += 1
             return handle
 
+    def getNumHandles(self):
+        return len(self._memoTable)
+
+    def getHitCount(self):
+        return self._hitCount
+
+    def getMissCount(self):
+        return self._missCount
+
+    def getEvictionCount(self):
+        return self._evictionCount
+
 
 # LRU cache of open file handles
 fileHandleCache = PysamFileHandleCache()
@@ -652,3 +698,28 @@ class PysamDatamodelMixin(object):
 
     def getFileHandle(self, dataFile):
         return fileHandleCache.getFileHandle(dataFile, self.openFile)
+
+    @classmethod
+    def iterateWithFilePosition(cls, fileHandle, cursor):
+        """
+        Returns an iterator over (record, position) pairs from the specified
+        cursor over the specified file handle, where position is the file
+        position immediately following the record. The file position is
+        restored before each read, so that the cursor can be suspended
+        while other queries use the same cached file handle, and the handle
+        is pinned in the file handle cache until the iterator is exhausted
+        or closed.
+        """
+        fileHandleCache.pin(fileHandle)
+        try:
+            position = None
+            while True:
+                if position is not None and fileHandle.tell() != position:
+                    fileHandle.seek(position)
+                record = next(cursor, None)
+                if record is None:
+                    break
+                position = fileHandle.tell()
+                yield record, position
+        finally:
+            fileHandleCache.unpin(fileHandle)
@@ -195,7 +195,9 @@ class BigWigDataSource:
             return False
         return True
 
-    def readValuesPyBigWig(self, reference, start, end):
+    def readValuesPyBigWig(
+            self, reference, start, end, resumePosition=None,
+            maxResults=None):
         """
         Use pyBigWig package to read a BigWig file for the
         given range and return a protocol object.
@@ -209,6 +211,11 @@ class BigWigDataSource:
         reference range. This function checks the query range
         and throws its own exceptions to avoid the ones thrown
         by pyBigWig.
+
+        If resumePosition is given, reading starts from that position
+        rather than from start. If maxResults is given, at most that
+        many protocol objects are produced, and no values beyond the
+        last of them are read.
         """
         if not self.checkReference(reference):
             raise exceptions.ReferenceNameNotFoundException(reference)
@@ -223,29 +230,38 @@ class BigWigDataSource:
         if start >= end:
             raise exceptions.ReferenceRangeErrorException(
                 reference, start, end)
+        if resumePosition is not None:
+            start = max(start, resumePosition)
 
+        numResults = 0
         data = protocol.Continuous()
         curStart = start
         curEnd = curStart + self._INCREMENT
-        while curStart < end:
-            if curEnd > end:
-                curEnd = end
-            for i, val in enumerate(bw.values(reference, curStart, curEnd)):
-                if not math.isnan(val):
-                    if len(data.values) == 0:
-                        data.start = curStart + i
-                    data.values.append(val)
-                    if len(data.values) == self._MAX_VALUES:
+        try:
+            while curStart < end:
+                if curEnd > end:
+                    curEnd = end
+                values = bw.values(reference, curStart, curEnd)
+                for i, val in enumerate(values):
+                    if not math.isnan(val):
+                        if len(data.values) == 0:
+                            data.start = curStart + i
+                        data.values.append(val)
+                        if len(data.values) == self._MAX_VALUES:
+                            yield data
+                            numResults += 1
+                            data = protocol.Continuous()
+                    elif len(data.values) > 0:
+                        # data.values.append(float('NaN'))
                         yield data
+                        numResults += 1
                         data = protocol.Continuous()
-                elif len(data.values) > 0:
-                    # data.values.append(float('NaN'))
-                    yield data
-                    data = protocol.Continuous()
-            curStart = curEnd
-            curEnd = curStart + self._INCREMENT
-
-        bw.close()
+                    if numResults == maxResults:
+                        return
+                curStart = curEnd
+                curEnd = curStart + self._INCREMENT
+        finally:
+            bw.close()
         if len(data.values) > 0:
             yield data
 
@@ -290,9 +306,12 @@ class BigWigDataSource:
 
         return wiggleReader.getData()
 
-    def bigWigToProtocol(self, reference, start, end):
+    def bigWigToProtocol(
+            self, reference, start, end, resumePosition=None,
+            maxResults=None):
         # return self.readValuesBigWigToWig(reference, start, end)
-        for continuousObj in self.readValuesPyBigWig(reference, start, end):
+        for continuousObj in self.readValuesPyBigWig(
+                reference, start, end, resumePosition, maxResults):
             yield continuousObj
 
 
@@ -369,7 +388,9 @@ class FileContinuousSet(AbstractContinuousSet):
         """
         return self._filePath
 
-    def getContinuous(self, referenceName=None, start=None, end=None):
+    def getContinuous(
+            self, referenceName=None, start=None, end=None,
+            resumePosition=None, maxResults=None):
         """
         Method passed to runSearchRequest to fulfill the request to
         yield continuous protocol objects that satisfy the given query.
@@ -377,11 +398,15 @@ class FileContinuousSet(AbstractContinuousSet):
         :param str referenceName: name of reference (ex: "chr1")
         :param start: castable to int, start position on reference
         :param end: castable to int, end position on reference
+        :param resumePosition: position on reference to resume reading
+            from, or None to read from start
+        :param maxResults: maximum number of objects to yield, or None
+            for no limit
         :return: yields a protocol.Continuous at a time
         """
         bigWigReader = BigWigDataSource(self._filePath)
         for continuousObj in bigWigReader.bigWigToProtocol(
-                                            referenceName, start, end):
+                referenceName, start, end, resumePosition, maxResults):
             yield continuousObj
 
 
@@ -140,7 +140,8 @@ class PhenotypeAssociationFeatureSet(
     def getFeatures(self, referenceName=None, start=None, end=None,
                     startIndex=None, maxResults=None,
                     featureTypes=None, parentId=None,
-                    name=None, geneSymbol=None, numFeatures=10):
+                    name=None, geneSymbol=None, numFeatures=10,
+                    lastKey=None):
 
         # query to do search
         query = self._filterSearchFeaturesRequest(
@@ -111,6 +111,16 @@ class Ontology(object):
         """
         return self._nameIdMap[termName]
 
+    def getTermNamesByIds(self, termIds):
+        """
+        Returns the set of term names for which getGaTermByName returns a
+        term with one of the specified IDs.
+        """
+        termIds = set(termIds)
+        return set(
+            name for name, ids in self._nameIdMap.items()
+            if len(ids) > 0 and ids[0] in termIds)
+
     def getGaTermByName(self, name):
         """
         Returns a GA4GH OntologyTerm object by name.
@@ -7,15 +7,21 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import functools
+import heapq
 import json
 import os.path
 import random
+import zlib
 
 import pysam
 
+import ga4gh.server.coverage_index as coverage_index
 import ga4gh.server.datamodel as datamodel
 import ga4gh.server.datamodel.references as references
 import ga4gh.server.exceptions as exceptions
+import ga4gh.server.response_builder as response_builder
+import ga4gh.server.timing as timing
 
 import ga4gh.schemas.pb as pb
 import ga4gh.schemas.protocol as protocol
@@ -57,6 +63,10 @@ class SamCigar(object):
         protocol.CigarUnit.SEQUENCE_MATCH,
         protocol.CigarUnit.SEQUENCE_MISMATCH,
     ]
+    # The operations (as pysam integers) that consume reference bases,
+    # and those whose reference bases are given in their CIGAR units.
+    referenceConsumingOperations = frozenset([0, 2, 3, 7, 8])
+    referenceSequenceOperations = frozenset([0, 2, 7, 8])
 
     @classmethod
     def ga2int(cls, value):
@@ -85,6 +95,10 @@ class SamFlags(object):
     FAILED_QUALITY_CHECK = 0x200
     DUPLICATE_READ = 0x400
     SUPPLEMENTARY_ALIGNMENT = 0x800
+    # The reads that are not counted in coverage
+    COVERAGE_EXCLUDED = (
+        READ_UNMAPPED | SECONDARY_ALIGNMENT | FAILED_QUALITY_CHECK |
+        DUPLICATE_READ)
 
     @staticmethod
     def isFlagSet(flagAttr, flag):
@@ -95,15 +109,159 @@ class SamFlags(object):
         return flagAttr | flag
 
 
+class ReadSampler(object):
+    """
+    Downsamples reads to at most maxReadsPerWindow reads starting in
+    each window of windowSize bases, for clients that only draw the
+    reads. The reads kept in a window are those with the smallest hashes
+    of their names, so that the sample is a deterministic function of
+    the window: searches starting anywhere in it, and the pages of a
+    search, agree on the reads kept.
+    """
+    defaultWindowSize = 50
+
+    def __init__(self, maxReadsPerWindow, windowSize=None):
+        if windowSize is None:
+            windowSize = self.defaultWindowSize
+        if maxReadsPerWindow < 1 or windowSize < 1:
+            raise exceptions.BadReadSamplingException(
+                maxReadsPerWindow, windowSize)
+        self._maxReadsPerWindow = maxReadsPerWindow
+        self._windowSize = windowSize
+
+    def getKey(self):
+        """
+        Returns a string identifying the parameters of this sampler.
+        """
+        return "{}:{}".format(self._maxReadsPerWindow, self._windowSize)
+
+    @staticmethod
+    def hashName(name):
+        """
+        Returns the hash of the specified read name.
+        """
+        return zlib.crc32(name.encode("utf-8")) & 0xffffffff
+
+    @classmethod
+    def hashRead(cls, read):
+        """
+        Returns the hash of the name of the specified pysam read.
+        """
+        return cls.hashName(read.query_name)
+
+    def _getWindowStart(self, position):
+        return position - position % self._windowSize
+
+    def _addToReservoir(self, reservoir, readHash, index, item):
+        """
+        Adds the specified item, the index-th of a window with the
+        specified hash, to the specified reservoir of the items kept in
+        the window, which is a heap whose root is the kept item with the
+        greatest (hash, index).
+        """
+        entry = (-readHash, -index, item)
+        if len(reservoir) < self._maxReadsPerWindow:
+            heapq.heappush(reservoir, entry)
+        elif entry > reservoir[0]:
+            heapq.heapreplace(reservoir, entry)
+
+    @staticmethod
+    def _drainReservoir(reservoir):
+        """
+        Returns the list of the items kept in the specified reservoir,
+        in the order they were added to it.
+        """
+        return [
+            item for _, _, item in sorted(
+                reservoir, key=lambda entry: entry[1], reverse=True)]
+
+    def sampleWindow(self, items, getHash):
+        """
+        Returns the list of the specified items of a single window that
+        are kept, in order, where getHash returns the hash of an item.
+        """
+        reservoir = []
+        for index, item in enumerate(items):
+            self._addToReservoir(reservoir, getHash(item), index, item)
+        return self._drainReservoir(reservoir)
+
+    def sample(self, getReads, start, end):
+        """
+        Returns an iterator over the sampled (read, readGroupId) pairs
+        overlapping the interval [start, end). The getReads function
+        returns an iterator over the (read, readGroupId) pairs
+        overlapping the interval given by its arguments, in order of
+        their start positions. After a probe for the first read
+        overlapping the interval, the reads are read in a single pass
+        from the start of its window to the end of the last window, and
+        only the reservoir of the reads kept in the current window is
+        held in memory. The reads that are dropped are never converted.
+        """
+        # The first window holds the first read overlapping the start of
+        # the search. Reads of the first and last windows that do not
+        # overlap the search are read so that they are counted in the
+        # sample of their window, but are not returned.
+        firstPair = next(iter(getReads(start, end)), None)
+        if firstPair is None or firstPair[0].reference_start >= end:
+            return
+        windowStart = self._getWindowStart(firstPair[0].reference_start)
+        windowEnd = windowStart + self._windowSize
+        reservoir = []
+        lastWindowEnd = min(
+            self._getWindowStart(end - 1) + self._windowSize,
+            datamodel.PysamDatamodelMixin.samMaxEnd)
+        pairs = getReads(windowStart, lastWindowEnd)
+        for index, pair in enumerate(pairs):
+            read = pair[0]
+            if read.reference_start < windowStart:
+                continue
+            if read.reference_start >= windowEnd:
+                for keptPair in self._drainReservoir(reservoir):
+                    if self._overlaps(keptPair[0], start, end):
+                        yield keptPair
+                if read.reference_start >= end:
+                    return
+                reservoir = []
+                windowStart = self._getWindowStart(read.reference_start)
+                windowEnd = windowStart + self._windowSize
+            self._addToReservoir(
+                reservoir, self.hashRead(read), index, pair)
+        for keptPair in self._drainReservoir(reservoir):
+            if self._overlaps(keptPair[0], start, end):
+                yield keptPair
+
+    @staticmethod
+    def _overlaps(read, start, end):
+        """
+        Returns True if the specified pysam read overlaps the interval
+        [start, end).
+        """
+        readEnd = read.reference_end
+        if readEnd is None:
+            readEnd = read.reference_start + 1
+        return read.reference_start < end and readEnd > start
+
+
 class AlignmentDataMixin(datamodel.PysamDatamodelMixin):
     """
     Mixin class that provides methods for getting read alignments
     from bam files
     """
+    # The largest number of bases counted by pysam at a time when
+    # computing coverage.
+    coverageChunkSize = 1024 * 1024
+
     def _getReadAlignments(
-            self, reference, start, end, readGroupSet, readGroup):
+            self, reference, start, end, readGroupSet, readGroup,
+            fieldMask=None, referenceWindow=None, readSampler=None,
+            qualityEncoding=None):
         """
-        Returns an iterator over the specified reads
+        Returns an iterator over the specified reads. Fields that are not
+        in the specified fieldMask may be left unset. If a referenceWindow
+        is given, the reference bases of CIGAR units are read from it. If
+        a readSampler is given, only the reads it keeps are returned. If a
+        qualityEncoding is given, the reads are returned as
+        EncodedQualitiesValues, as by convertReadAlignment.
         """
         # TODO If reference is None, return against all references,
         # including unmapped reads.
@@ -111,38 +269,157 @@ class AlignmentDataMixin(datamodel.PysamDatamodelMixin):
         referenceName = reference.getLocalId().encode()
         # TODO deal with errors from htslib
         start, end = self.sanitizeAlignmentFileFetch(start, end)
-        readAlignments = samFile.fetch(referenceName, start, end)
-        for readAlignment in readAlignments:
-            tags = dict(readAlignment.tags)
+        getReads = functools.partial(
+            self._getReadGroupReads, samFile, referenceName, readGroupSet,
+            readGroup)
+        if readSampler is None:
+            pairs = getReads(start, end)
+        else:
+            pairs = readSampler.sample(
+                getReads, start if start is not None else self.samMin,
+                end if end is not None else self.samMaxEnd)
+        for readAlignment, readGroupId in pairs:
+            with timing.stage("convert"):
+                alignment = self.convertReadAlignment(
+                    readAlignment, readGroupSet, readGroupId, fieldMask,
+                    referenceWindow, qualityEncoding)
+            yield alignment
+
+    def _getReadGroupReads(
+            self, samFile, referenceName, readGroupSet, readGroup, start,
+            end):
+        """
+        Returns an iterator over the (pysam read, readGroupId) pairs of
+        the reads of the specified read group, or of the whole read group
+        set if it is None, overlapping the specified interval.
+        """
+        cursor = samFile.fetch(referenceName, start, end)
+        if readGroup is not None:
+            readGroupId = str(readGroup.getCompoundId())
+        # The read group IDs of the RG tags found when reading the whole
+        # read group set.
+        readGroupIds = {}
+        for readAlignment, _ in self.iterateWithFilePosition(samFile, cursor):
+            # Only the RG tag is decoded before the read is known to be
+            # wanted; the other tags are decoded on conversion.
+            alignmentReadGroupLocalId = self._getReadGroupTag(readAlignment)
             if readGroup is None:
-                if 'RG' in tags:
-                    alignmentReadGroupLocalId = tags['RG']
-                    readGroupCompoundId = datamodel.ReadGroupCompoundId(
+                readGroupId = readGroupIds.get(alignmentReadGroupLocalId)
+                if readGroupId is None:
+                    readGroupId = str(datamodel.ReadGroupCompoundId(
                         readGroupSet.getCompoundId(),
-                        str(alignmentReadGroupLocalId))
-                yield self.convertReadAlignment(
-                    readAlignment, readGroupSet, str(readGroupCompoundId))
-            else:
-                if self._filterReads:
-                    if 'RG' in tags and tags['RG'] == self._localId:
-                        yield self.convertReadAlignment(
-                            readAlignment, readGroupSet,
-                            str(readGroup.getCompoundId()))
-                else:
-                    yield self.convertReadAlignment(
-                        readAlignment, readGroupSet,
-                        str(readGroup.getCompoundId()))
-
-    def convertReadAlignment(self, read, readGroupSet, readGroupId):
+                        str(alignmentReadGroupLocalId)))
+                    readGroupIds[alignmentReadGroupLocalId] = readGroupId
+            elif (self._filterReads and
+                    alignmentReadGroupLocalId != self._localId):
+                continue
+            yield readAlignment, readGroupId
+
+    def _getBinnedCoverage(
+            self, reference, start, end, binSize, readGroupLocalId):
+        """
+        Returns the list of the mean depths of the reads in the bins of
+        binSize bases covering the interval [start, end) of the specified
+        reference, counting only the reads with the specified RG tag if
+        it is not None. The depths are read from the coverage index of the
+        file if it can provide them, and are otherwise counted by pysam,
+        without converting the reads.
+        """
+        depths = self._getIndexedCoverage(
+            reference, start, end, binSize, readGroupLocalId)
+        if depths is not None:
+            return depths
+        samFile = self.getFileHandle(self._dataUrl)
+        referenceName = reference.getLocalId().encode()
+        readCallback = "all"
+        if readGroupLocalId is not None:
+            def isCountedRead(read):
+                return (
+                    read.flag & SamFlags.COVERAGE_EXCLUDED == 0 and
+                    self._getReadGroupTag(read) == readGroupLocalId)
+            readCallback = isCountedRead
+        length = end - start
+        binStarts = range(0, length, binSize)
+        counts = [0] * len(binStarts)
+        # The bases are counted by pysam in chunks of at most
+        # coverageChunkSize bases, whatever the size of the bins, so that
+        # its per-base arrays stay small. The counts of each chunk are
+        # summed a slice per bin, so that the positions are only iterated
+        # over by the builtin sum.
+        for chunkStart in range(0, length, self.coverageChunkSize):
+            chunkEnd = min(chunkStart + self.coverageChunkSize, length)
+            baseCounts = samFile.count_coverage(
+                referenceName, start + chunkStart, start + chunkEnd,
+                quality_threshold=0, read_callback=readCallback)
+            firstBin = chunkStart // binSize
+            lastBin = (chunkEnd - 1) // binSize
+            for positionCounts in baseCounts:
+                for index in range(firstBin, lastBin + 1):
+                    counts[index] += sum(positionCounts[
+                        max(index * binSize, chunkStart) - chunkStart:
+                        min((index + 1) * binSize, chunkEnd) - chunkStart])
+        return [
+            count / (min(binStart + binSize, length) - binStart)
+            for binStart, count in zip(binStarts, counts)]
+
+    def _getIndexedCoverage(
+            self, reference, start, end, binSize, readGroupLocalId):
+        """
+        Returns the depths of _getBinnedCoverage read from the coverage
+        index of the alignment file, or None if there is no current index
+        or its bins do not fit the request.
+        """
+        coverageIndex = self.getCoverageIndex()
+        if coverageIndex is None:
+            return None
+        return coverageIndex.getBinnedCoverage(
+            readGroupLocalId, reference.getLocalId(), start, end, binSize)
+
+    def _getCoverageSourceKey(self, readGroupLocalId):
+        """
+        Returns a string identifying the alignment file, as modified, and
+        the RG tag from which coverage is computed.
+        """
+        return "{}:{}:{}".format(
+            self._dataUrl, os.path.getmtime(self._dataUrl),
+            readGroupLocalId if readGroupLocalId is not None else "")
+
+    def _getReadGroupTag(self, read):
+        """
+        Returns the value of the RG tag of the specified pysam read, or
+        the name of the default read group if it has no such tag.
         """
-        Convert a pysam ReadAlignment to a GA4GH ReadAlignment
+        try:
+            return read.get_tag('RG')
+        except KeyError:
+            return HtslibReadGroupSet.defaultReadGroupName
+
+    def convertReadAlignment(
+            self, read, readGroupSet, readGroupId, fieldMask=None,
+            referenceWindow=None, qualityEncoding=None):
+        """
+        Convert a pysam ReadAlignment to a GA4GH ReadAlignment. If a
+        fieldMask is given, the qualities and tags of the read are only
+        decoded if they are in it. If a referenceWindow is given, the
+        reference bases of the match and deletion CIGAR units are read
+        from it. If a qualityEncoding is given, the qualities of the read
+        are encoded directly from those of the pysam read rather than set
+        in the GA4GH ReadAlignment, which is returned in an
+        EncodedQualitiesValue holding them.
         """
         samFile = self.getFileHandle(self._dataUrl)
         # TODO fill out remaining fields
         # TODO refine in tandem with code in converters module
         ret = protocol.ReadAlignment()
         # ret.fragmentId = 'TODO'
-        ret.aligned_quality.extend(read.query_qualities)
+        encodedQualities = None
+        if fieldMask is None or "aligned_quality" in fieldMask:
+            qualities = read.query_qualities
+            if qualityEncoding is None:
+                ret.aligned_quality.extend(qualities)
+            elif qualities is not None:
+                encodedQualities = response_builder.encodeQualities(
+                    qualities, qualityEncoding)
         ret.aligned_sequence = read.query_sequence
         if SamFlags.isFlagSet(read.flag, SamFlags.READ_UNMAPPED):
             ret.ClearField("alignment")
@@ -156,22 +433,32 @@ class AlignmentDataMixin(datamodel.PysamDatamodelMixin):
             ret.alignment.position.strand = protocol.POS_STRAND
             if SamFlags.isFlagSet(read.flag, SamFlags.READ_REVERSE_STRAND):
                 ret.alignment.position.strand = protocol.NEG_STRAND
+            referencePosition = read.reference_start
             for operation, length in read.cigar:
                 gaCigarUnit = ret.alignment.cigar.add()
                 gaCigarUnit.operation = SamCigar.int2ga(operation)
                 gaCigarUnit.operation_length = length
-                gaCigarUnit.reference_sequence = ""  # TODO fix this!
+                if (referenceWindow is not None and operation in
+                        SamCigar.referenceSequenceOperations):
+                    gaCigarUnit.reference_sequence = referenceWindow.getBases(
+                        referencePosition, referencePosition + length)
+                else:
+                    gaCigarUnit.reference_sequence = ""
+                if operation in SamCigar.referenceConsumingOperations:
+                    referencePosition += length
         ret.duplicate_fragment = SamFlags.isFlagSet(
             read.flag, SamFlags.DUPLICATE_READ)
         ret.failed_vendor_quality_checks = SamFlags.isFlagSet(
             read.flag, SamFlags.FAILED_QUALITY_CHECK)
         ret.fragment_length = read.template_length
         ret.fragment_name = read.query_name
-        for key, value in read.tags:
-            # Useful for inspecting the structure of read tags
-            # print("{key} {ktype}: {value}, {vtype}".format(
-            #     key=key, ktype=type(key), value=value, vtype=type(value)))
-            protocol.setAttribute(ret.attributes.attr[key].values, value)
+        if fieldMask is None or "attributes" in fieldMask:
+            for key, value in read.tags:
+                # Useful for inspecting the structure of read tags
+                # print("{key} {ktype}: {value}, {vtype}".format(
+                #     key=key, ktype=type(key), value=value,
+                #     vtype=type(value)))
+                protocol.setAttribute(ret.attributes.attr[key].values, value)
 
         if SamFlags.isFlagSet(read.flag, SamFlags.MATE_UNMAPPED):
             ret.next_mate_position.Clear()
@@ -206,6 +493,9 @@ class AlignmentDataMixin(datamodel.PysamDatamodelMixin):
         ret.supplementary_alignment = SamFlags.isFlagSet(
             read.flag, SamFlags.SUPPLEMENTARY_ALIGNMENT)
         ret.id = readGroupSet.getReadAlignmentId(ret)
+        if qualityEncoding is not None:
+            return response_builder.EncodedQualitiesValue(
+                ret, encodedQualities)
         return ret
 
     def openFile(self, dataFile):
@@ -330,6 +620,23 @@ class AbstractReadGroupSet(datamodel.DatamodelObject):
         stats.unaligned_read_count = self._numUnalignedReads
         return stats
 
+    def getBinnedCoverage(self, reference, start, end, binSize):
+        """
+        Returns the list of the mean depths of the reads of this read
+        group set in the bins of binSize bases covering the interval
+        [start, end) of the specified reference.
+        """
+        raise exceptions.NotImplementedException(
+            "Coverage is not available for this read group set")
+
+    def getCoverageSourceKey(self):
+        """
+        Returns a string identifying the data the coverage of this read
+        group set is computed from, which changes when the data changes.
+        """
+        raise exceptions.NotImplementedException(
+            "Coverage is not available for this read group set")
+
 
 class SimulatedReadGroupSet(AbstractReadGroupSet):
     """
@@ -353,9 +660,13 @@ class SimulatedReadGroupSet(AbstractReadGroupSet):
     def getPrograms(self):
         return []
 
-    def getReadAlignments(self, referenceId=None, start=None, end=None):
+    def getReadAlignments(
+            self, referenceId=None, start=None, end=None, fieldMask=None,
+            referenceWindow=None, readSampler=None, qualityEncoding=None):
         for readGroup in self.getReadGroups():
-            iterator = readGroup.getReadAlignments(referenceId, start, end)
+            iterator = readGroup.getReadAlignments(
+                referenceId, start, end, fieldMask, referenceWindow,
+                readSampler, qualityEncoding)
             for alignment in iterator:
                 yield alignment
 
@@ -374,12 +685,101 @@ class HtslibReadGroupSet(AlignmentDataMixin, AbstractReadGroupSet):
         # Used when we populate from a file. Not defined when we populate
         # from the DB.
         self._bamHeaderReferenceSetName = None
+        self._coverageIndex = None
+        self._coverageIndexStat = None
 
-    def getReadAlignments(self, reference, start=None, end=None):
+    def getReadAlignments(
+            self, reference, start=None, end=None, fieldMask=None,
+            referenceWindow=None, readSampler=None, qualityEncoding=None):
         """
         Returns an iterator over the specified reads
         """
-        return self._getReadAlignments(reference, start, end, self, None)
+        return self._getReadAlignments(
+            reference, start, end, self, None, fieldMask, referenceWindow,
+            readSampler, qualityEncoding)
+
+    def getBinnedCoverage(self, reference, start, end, binSize):
+        return self._getBinnedCoverage(reference, start, end, binSize, None)
+
+    def getCoverageSourceKey(self):
+        return self._getCoverageSourceKey(None)
+
+    def getCoverageIndex(self):
+        """
+        Returns the memory-mapped coverage index of the alignment file of
+        this read group set, or None if it has no current index. The
+        index is kept open until the index file is replaced, so that each
+        call only costs a stat of the index and of the alignment file. An
+        index file that cannot be read is ignored.
+        """
+        indexPath = coverage_index.getCoverageIndexPath(self._dataUrl)
+        try:
+            stat = os.stat(indexPath)
+            indexStat = (stat.st_ino, stat.st_size, stat.st_mtime)
+        except OSError:
+            indexStat = None
+        if indexStat != self._coverageIndexStat:
+            if self._coverageIndex is not None:
+                self._coverageIndex.close()
+                self._coverageIndex = None
+            self._coverageIndexStat = indexStat
+            if indexStat is not None:
+                try:
+                    self._coverageIndex = coverage_index.CoverageIndex(
+                        indexPath)
+                except (ValueError, KeyError):
+                    self._coverageIndex = None
+        if (self._coverageIndex is None or
+                not self._coverageIndex.isCurrent(self._dataUrl)):
+            return None
+        return self._coverageIndex
+
+    def buildCoverageIndex(self):
+        """
+        Builds the coverage index of the alignment file of this read group
+        set in a single pass over its reads, and sets the numbers of
+        aligned and unaligned reads of its read groups from the counts of
+        the index.
+        """
+        indexPath = coverage_index.getCoverageIndexPath(self._dataUrl)
+        readGroupNames = [
+            readGroup.getLocalId() for readGroup in self.getReadGroups()
+            if readGroup.getLocalId() != self.defaultReadGroupName]
+        writer = coverage_index.CoverageIndexWriter(
+            indexPath, self._dataUrl, readGroupNames)
+        # A new handle is used so that we read the file from its start
+        # rather than from wherever the cached handle was left.
+        samFile = pysam.AlignmentFile(self._dataUrl)
+        try:
+            referenceId = None
+            for read in samFile.fetch(until_eof=True):
+                readGroupName = self._getReadGroupTag(read)
+                writer.countRead(readGroupName, not read.is_unmapped)
+                if read.flag & SamFlags.COVERAGE_EXCLUDED != 0:
+                    continue
+                if read.reference_id != referenceId:
+                    referenceId = read.reference_id
+                    writer.beginReference(
+                        samFile.getrname(referenceId),
+                        samFile.lengths[referenceId])
+                writer.addRead(readGroupName, read.get_blocks())
+            # References without reads are indexed with zero depths.
+            for name, length in zip(samFile.references, samFile.lengths):
+                if not writer.hasReference(name):
+                    writer.beginReference(name, length)
+        finally:
+            samFile.close()
+        writer.close()
+        coverageIndex = coverage_index.CoverageIndex(indexPath)
+        try:
+            for readGroup in self.getReadGroups():
+                readGroupName = readGroup.getLocalId()
+                if readGroupName == self.defaultReadGroupName:
+                    readGroupName = None
+                readGroup.setReadCounts(
+                    *coverageIndex.getReadCounts(readGroupName))
+        finally:
+            coverageIndex.close()
 
     def getBamHeaderReferenceSetName(self):
         """
@@ -530,6 +930,23 @@ class AbstractReadGroup(datamodel.DatamodelObject):
         # TODO base_count requires iterating through all reads
         return stats
 
+    def getBinnedCoverage(self, reference, start, end, binSize):
+        """
+        Returns the list of the mean depths of the reads of this read
+        group in the bins of binSize bases covering the interval
+        [start, end) of the specified reference.
+        """
+        raise exceptions.NotImplementedException(
+            "Coverage is not available for this read group")
+
+    def getCoverageSourceKey(self):
+        """
+        Returns a string identifying the data the coverage of this read
+        group is computed from, which changes when the data changes.
+        """
+        raise exceptions.NotImplementedException(
+            "Coverage is not available for this read group")
+
     def getExperiment(self):
         """
         Returns the GA4GH protocol representation of this read group's
@@ -644,7 +1061,16 @@ class SimulatedReadGroup(AbstractReadGroup):
         self._numAlignedReads = self._parentContainer.getNumAlignedReads()
         self._numUnalignedReads = 0
 
-    def getReadAlignments(self, referenceId=None, start=None, end=None):
+    def getReadAlignments(
+            self, referenceId=None, start=None, end=None, fieldMask=None,
+            referenceWindow=None, readSampler=None, qualityEncoding=None):
+        """
+        Returns an iterator over the simulated reads, which are the same
+        whatever the reference and interval. The reads have no CIGAR
+        units, so the referenceWindow is unused. All of the reads start
+        at position 0, in the first window of a readSampler, which keeps
+        those with the smallest hashes of their fragment names.
+        """
         rng = random.Random(self._randomSeed)
 
         # We seed reads with sequential seeds starting from here. We hope no
@@ -652,9 +1078,25 @@ class SimulatedReadGroup(AbstractReadGroup):
         # then we'd start seeing identical reads in the two groups.)
         read_seed_start = rng.getrandbits(64)
 
-        for i in range(self.getNumAlignedReads()):
-            seed = read_seed_start + i
-            yield self._createReadAlignment(i, seed)
+        alignments = (
+            self._createReadAlignment(i, read_seed_start + i)
+            for i in range(self.getNumAlignedReads()))
+        if readSampler is not None:
+            alignments = readSampler.sampleWindow(
+                alignments, lambda alignment: ReadSampler.hashName(
+                    alignment.fragment_name))
+        for alignment in alignments:
+            if fieldMask is not None and "aligned_quality" not in fieldMask:
+                alignment.ClearField("aligned_quality")
+            if qualityEncoding is not None:
+                encodedQualities = None
+                if len(alignment.aligned_quality) > 0:
+                    encodedQualities = response_builder.encodeQualities(
+                        alignment.aligned_quality, qualityEncoding)
+                alignment.ClearField("aligned_quality")
+                alignment = response_builder.EncodedQualitiesValue(
+                    alignment, encodedQualities)
+            yield alignment
 
     def _createReadAlignment(self, i, seed):
         # TODO fill out a bit more
@@ -738,6 +1180,14 @@ class HtslibReadGroup(AlignmentDataMixin, AbstractReadGroup):
         self._numAlignedReads = -1  # TODO populate with metadata
         self._numUnalignedReads = -1  # TODO populate with metadata
 
+    def setReadCounts(self, numAlignedReads, numUnalignedReads):
+        """
+        Sets the numbers of aligned and unaligned reads of this read
+        group, as counted when building the coverage index of its file.
+        """
+        self._numAlignedReads = numAlignedReads
+        self._numUnalignedReads = numUnalignedReads
+
     def populateFromHeader(self, readGroupHeader):
         """
         Populate the instance variables using the specified SAM header.
@@ -773,12 +1223,38 @@ class HtslibReadGroup(AlignmentDataMixin, AbstractReadGroup):
         self._platformUnit = experiment.platform_unit
         self._runTime = experiment.run_time
 
-    def getReadAlignments(self, reference, start=None, end=None):
+    def getReadAlignments(
+            self, reference, start=None, end=None, fieldMask=None,
+            referenceWindow=None, readSampler=None, qualityEncoding=None):
         """
         Returns an iterator over the specified reads
         """
         return self._getReadAlignments(
-            reference, start, end, self._parentContainer, self)
+            reference, start, end, self._parentContainer, self, fieldMask,
+            referenceWindow, readSampler, qualityEncoding)
+
+    def _getCoverageReadGroupTag(self):
+        """
+        Returns the RG tag of the reads counted in the coverage of this
+        read group, or None if all the reads of the file are counted.
+        """
+        if self._filterReads:
+            return self._localId
+        return None
+
+    def getBinnedCoverage(self, reference, start, end, binSize):
+        return self._getBinnedCoverage(
+            reference, start, end, binSize, self._getCoverageReadGroupTag())
+
+    def getCoverageSourceKey(self):
+        return self._getCoverageSourceKey(self._getCoverageReadGroupTag())
+
+    def getCoverageIndex(self):
+        """
+        Returns the coverage index of the read group set of this read
+        group, which is shared by all of its read groups.
+        """
+        return self._parentContainer.getCoverageIndex()
 
     def getPrograms(self):
         return self._parentContainer.getPrograms()
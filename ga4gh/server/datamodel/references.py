@@ -8,12 +8,15 @@ from __future__ import unicode_literals
 
 import hashlib
 import json
+import multiprocessing
+import os.path
 import random
 
 import pysam
 
 import ga4gh.server.datamodel as datamodel
 import ga4gh.server.exceptions as exceptions
+import ga4gh.server.reference_store as reference_store
 
 import ga4gh.schemas.pb as pb
 import ga4gh.schemas.protocol as protocol
@@ -381,6 +384,38 @@ class AbstractReference(datamodel.DatamodelObject):
         """
         raise NotImplemented()
 
+
+class ReferenceWindow(object):
+    """
+    A window of the bases of the specified reference, held in memory so
+    that the bases under many nearby reads are read from the reference
+    once. The window is moved when bases outside it are requested, and
+    then holds at least windowSize bases.
+    """
+    windowSize = 64 * 1024
+
+    def __init__(self, reference):
+        self._reference = reference
+        self._start = 0
+        self._end = 0
+        self._bases = ""
+
+    def getBases(self, start, end):
+        """
+        Returns the bases of the reference from start (inclusive) to end
+        (exclusive), truncated at the end of the reference.
+        """
+        end = min(end, self._reference.getLength())
+        if start >= end:
+            return ""
+        if start < self._start or end > self._end:
+            self._start = start
+            self._end = min(
+                max(end, start + self.windowSize),
+                self._reference.getLength())
+            self._bases = self._reference.getBases(self._start, self._end)
+        return self._bases[start - self._start:end - self._start]
+
 ##################################################################
 #
 # Simulated references
@@ -452,29 +487,79 @@ class SimulatedReference(AbstractReference):
 ##################################################################
 
 
+def _getReferenceChecksum(args):
+    """
+    Returns the (referenceName, md5checksum, length) triple of the bases
+    of the specified reference in the specified FASTA file, which are
+    read chunkSize bases at a time up to the indexed length of the
+    reference. This is run in the worker processes of
+    HtslibReferenceSet.populateFromFile, and so opens its own handle.
+    """
+    dataUrl, referenceName, indexedLength, chunkSize = args
+    fastaFile = pysam.FastaFile(dataUrl)
+    try:
+        md5 = hashlib.md5()
+        length = 0
+        for start in range(0, indexedLength, chunkSize):
+            bases = fastaFile.fetch(referenceName, start, start + chunkSize)
+            md5.update(bases)
+            length += len(bases)
+    finally:
+        fastaFile.close()
+    return referenceName, md5.hexdigest(), length
+
+
 class HtslibReferenceSet(datamodel.PysamDatamodelMixin, AbstractReferenceSet):
     """
     A referenceSet based on data on a file system
     """
+    # The number of bases read from the FASTA file at a time when
+    # computing checksums and compiling the reference store.
+    fastaChunkSize = 1024 * 1024
+
     def __init__(self, localId):
         super(HtslibReferenceSet, self).__init__(localId)
         self._dataUrl = None
+        self._referenceStore = None
+        self._referenceStoreStat = None
 
-    def populateFromFile(self, dataUrl):
+    def populateFromFile(self, dataUrl, numProcesses=1, progress=None):
         """
         Populates the instance variables of this ReferencSet from the
-        data URL.
+        data URL. The checksums of the references are computed by
+        numProcesses worker processes, streaming the bases of each
+        reference in chunks. If given, progress is called with the name
+        of each reference when its checksum is computed, and the numbers
+        of references done and in total.
         """
         self._dataUrl = dataUrl
         fastaFile = self.getFastaFile()
-        for referenceName in fastaFile.references:
+        referenceNames = list(fastaFile.references)
+        tasks = [
+            (dataUrl, referenceName, indexedLength, self.fastaChunkSize)
+            for referenceName, indexedLength in zip(
+                referenceNames, fastaFile.lengths)]
+        pool = None
+        if numProcesses > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(numProcesses, len(tasks)))
+            results = pool.imap_unordered(_getReferenceChecksum, tasks)
+        else:
+            results = (_getReferenceChecksum(task) for task in tasks)
+        checksums = {}
+        try:
+            for referenceName, md5checksum, length in results:
+                checksums[referenceName] = md5checksum, length
+                if progress is not None:
+                    progress(referenceName, len(checksums), len(tasks))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        for referenceName in referenceNames:
             reference = HtslibReference(self, referenceName)
-            # TODO break this up into chunks and calculate the MD5
-            # in bits (say, 64K chunks?)
-            bases = fastaFile.fetch(referenceName)
-            md5checksum = hashlib.md5(bases).hexdigest()
+            md5checksum, length = checksums[referenceName]
             reference.setMd5checksum(md5checksum)
-            reference.setLength(len(bases))
+            reference.setLength(length)
             self.addReference(reference)
 
     def populateFromRow(self, referenceSetRecord):
@@ -510,6 +595,55 @@ class HtslibReferenceSet(datamodel.PysamDatamodelMixin, AbstractReferenceSet):
         """
         return self.getFileHandle(self._dataUrl)
 
+    def compileReferenceStore(self):
+        """
+        Writes the bases of the FASTA file of this reference set into its
+        reference store, from which they are then served.
+        """
+        fastaFile = pysam.FastaFile(self._dataUrl)
+        writer = reference_store.ReferenceStoreWriter(
+            reference_store.getReferenceStorePath(self._dataUrl),
+            self._dataUrl)
+        try:
+            for name, length in zip(fastaFile.references, fastaFile.lengths):
+                writer.beginReference(name)
+                for start in range(0, length, self.fastaChunkSize):
+                    writer.addBases(fastaFile.fetch(
+                        name, start, start + self.fastaChunkSize))
+        finally:
+            fastaFile.close()
+        writer.close()
+
+    def getReferenceStore(self):
+        """
+        Returns the memory-mapped reference store of this reference set,
+        or None if its FASTA file has no current store. The store is kept
+        open until the store file is replaced, so that each call only
+        costs a stat of the store and of the FASTA file. Stores of an
+        older format are ignored.
+        """
+        path = reference_store.getReferenceStorePath(self._dataUrl)
+        try:
+            stat = os.stat(path)
+            storeStat = (stat.st_ino, stat.st_size, stat.st_mtime)
+        except OSError:
+            storeStat = None
+        if storeStat != self._referenceStoreStat:
+            if self._referenceStore is not None:
+                self._referenceStore.close()
+                self._referenceStore = None
+            self._referenceStoreStat = storeStat
+            if storeStat is not None:
+                try:
+                    self._referenceStore = reference_store.ReferenceStore(
+                        path)
+                except ValueError:
+                    self._referenceStore = None
+        if (self._referenceStore is None or
+                not self._referenceStore.isCurrent(self._dataUrl)):
+            return None
+        return self._referenceStore
+
 
 class HtslibReference(datamodel.PysamDatamodelMixin, AbstractReference):
     """
@@ -534,6 +668,10 @@ class HtslibReference(datamodel.PysamDatamodelMixin, AbstractReference):
 
     def getBases(self, start, end):
         self.checkQueryRange(start, end)
+        referenceStore = self._parentContainer.getReferenceStore()
+        if (referenceStore is not None and
+                referenceStore.hasReference(self.getLocalId())):
+            return referenceStore.getBases(self.getLocalId(), start, end)
         fastaFile = self._parentContainer.getFastaFile()
         localId = self.getLocalId().encode()
         # TODO we should have some error checking here...
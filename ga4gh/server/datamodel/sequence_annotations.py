@@ -58,6 +58,12 @@ _featureColumns = [
     ('transcript_name', 'TEXT'),  # as found in GFF3 attributes
     ('attributes', 'TEXT')]  # JSON encoding of attributes dict
 
+# The index matching the ordering and keyset condition used to page
+# through feature search results.
+_pageIndexSql = (
+    "CREATE INDEX IF NOT EXISTS idx2 "
+    "ON feature(reference_name, start, end, id)")
+
 
 class Gff3DbBackend(sqlite_backend.SqliteBackedDataSource):
     """
@@ -76,6 +82,15 @@ class Gff3DbBackend(sqlite_backend.SqliteBackedDataSource):
         self.featureColumnNames = [f[0] for f in _featureColumns]
         self.featureColumnTypes = [f[1] for f in _featureColumns]
 
+    def createPageIndex(self):
+        """
+        Creates the index matching the ordering and keyset condition used
+        to page through search results, which databases generated by
+        older versions of generate_gff3_db.py lack.
+        """
+        self._dbconn.execute(_pageIndexSql)
+        self._dbconn.commit()
+
     def featuresQuery(self, **kwargs):
         """
         Converts a dictionary of keyword arguments into a tuple
@@ -98,7 +113,7 @@ class Gff3DbBackend(sqlite_backend.SqliteBackedDataSource):
             sql += "AND start < ? "
             sql_args += (kwargs.get('end'),)
         if 'referenceName' in kwargs and kwargs['referenceName']:
-            sql += "AND reference_name = ?"
+            sql += "AND reference_name = ? "
             sql_args += (kwargs.get('referenceName'),)
         if 'parentId' in kwargs and kwargs['parentId']:
             sql += "AND parent_id = ? "
@@ -109,20 +124,37 @@ class Gff3DbBackend(sqlite_backend.SqliteBackedDataSource):
             sql += ", ".join(["?", ] * len(kwargs.get('featureTypes')))
             sql += ") "
             sql_args += tuple(kwargs.get('featureTypes'))
+        if kwargs.get('lastKey') is not None:
+            # Keyset condition matching the ORDER BY below, so that SQLite
+            # can seek directly to the first row of the page rather than
+            # stepping over an OFFSET worth of rows. This is the row value
+            # comparison (reference_name, start, end, id) > lastKey, which
+            # older versions of SQLite do not support.
+            referenceName, start, end, featureId = kwargs['lastKey']
+            sql += (
+                "AND reference_name >= ? AND (reference_name > ? OR "
+                "(start >= ? AND (start > ? OR end > ? OR "
+                "(end = ? AND id > ?)))) ")
+            sql_args += (
+                referenceName, referenceName, start, start, end, end,
+                featureId)
         sql_rows += sql
-        sql_rows += " ORDER BY reference_name, start, end ASC "
+        sql_rows += " ORDER BY reference_name, start, end, id ASC "
         return sql_rows, sql_args
 
     def searchFeaturesInDb(
             self, startIndex=0, maxResults=None,
             referenceName=None, start=None, end=None,
             parentId=None, featureTypes=None,
-            name=None, geneSymbol=None):
+            name=None, geneSymbol=None, lastKey=None):
         """
         Perform a full features query in database.
 
         :param startIndex: int representing first record to return
         :param maxResults: int representing number of records to return
+        :param lastKey: None or the (reference_name, start, end, id) tuple
+            of the last record previously returned; only records
+            ordered after this key are returned.
         :param referenceName: string representing reference name, ex 'chr1'
         :param start: int position on reference to start search
         :param end: int position on reference to end search >= start
@@ -136,7 +168,7 @@ class Gff3DbBackend(sqlite_backend.SqliteBackedDataSource):
             startIndex=startIndex, maxResults=maxResults,
             referenceName=referenceName, start=start, end=end,
             parentId=parentId, featureTypes=featureTypes,
-            name=name, geneSymbol=geneSymbol)
+            name=name, geneSymbol=geneSymbol, lastKey=lastKey)
         sql += sqlite_backend.limitsSql(startIndex, maxResults)
         query = self._dbconn.execute(sql, sql_args)
         return sqlite_backend.sqliteRowsToDicts(query.fetchall())
@@ -214,6 +246,14 @@ class AbstractFeatureSet(datamodel.DatamodelObject):
             compoundId = ""
         return str(compoundId)
 
+    def getPageKey(self, gaFeature):
+        """
+        Returns the key that identifies the position of the specified
+        feature in the ordering of search results, or None if this
+        FeatureSet does not support keyset paging.
+        """
+        return None
+
 
 class SimulatedFeatureSet(AbstractFeatureSet):
     """
@@ -273,7 +313,8 @@ class SimulatedFeatureSet(AbstractFeatureSet):
     def getFeatures(self, referenceName=None, start=None, end=None,
                     startIndex=None, maxResults=None,
                     featureTypes=None, parentId=None,
-                    name=None, geneSymbol=None, numFeatures=10):
+                    name=None, geneSymbol=None, numFeatures=10,
+                    lastKey=None):
         """
         Returns a set number of simulated features.
 
@@ -288,6 +329,8 @@ class SimulatedFeatureSet(AbstractFeatureSet):
         :param geneSymbol: the symbol for the gene the features are on
         :param numFeatures: number of features to generate in the return.
             10 is a reasonable (if arbitrary) default.
+        :param lastKey: ignored; simulated features do not support
+            keyset paging.
         :return: Yields feature list
         """
         randomNumberGenerator = random.Random()
@@ -348,6 +391,14 @@ class Gff3DbFeatureSet(AbstractFeatureSet):
         self.setAttributesJson(featureSetRecord.attributes)
         self._db = Gff3DbBackend(self._dbFilePath)
 
+    def createPageIndex(self):
+        """
+        Creates the index used to page through the features of this
+        FeatureSet in its DB, if it does not already exist.
+        """
+        with self._db as dataSource:
+            dataSource.createPageIndex()
+
     def getDataUrl(self):
         """
         Returns the URL providing the data source for this FeatureSet.
@@ -372,6 +423,12 @@ class Gff3DbFeatureSet(AbstractFeatureSet):
             gaFeature = self._gaFeatureForFeatureDbRecord(featureReturned)
             return gaFeature
 
+    def getPageKey(self, gaFeature):
+        featureId = datamodel.FeatureCompoundId.parse(gaFeature.id).featureId
+        return (
+            gaFeature.reference_name, gaFeature.start, gaFeature.end,
+            long(featureId))
+
     def _gaFeatureForFeatureDbRecord(self, feature):
         """
         :param feature: The DB Row representing a feature
@@ -411,7 +468,7 @@ class Gff3DbFeatureSet(AbstractFeatureSet):
     def getFeatures(self, referenceName=None, start=None, end=None,
                     startIndex=None, maxResults=None,
                     featureTypes=None, parentId=None,
-                    name=None, geneSymbol=None):
+                    name=None, geneSymbol=None, lastKey=None):
         """
         method passed to runSearchRequest to fulfill the request
         :param str referenceName: name of reference (ex: "chr1")
@@ -423,6 +480,8 @@ class Gff3DbFeatureSet(AbstractFeatureSet):
         :param parentId: none or featureID of parent
         :param name: the name of the feature
         :param geneSymbol: the symbol for the gene the features are on
+        :param lastKey: none or the page key of the last feature returned
+            by a previous search, as given by getPageKey
         :return: yields a protocol.Feature at a time
         """
         with self._db as dataSource:
@@ -431,7 +490,7 @@ class Gff3DbFeatureSet(AbstractFeatureSet):
                 referenceName=referenceName,
                 start=start, end=end,
                 parentId=parentId, featureTypes=featureTypes,
-                name=name, geneSymbol=geneSymbol)
+                name=name, geneSymbol=geneSymbol, lastKey=lastKey)
             for feature in features:
                 gaFeature = self._gaFeatureForFeatureDbRecord(feature)
                 yield gaFeature
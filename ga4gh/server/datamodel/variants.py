@@ -6,6 +6,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
 import datetime
 import glob
 import hashlib
@@ -13,11 +14,17 @@ import json
 import os
 import random
 import re
+import sqlite3
+import threading
+import zlib
 
 import pysam
 
 import ga4gh.server.exceptions as exceptions
 import ga4gh.server.datamodel as datamodel
+import ga4gh.server.columnar_store as columnar_store
+import ga4gh.server.sqlite_backend as sqlite_backend
+import ga4gh.server.timing as timing
 
 import ga4gh.schemas.pb as pb
 import ga4gh.schemas.protocol as protocol
@@ -27,6 +34,10 @@ ANNOTATIONS_VEP_V82 = "VEP_v82"
 ANNOTATIONS_VEP_V77 = "VEP_v77"
 ANNOTATIONS_SNPEFF = "SNPEff"
 
+# The formats of the files variant sets are served from
+VARIANT_SET_FORMAT_VCF = "vcf"
+VARIANT_SET_FORMAT_COLUMNAR = "columnar"
+
 
 # Utility functions for module
 
@@ -40,6 +51,10 @@ def isUnspecified(str):
 
 _nothing = object()
 
+# HGVS c. and p. notations, from which allele locations are parsed
+HGVS_C_PATTERN = re.compile(r".*c.(\d+)(\D+)>(\D+)")
+HGVS_P_PATTERN = re.compile(r".*p.(\D+)(\d+)(\D+)", flags=re.UNICODE)
+
 
 def isEmptyIter(it):
     """Return True iff the iterator is empty or exhausted"""
@@ -248,6 +263,23 @@ class AbstractVariantSet(datamodel.DatamodelObject):
         """
         return self._metadata
 
+    def _validateCallSetIds(self, callSetIds, fieldMask=None):
+        """
+        Returns the list of call set IDs to include in converted variants,
+        raising an exception if any are not in this VariantSet. No calls
+        are included if the specified fieldMask does not hold them.
+        """
+        if callSetIds is None:
+            callSetIds = self._callSetIds
+        else:
+            for callSetId in callSetIds:
+                if callSetId not in self._callSetIds:
+                    raise exceptions.CallSetNotInVariantSetException(
+                        callSetId, self.getId())
+        if fieldMask is not None and "calls" not in fieldMask:
+            callSetIds = []
+        return callSetIds
+
     def toProtocolElement(self):
         """
         Converts this VariantSet into its GA4GH protocol equivalent.
@@ -269,6 +301,14 @@ class AbstractVariantSet(datamodel.DatamodelObject):
         """
         raise NotImplementedError()
 
+    def supportsVirtualOffsets(self):
+        """
+        Returns True if this VariantSet can report the virtual file
+        offsets of its records using getVariantsWithOffsets, and resume
+        reading from them using getVariantsFromOffset.
+        """
+        return False
+
     def _createGaVariant(self):
         """
         Convenience method to set the common fields in a GA Variant
@@ -380,7 +420,7 @@ class SimulatedVariantSet(AbstractVariantSet):
         return variant
 
     def getVariants(self, referenceName, startPosition, endPosition,
-                    callSetIds=None):
+                    callSetIds=None, fieldMask=None):
         randomNumberGenerator = random.Random()
         randomNumberGenerator.seed(self._randomSeed)
         i = startPosition
@@ -439,10 +479,15 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
     Class representing a single variant set backed by a directory of indexed
     VCF or BCF files.
     """
+    # The number of variants retrieved by ID that are kept in memory
+    variantCacheSize = 1024
+
     def __init__(self, parentContainer, localId):
         super(HtslibVariantSet, self).__init__(parentContainer, localId)
         self._chromFileMap = {}
         self._metadata = None
+        self._variantCache = collections.OrderedDict()
+        self._variantCacheLock = threading.Lock()
 
     def isAnnotated(self):
         """
@@ -629,6 +674,65 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         # TODO How do we get the number of records in a VariantFile?
         return 0
 
+    def getFormat(self):
+        """
+        Returns the format of the files this VariantSet is served from.
+        """
+        return VARIANT_SET_FORMAT_VCF
+
+    def compileColumnarStore(self, directory):
+        """
+        Compiles the variants of this VariantSet into a columnar store in
+        the specified directory, which can be served by a
+        ColumnarVariantSet. Only the GT and GL fields of the calls are
+        kept.
+        """
+        sampleNames = [
+            callSet.getSampleName() for callSet in self.getCallSets()]
+        metadata = [
+            protocol.toJsonDict(metadata) for metadata in self.getMetadata()]
+        writer = columnar_store.ColumnarStoreWriter(
+            directory, sampleNames, metadata)
+        for referenceName in sorted(self._chromFileMap.keys()):
+            # A first pass finds the width of the genotype and likelihood
+            # matrices of the contig.
+            ploidy = 0
+            numLikelihoods = 0
+            numRecords = 0
+            for record in self.getPysamVariants(referenceName, 0, self.vcfMax):
+                numRecords += 1
+                for sampleName in sampleNames:
+                    pysamCall = record.samples[str(sampleName)]
+                    ploidy = max(ploidy, len(pysamCall.allele_indices))
+                    if 'GL' in record.format:
+                        likelihoods = pysamCall['GL']
+                        if likelihoods is not None:
+                            numLikelihoods = max(
+                                numLikelihoods, len(likelihoods))
+            if numRecords == 0:
+                continue
+            writer.beginContig(referenceName, ploidy, numLikelihoods)
+            for record in self.getPysamVariants(referenceName, 0, self.vcfMax):
+                site = self.convertVariant(record, [])
+                site.ClearField(str("id"))
+                site.ClearField(str("variant_set_id"))
+                site.ClearField(str("created"))
+                site.ClearField(str("updated"))
+                calls = []
+                for sampleName in sampleNames:
+                    pysamCall = record.samples[str(sampleName)]
+                    likelihoods = None
+                    if 'GL' in record.format:
+                        likelihoods = pysamCall['GL']
+                    calls.append((
+                        pysamCall.allele_indices, pysamCall.phased,
+                        likelihoods if likelihoods is not None else []))
+                writer.addRecord(
+                    record.start, record.stop, site.SerializeToString(),
+                    calls)
+            writer.endContig()
+        writer.close()
+
     def _updateCallSetIds(self, variantFile):
         """
         Updates the call set IDs based on the specified variant file.
@@ -637,9 +741,42 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
             for sample in variantFile.header.samples:
                 self.addCallSetFromName(sample)
 
-    def openFile(self, dataUrlIndexFilePair):
-        dataUrl, indexFile = dataUrlIndexFilePair
-        return pysam.VariantFile(dataUrl, index_filename=indexFile)
+    def openFile(self, fileKey):
+        """
+        Opens the variant file identified by the specified (dataUrl,
+        indexFile) pair, or by a (dataUrl, indexFile, sampleNames) triple,
+        in which case only the calls of the named samples are decoded
+        from the records of the file.
+        """
+        dataUrl, indexFile = fileKey[:2]
+        varFile = pysam.VariantFile(dataUrl, index_filename=indexFile)
+        if len(fileKey) > 2:
+            varFile.subset_samples(fileKey[2])
+        return varFile
+
+    def _getVariantFileKey(self, varFileName, callSetIds):
+        """
+        Returns the key passed to openFile for a handle on the specified
+        (dataUrl, indexFile) pair that decodes only the samples of the
+        specified call sets. Searches for no calls or for all calls use
+        the key of the handle decoding every sample.
+        """
+        sampleNames = tuple(sorted(set(
+            str(self.getCallSet(callSetId).getSampleName())
+            for callSetId in callSetIds)))
+        if len(sampleNames) == 0 or len(sampleNames) == len(self._callSetIds):
+            return varFileName
+        return varFileName + (sampleNames,)
+
+    def _getVariantFileHandle(self, varFileName, callSetIds):
+        """
+        Returns a handle on the specified (dataUrl, indexFile) pair that
+        decodes only the samples of the specified call sets. These handles
+        are pooled in the file handle cache by their set of samples, so
+        that searches for the same calls share them.
+        """
+        return self.getFileHandle(
+            self._getVariantFileKey(varFileName, callSetIds))
 
     def _convertGaCall(self, callSet, pysamCall):
         phaseset = None
@@ -662,11 +799,51 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
             call.attributes.attr[key].values.extend(info[key])
         return call
 
-    def convertVariant(self, record, callSetIds):
+    def _addGaCalls(self, variant, record, callSetIds):
+        """
+        Adds the calls for the specified callSetIds in the specified pysam
+        record to the specified variant. This gives the same calls as
+        converting each sample with _convertGaCall, but the FORMAT keys
+        of the record are examined once rather than once per sample, and
+        the calls are filled in place rather than built separately and
+        copied into the variant, which dominates the conversion of
+        records with many samples. As there, a missing GL value is kept
+        as a GL attribute.
+        """
+        if len(callSetIds) == 0:
+            return
+        formatKeys = list(record.format.keys())
+        hasLikelihoods = 'GL' in formatKeys
+        attributeKeys = [
+            key for key in formatKeys if key != 'GT' and key != 'GL']
+        samples = record.samples
+        calls = variant.calls
+        for callSetId in callSetIds:
+            sampleName = self.getCallSet(callSetId).getSampleName()
+            pysamCall = samples[str(sampleName)]
+            call = calls.add()
+            call.call_set_name = sampleName
+            call.call_set_id = callSetId
+            call.genotype.extend(pysamCall.allele_indices)
+            if pysamCall.phased:
+                call.phaseset = str(pysamCall.phased)
+            attr = call.attributes.attr
+            if hasLikelihoods:
+                genotypeLikelihood = pysamCall['GL']
+                if genotypeLikelihood is not None:
+                    call.genotype_likelihood.extend(genotypeLikelihood)
+                else:
+                    attr['GL'].values.extend(
+                        protocol.encodeValue(genotypeLikelihood))
+            for key in attributeKeys:
+                attr[key].values.extend(protocol.encodeValue(pysamCall[key]))
+
+    def convertVariant(self, record, callSetIds, fieldMask=None):
         """
         Converts the specified pysam variant record into a GA4GH Variant
         object. Only calls for the specified list of callSetIds will
-        be included.
+        be included, and the INFO fields are only converted into
+        attributes if the specified fieldMask holds them.
         """
         variant = self._createGaVariant()
         variant.reference_name = record.contig
@@ -688,6 +865,7 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
                 variant.filters_passed = False
                 variant.filters_failed.extend(filterKeys)
         # record.qual is also available, when supported by GAVariant.
+        convertAttributes = fieldMask is None or "attributes" in fieldMask
         for key, value in record.info.iteritems():
             if value is None:
                 continue
@@ -701,17 +879,49 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
                 variant.ciend.extend(value)
             elif isinstance(value, str):
                 value = value.split(',')
-            protocol.setAttribute(
-                variant.attributes.attr[key].values, value)
-        for callSetId in callSetIds:
-            callSet = self.getCallSet(callSetId)
-            pysamCall = record.samples[str(callSet.getSampleName())]
-            variant.calls.add().CopyFrom(
-                self._convertGaCall(callSet, pysamCall))
+            if convertAttributes:
+                protocol.setAttribute(
+                    variant.attributes.attr[key].values, value)
+        self._addGaCalls(variant, record, callSetIds)
         variant.id = self.getVariantId(variant)
         return variant
 
+    @classmethod
+    def hashPysamVariant(cls, record):
+        """
+        Returns the hash of the specified pysam variant record, as
+        computed by hashVariant on the converted record.
+        """
+        variant = protocol.Variant()
+        variant.reference_bases = record.ref
+        if record.alts is not None:
+            variant.alternate_bases.extend(list(record.alts))
+        return cls.hashVariant(variant)
+
     def getVariant(self, compoundId):
+        """
+        Returns the GA4GH Variant with the specified compound ID. The
+        most recently retrieved variants are kept in memory.
+        """
+        key = str(compoundId)
+        with self._variantCacheLock:
+            variant = self._variantCache.pop(key, None)
+            if variant is not None:
+                self._variantCache[key] = variant
+                return variant
+        variant = self._lookupVariant(compoundId)
+        with self._variantCacheLock:
+            self._variantCache[key] = variant
+            while len(self._variantCache) > self.variantCacheSize:
+                self._variantCache.popitem(last=False)
+        return variant
+
+    def _lookupVariant(self, compoundId):
+        """
+        Reads the variant with the specified compound ID from the VCF
+        file. The hash is checked against the raw records starting at the
+        variant's position, so that only the matching record is converted.
+        """
         if compoundId.reference_name in self._chromFileMap:
             varFileName = self._chromFileMap[compoundId.reference_name]
         else:
@@ -720,48 +930,154 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         referenceName, startPosition, endPosition = \
             self.sanitizeVariantFileFetch(
                 compoundId.reference_name, start, start + 1)
-        cursor = self.getFileHandle(varFileName).fetch(
-            referenceName, startPosition, endPosition)
-        for record in cursor:
-            variant = self.convertVariant(record, self._callSetIds)
+        varFile = self.getFileHandle(varFileName)
+        cursor = varFile.fetch(referenceName, startPosition, endPosition)
+        for record, _ in self.iterateWithFilePosition(varFile, cursor):
+            if record.start > start:
+                break
             if (record.start == start and
-                    compoundId.md5 == self.hashVariant(variant)):
-                return variant
-            elif record.start > start:
-                raise exceptions.ObjectNotFoundException()
+                    compoundId.md5 == self.hashPysamVariant(record)):
+                return self.convertVariant(record, self._callSetIds)
         raise exceptions.ObjectNotFoundException(compoundId)
 
-    def getPysamVariants(self, referenceName, startPosition, endPosition):
+    def getPysamVariants(
+            self, referenceName, startPosition, endPosition, callSetIds=[]):
         """
         Returns an iterator over the pysam VCF records corresponding to the
-        specified query.
+        specified query. If callSetIds are given, the records hold only the
+        calls for these call sets.
         """
         if referenceName in self._chromFileMap:
             varFileName = self._chromFileMap[referenceName]
             referenceName, startPosition, endPosition = \
                 self.sanitizeVariantFileFetch(
                     referenceName, startPosition, endPosition)
-            cursor = self.getFileHandle(varFileName).fetch(
-                referenceName, startPosition, endPosition)
-            for record in cursor:
+            varFile = self._getVariantFileHandle(varFileName, callSetIds)
+            cursor = varFile.fetch(referenceName, startPosition, endPosition)
+            for record, _ in self.iterateWithFilePosition(varFile, cursor):
                 yield record
 
+    def getPysamVariantsAtPositions(self, referenceName, positions):
+        """
+        Returns an iterator over the pysam VCF records on the specified
+        reference starting at the specified sorted list of positions.
+        """
+        if referenceName not in self._chromFileMap:
+            return
+        varFileName = self._chromFileMap[referenceName]
+        referenceName = self.sanitizeString(referenceName, 'contig')
+        varFile = self.getFileHandle(varFileName)
+        for position in positions:
+            cursor = varFile.fetch(referenceName, position, position + 1)
+            for record, _ in self.iterateWithFilePosition(varFile, cursor):
+                # Records starting earlier also overlap the position.
+                if record.start > position:
+                    break
+                if record.start == position:
+                    yield record
+
     def getVariants(self, referenceName, startPosition, endPosition,
-                    callSetIds=[]):
+                    callSetIds=[], fieldMask=None):
         """
         Returns an iterator over the specified variants. The parameters
         correspond to the attributes of a GASearchVariantsRequest object.
+        Fields that are not in the specified fieldMask may be left unset.
         """
-        if callSetIds is None:
-            callSetIds = self._callSetIds
-        else:
-            for callSetId in callSetIds:
-                if callSetId not in self._callSetIds:
-                    raise exceptions.CallSetNotInVariantSetException(
-                        callSetId, self.getId())
+        callSetIds = self._validateCallSetIds(callSetIds, fieldMask)
         for record in self.getPysamVariants(
-                referenceName, startPosition, endPosition):
-            yield self.convertVariant(record, callSetIds)
+                referenceName, startPosition, endPosition, callSetIds):
+            with timing.stage("convert"):
+                variant = self.convertVariant(record, callSetIds, fieldMask)
+            yield variant
+
+    def supportsVirtualOffsets(self):
+        return True
+
+    def getFileIdentity(self, referenceName):
+        """
+        Returns an integer checksum identifying the file that holds the
+        variants for the specified reference, derived from its path, size
+        and modification time. Returns None if there is no such file.
+        """
+        if referenceName not in self._chromFileMap:
+            return None
+        dataUrl, indexFile = self._chromFileMap[referenceName]
+        try:
+            stat = os.stat(dataUrl)
+        except OSError:
+            return None
+        identity = "{}:{}:{}".format(
+            dataUrl, stat.st_size, int(stat.st_mtime))
+        return zlib.crc32(identity.encode("utf-8")) & 0xffffffff
+
+    def getVariantsWithOffsets(
+            self, referenceName, startPosition, endPosition, callSetIds=[],
+            fieldMask=None):
+        """
+        Returns an iterator over (variant, virtualOffset) pairs for the
+        specified query, where virtualOffset is the BGZF virtual file
+        offset at which the variant's record begins, or None for the
+        first record, whose offset is not known. Fields that are not in
+        the specified fieldMask may be left unset.
+        """
+        callSetIds = self._validateCallSetIds(callSetIds, fieldMask)
+        if referenceName not in self._chromFileMap:
+            return
+        varFileName = self._chromFileMap[referenceName]
+        referenceName, startPosition, endPosition = \
+            self.sanitizeVariantFileFetch(
+                referenceName, startPosition, endPosition)
+        varFile = self._getVariantFileHandle(varFileName, callSetIds)
+        cursor = varFile.fetch(referenceName, startPosition, endPosition)
+        # Records that the index iterator jumps over between its chunks
+        # do not overlap the region, so the offset following each record
+        # is where a sequential read finds the next one.
+        virtualOffset = None
+        for record, position in self.iterateWithFilePosition(
+                varFile, cursor):
+            with timing.stage("convert"):
+                variant = self.convertVariant(record, callSetIds, fieldMask)
+            yield variant, virtualOffset
+            virtualOffset = position
+
+    def getVariantsFromOffset(
+            self, referenceName, startPosition, endPosition, virtualOffset,
+            callSetIds=[], fieldMask=None):
+        """
+        Returns an iterator over (variant, virtualOffset) pairs as for
+        getVariantsWithOffsets, reading the records of the specified
+        region sequentially from the specified BGZF virtual offset rather
+        than through the index. The file is read through a handle of its
+        own, which is not shared through the file handle cache and is
+        closed when the iterator is exhausted or closed. Raises ValueError
+        or IOError if the offset does not fall on a record of the file.
+        """
+        callSetIds = self._validateCallSetIds(callSetIds, fieldMask)
+        if referenceName not in self._chromFileMap:
+            return
+        varFileName = self._chromFileMap[referenceName]
+        referenceName, startPosition, endPosition = \
+            self.sanitizeVariantFileFetch(
+                referenceName, startPosition, endPosition)
+        varFile = self.openFile(
+            self._getVariantFileKey(varFileName, callSetIds))
+        try:
+            varFile.seek(virtualOffset)
+            while True:
+                record = next(varFile, None)
+                if record is None or record.contig != referenceName:
+                    break
+                if endPosition is not None and record.start >= endPosition:
+                    break
+                position = varFile.tell()
+                if record.stop > startPosition:
+                    with timing.stage("convert"):
+                        variant = self.convertVariant(
+                            record, callSetIds, fieldMask)
+                    yield variant, virtualOffset
+                virtualOffset = position
+        finally:
+            varFile.close()
 
     def getMetadataId(self, metadata):
         """
@@ -819,6 +1135,156 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
                         description=description))
         return ret
 
+
+class ColumnarVariantSet(AbstractVariantSet):
+    """
+    Class representing a single variant set served from a columnar store
+    compiled from VCF files by HtslibVariantSet.compileColumnarStore.
+    """
+    def __init__(self, parentContainer, localId):
+        super(ColumnarVariantSet, self).__init__(parentContainer, localId)
+        self._store = None
+        self._sampleIndexes = {}
+
+    def isAnnotated(self):
+        return False
+
+    def getFormat(self):
+        return VARIANT_SET_FORMAT_COLUMNAR
+
+    def getReferenceToDataUrlIndexMap(self):
+        """
+        Returns the map of Reference names to the (dataUrl, indexFile)
+        pairs, where the dataUrl is the directory of the store, which has
+        no index file.
+        """
+        return dict(
+            (referenceName, (self._store.getDirectory(), None))
+            for referenceName in self._store.getContigNames())
+
+    def _openStore(self, directory):
+        try:
+            self._store = columnar_store.ColumnarStore(directory)
+        except (IOError, OSError, ValueError):
+            raise exceptions.FileOpenFailedException(directory)
+        self._sampleIndexes = dict(
+            (sampleName, index) for index, sampleName in enumerate(
+                self._store.getSampleNames()))
+
+    def populateFromRow(self, variantSetRecord):
+        """
+        Populates this VariantSet from the specified DB row.
+        """
+        self._created = variantSetRecord.created
+        self._updated = variantSetRecord.updated
+        self.setAttributesJson(variantSetRecord.attributes)
+        dataUrlIndexMap = json.loads(variantSetRecord.dataurlindexmap)
+        if len(dataUrlIndexMap) > 0:
+            directory, _ = list(dataUrlIndexMap.values())[0]
+            self._openStore(directory)
+        self._metadata = []
+        for jsonDict in json.loads(variantSetRecord.metadata):
+            metadata = protocol.fromJson(json.dumps(jsonDict),
+                                         protocol.VariantSetMetadata)
+            self._metadata.append(metadata)
+
+    def populateFromStore(self, directory):
+        """
+        Populates this VariantSet from the columnar store in the specified
+        directory.
+        """
+        self._openStore(directory)
+        for sampleName in self._store.getSampleNames():
+            self.addCallSetFromName(sampleName)
+        self._metadata = []
+        for jsonDict in self._store.getMetadata():
+            metadata = protocol.fromJson(json.dumps(jsonDict),
+                                         protocol.VariantSetMetadata)
+            self._metadata.append(metadata)
+
+    def checkConsistency(self):
+        """
+        Perform consistency check on the variant set
+        """
+        sampleNames = set(
+            callSet.getSampleName() for callSet in self.getCallSets())
+        if sampleNames != set(self._store.getSampleNames()):
+            raise exceptions.InconsistentCallSetIdException(
+                self._store.getDirectory())
+
+    def getNumVariants(self):
+        return sum(
+            self._store.getContig(referenceName).getNumRecords()
+            for referenceName in self._store.getContigNames())
+
+    def getVcfHeaderReferenceSetName(self):
+        return None
+
+    def _convertRecord(self, contig, index, callSetIds, sampleIndexes):
+        """
+        Converts the specified record of the specified ColumnarContig into
+        a GA4GH Variant with the calls of the specified call sets, which
+        are held by the samples at the specified indexes of the store.
+        """
+        variant = self._createGaVariant()
+        variant.MergeFromString(contig.getSite(index))
+        calls = variant.calls
+        for callSetId, (alleleIndexes, phased, likelihoods) in zip(
+                callSetIds, contig.getCalls(index, sampleIndexes)):
+            call = calls.add()
+            call.call_set_name = self.getCallSet(callSetId).getSampleName()
+            call.call_set_id = callSetId
+            call.genotype.extend(alleleIndexes)
+            if phased:
+                call.phaseset = str(phased)
+            call.genotype_likelihood.extend(likelihoods)
+        variant.id = self.getVariantId(variant)
+        return variant
+
+    def getVariants(self, referenceName, startPosition, endPosition,
+                    callSetIds=[], fieldMask=None):
+        """
+        Returns an iterator over the specified variants. The parameters
+        correspond to the attributes of a GASearchVariantsRequest object.
+        Calls are only decoded if the specified fieldMask holds them.
+        """
+        callSetIds = self._validateCallSetIds(callSetIds, fieldMask)
+        contig = self._store.getContig(referenceName)
+        if contig is None:
+            return
+        if not endPosition:
+            # An open-ended search runs to the end of the contig.
+            endPosition = max(startPosition, contig.getMaxEnd())
+        _, startPosition, endPosition = \
+            datamodel.PysamDatamodelMixin.sanitizeVariantFileFetch(
+                None, startPosition, endPosition)
+        sampleIndexes = [
+            self._sampleIndexes[self.getCallSet(callSetId).getSampleName()]
+            for callSetId in callSetIds]
+        for index in contig.getRecordIndexes(startPosition, endPosition):
+            with timing.stage("convert"):
+                variant = self._convertRecord(
+                    contig, index, callSetIds, sampleIndexes)
+            yield variant
+
+    def getVariant(self, compoundId):
+        contig = self._store.getContig(compoundId.reference_name)
+        if contig is None:
+            raise exceptions.ObjectNotFoundException(compoundId)
+        start = int(compoundId.start)
+        for index in contig.getRecordIndexes(start, start + 1):
+            if contig.getStart(index) != start:
+                continue
+            site = protocol.Variant()
+            site.MergeFromString(contig.getSite(index))
+            if compoundId.md5 == self.hashVariant(site):
+                return self._convertRecord(
+                    contig, index, self._callSetIds,
+                    [self._sampleIndexes[callSet.getSampleName()]
+                     for callSet in self.getCallSets()])
+        raise exceptions.ObjectNotFoundException(compoundId)
+
+
 #############################################
 
 # Variant Annotations.
@@ -926,26 +1392,36 @@ class AbstractVariantAnnotationSet(datamodel.DatamodelObject):
                 effs, gaTranscriptEffect.hgvs_annotation)
             ).hexdigest()
 
-    def hashVariantAnnotation(cls, gaVariant, gaVariantAnnotation):
+    def hashVariantAnnotation(
+            cls, gaVariant, gaVariantAnnotation, transcriptEffectIds=None):
         """
-        Produces an MD5 hash of the gaVariant and gaVariantAnnotation objects
+        Produces an MD5 hash of the gaVariant and gaVariantAnnotation objects.
+        If transcriptEffectIds are given, they are hashed in place of the
+        IDs of the transcript effects of the annotation.
         """
-        treffs = [treff.id for treff in gaVariantAnnotation.transcript_effects]
+        treffs = transcriptEffectIds
+        if treffs is None:
+            treffs = [
+                treff.id for treff in gaVariantAnnotation.transcript_effects]
         return hashlib.md5(
             "{}\t{}\t{}\t".format(
                 gaVariant.reference_bases, tuple(gaVariant.alternate_bases),
                 treffs)
             ).hexdigest()
 
-    def getVariantAnnotationId(self, gaVariant, gaAnnotation):
+    def getVariantAnnotationId(
+            self, gaVariant, gaAnnotation, transcriptEffectIds=None):
         """
         Produces a stringified compoundId representing a variant
         annotation.
         :param gaVariant:   protocol.Variant
         :param gaAnnotation: protocol.VariantAnnotation
+        :param transcriptEffectIds: list of String, if the annotation
+            holds only some of its transcript effects
         :return:  compoundId String
         """
-        md5 = self.hashVariantAnnotation(gaVariant, gaAnnotation)
+        md5 = self.hashVariantAnnotation(
+            gaVariant, gaAnnotation, transcriptEffectIds)
         compoundId = datamodel.VariantAnnotationCompoundId(
             self.getCompoundId(), gaVariant.reference_name,
             str(gaVariant.start), md5)
@@ -978,7 +1454,9 @@ class SimulatedVariantAnnotationSet(AbstractVariantAnnotationSet):
         ann = self.generateVariantAnnotation(variant, randomNumberGenerator)
         return ann
 
-    def getVariantAnnotations(self, referenceName, start, end):
+    def getVariantAnnotations(
+            self, referenceName, start, end, effectTermIds=None):
+        # Simulated annotations are not pre-filtered by effect.
         for variant in self._variantSet.getVariants(referenceName, start, end):
             yield variant, self.generateVariantAnnotation(variant)
 
@@ -1065,6 +1543,102 @@ class SimulatedVariantAnnotationSet(AbstractVariantAnnotationSet):
         return effect
 
 
+# Suffix added to the path of an annotated VCF file to give the path of
+# its effect index.
+EFFECT_INDEX_SUFFIX = ".effects.db"
+
+
+def getEffectIndexPath(dataUrl):
+    """
+    Returns the path of the effect index of the specified VCF file.
+    """
+    return dataUrl + EFFECT_INDEX_SUFFIX
+
+
+class VariantEffectIndex(sqlite_backend.SqliteBackedDataSource):
+    """
+    A sidecar index of an annotated VCF file, mapping the effect names
+    of its transcript effects to the positions of the records holding
+    them. Effects are indexed by their sequence ontology names, as they
+    appear in the ANN/CSQ strings, so that the index does not depend on
+    the ontology used to map them to term IDs.
+    """
+    EFFECT = "effect"
+
+    def _getFileStamp(self, dataUrl):
+        stat = os.stat(dataUrl)
+        return "{}:{}".format(stat.st_size, int(stat.st_mtime))
+
+    def build(self, dataUrl, annotationSet):
+        """
+        Writes the index of the specified VCF file, whose ANN/CSQ strings
+        are interpreted by the specified annotation set, replacing any
+        existing index.
+        """
+        cursor = self._dbconn.cursor()
+        cursor.execute("DROP TABLE IF EXISTS metadata")
+        cursor.execute("DROP TABLE IF EXISTS postings")
+        cursor.execute(
+            "CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)")
+        cursor.execute(
+            "CREATE TABLE postings (kind TEXT, key TEXT, "
+            "referenceName TEXT, start INTEGER, end INTEGER)")
+        varFile = pysam.VariantFile(dataUrl)
+        try:
+            for record in varFile:
+                keys = set()
+                for annStr in annotationSet._getAnnotations(record) or []:
+                    for name in annotationSet._getEffectNames(annStr):
+                        keys.add((self.EFFECT, name))
+                cursor.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?, ?, ?)", [
+                        (kind, key, record.contig, record.start, record.stop)
+                        for kind, key in keys])
+        finally:
+            varFile.close()
+        cursor.execute(
+            "CREATE INDEX postings_key ON postings "
+            "(kind, key, referenceName, start)")
+        cursor.execute(
+            "INSERT INTO metadata VALUES ('fileStamp', ?)",
+            (self._getFileStamp(dataUrl),))
+        self._dbconn.commit()
+
+    def isCurrent(self, dataUrl):
+        """
+        Returns True if this index was built from the current version of
+        the specified VCF file.
+        """
+        try:
+            row = self._dbconn.execute(
+                "SELECT value FROM metadata WHERE key = 'fileStamp'"
+            ).fetchone()
+        except sqlite3.Error:
+            return False
+        return row is not None and row[0] == self._getFileStamp(dataUrl)
+
+    def getStartPositions(self, kind, keys, referenceName, start, end):
+        """
+        Returns the sorted list of distinct start positions of the records
+        on the specified reference overlapping [start, end) that hold any
+        of the specified keys of the specified kind. An end of None
+        denotes the end of the reference.
+        """
+        keys = list(keys)
+        if len(keys) == 0:
+            return []
+        sql = (
+            "SELECT DISTINCT start FROM postings WHERE kind = ? "
+            "AND key IN ({}) AND referenceName = ? AND end > ?").format(
+                ", ".join("?" * len(keys)))
+        args = [kind] + keys + [referenceName, start]
+        if end is not None:
+            sql += " AND start < ?"
+            args.append(end)
+        sql += " ORDER BY start"
+        return [row[0] for row in self._dbconn.execute(sql, args)]
+
+
 class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
     """
     Class representing a single variant annotation derived from an
@@ -1090,6 +1664,11 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
                      "hgvs_annotation.transcript",
                      "hgvs_annotation.protein", "cdnaPos", "cdsPos",
                      "protPos", "distance", "errsWarns")
+    # The fields from which the ID of a transcript effect is derived,
+    # besides its effects and hgvs_annotation.genomic.
+    TRANSCRIPT_EFFECT_ID_FIELDS = (
+        "alternate_bases", "feature_id", "hgvs_annotation.transcript",
+        "hgvs_annotation.protein")
     EXCLUDED_FIELDS = ("effects", "geneName", "gene", "geneId", "featureType",
                        "trBiotype", "rank", "cdnaPos", "cdsPos",
                        "protPos", "distance", "exon", "intron",
@@ -1099,6 +1678,8 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
 
     def __init__(self, variantSet, localId):
         super(HtslibVariantAnnotationSet, self).__init__(variantSet, localId)
+        self._fieldPlan = None
+        self._fieldIndexes = None
 
     def populateFromFile(self, varFile, annotationType):
         self._annotationType = annotationType
@@ -1176,19 +1757,167 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
             self._compoundId, "analysis"))
         return analysis
 
-    def getVariantAnnotations(self, referenceName, startPosition, endPosition):
+    def getVariantAnnotations(
+            self, referenceName, startPosition, endPosition,
+            effectTermIds=None):
         """
         Generator for iterating through variant annotations in this
-        variant annotation set.
+        variant annotation set. If effectTermIds are given, only the
+        annotations with a transcript effect having one of these
+        ontology term IDs are returned, and only those transcript effects
+        are included. Records are checked against the raw ANN/CSQ strings
+        before they are converted.
         :param referenceName:
         :param startPosition:
         :param endPosition:
-        :return: generator of protocol.VariantAnnotation
+        :param effectTermIds:
+        :return: generator of (protocol.Variant, protocol.VariantAnnotation)
+        """
+        effectNames = None
+        variantIter = None
+        if effectTermIds is not None:
+            effectNames = self._ontology.getTermNamesByIds(effectTermIds)
+            variantIter = self._getIndexedPysamVariants(
+                referenceName, startPosition, endPosition, effectNames)
+        if variantIter is None:
+            variantIter = self._variantSet.getPysamVariants(
+                referenceName, startPosition, endPosition)
+        for record in variantIter:
+            if (effectNames is not None and
+                    not self._hasMatchingEffect(record, effectNames)):
+                continue
+            with timing.stage("convert"):
+                variantAnnotation = self.convertVariantAnnotation(
+                    record, effectNames)
+            yield variantAnnotation
+
+    def buildEffectIndexes(self):
+        """
+        Builds the effect index of each of the local VCF files of this
+        variant annotation set, which allows searches filtered by effect
+        to read only the records holding the requested effects.
+        """
+        for dataUrl, _ in self._variantSet.getDataUrlIndexPairs():
+            if os.path.exists(dataUrl):
+                with VariantEffectIndex(
+                        getEffectIndexPath(dataUrl)) as effectIndex:
+                    effectIndex.build(dataUrl, self)
+
+    def _getIndexedPysamVariants(
+            self, referenceName, startPosition, endPosition, effectNames):
+        """
+        Returns an iterator over the pysam records of the specified region
+        holding any of the specified effects, read from the positions
+        given by the effect index of the VCF file. Returns None if there
+        is no current effect index for the file.
         """
-        variantIter = self._variantSet.getPysamVariants(
+        dataUrlIndexMap = self._variantSet.getReferenceToDataUrlIndexMap()
+        if referenceName not in dataUrlIndexMap:
+            return None
+        dataUrl, _ = dataUrlIndexMap[referenceName]
+        indexPath = getEffectIndexPath(dataUrl)
+        if not os.path.exists(indexPath):
+            return None
+        contig, start, end = self._variantSet.sanitizeVariantFileFetch(
             referenceName, startPosition, endPosition)
-        for record in variantIter:
-            yield self.convertVariantAnnotation(record)
+        with VariantEffectIndex(indexPath) as effectIndex:
+            if not effectIndex.isCurrent(dataUrl):
+                return None
+            positions = effectIndex.getStartPositions(
+                VariantEffectIndex.EFFECT, effectNames, contig, start, end)
+        return self._variantSet.getPysamVariantsAtPositions(
+            referenceName, positions)
+
+    def _getAnnotations(self, record):
+        """
+        Returns the ANN or CSQ strings of the specified pysam record.
+        """
+        return record.info.get(b'ANN') or record.info.get(b'CSQ')
+
+    def _getTranscriptEffectFields(self):
+        """
+        Returns the names of the fields of the ANN or CSQ strings of the
+        records in this variant annotation set.
+        """
+        if self._annotationType == ANNOTATIONS_SNPEFF:
+            return self.SNPEFF_FIELDS
+        elif self._annotationType == ANNOTATIONS_VEP_V82:
+            return self.VEP_FIELDS
+        else:
+            return self.CSQ_FIELDS
+
+    def _compileFieldPlan(self):
+        """
+        Builds the plan for converting the fields of the ANN or CSQ
+        strings of this annotation set into transcript effects. The plan
+        is a list of (index, key, parentName, name) tuples, where parentName
+        and name locate the transcript effect field that the value at the
+        index of the split string is assigned to. The name is None for the
+        fields stored as attributes. Fields that are neither assigned nor
+        stored, and all but the last occurrence of duplicated fields, are
+        left out.
+        """
+        fields = self._getTranscriptEffectFields()
+        fieldIndexes = dict((key, index) for index, key in enumerate(fields))
+        fieldPlan = []
+        effect = self._createGaTranscriptEffect()
+        for index, key in enumerate(fields):
+            if fieldIndexes[key] != index:
+                continue
+            parentName, _, name = key.rpartition('.')
+            try:
+                protocol.deepSetAttr(effect, key, "")
+            except AttributeError:
+                if key in self.EXCLUDED_FIELDS:
+                    continue
+                name = None
+            fieldPlan.append((index, key, parentName or None, name))
+        self._fieldIndexes = fieldIndexes
+        self._fieldPlan = fieldPlan
+
+    def _getFieldPlan(self):
+        if self._fieldPlan is None:
+            self._compileFieldPlan()
+        return self._fieldPlan
+
+    def _getFieldValue(self, values, key):
+        """
+        Returns the value of the specified field in the specified list of
+        values from a split ANN or CSQ string, or None if it is absent.
+        """
+        if self._fieldIndexes is None:
+            self._compileFieldPlan()
+        index = self._fieldIndexes.get(key)
+        if index is None or index >= len(values):
+            return None
+        return values[index]
+
+    def _getEffectNames(self, annStr):
+        """
+        Returns the list of sequence ontology term names in the effects
+        field of the specified ANN or CSQ string.
+        """
+        effects = self._getFieldValue(annStr.split("|"), "effects")
+        if effects is None:
+            return []
+        return effects.split('&')
+
+    def _hasMatchingEffect(self, record, effectNames):
+        """
+        Returns True if any of the ANN or CSQ strings of the specified
+        pysam record has an effect with one of the specified names.
+        """
+        annotations = self._getAnnotations(record)
+        if not annotations:
+            return False
+        # Rule out most records with a substring test before splitting.
+        if not any(
+                name in annStr for annStr in annotations
+                for name in effectNames):
+            return False
+        return any(
+            name in effectNames for annStr in annotations
+            for name in self._getEffectNames(annStr))
 
     def convertLocation(self, pos):
         """
@@ -1215,7 +1944,7 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
         """
         if isUnspecified(hgvsc):
             return None
-        match = re.match(".*c.(\d+)(\D+)>(\D+)", hgvsc)
+        match = HGVS_C_PATTERN.match(hgvsc)
         if match:
             pos = int(match.group(1))
             if pos > 0:
@@ -1235,7 +1964,7 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
         """
         if isUnspecified(hgvsp):
             return None
-        match = re.match(".*p.(\D+)(\d+)(\D+)", hgvsp, flags=re.UNICODE)
+        match = HGVS_P_PATTERN.match(hgvsp)
         if match is not None:
             allLoc = self._createGaAlleleLocation()
             allLoc.reference_sequence = match.group(1)
@@ -1244,40 +1973,34 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
             return allLoc
         return None
 
-    def addCDSLocation(self, effect, cdnaPos):
-        hgvsC = effect.hgvs_annotation.transcript
-        allele_location = None
-        if not isUnspecified(hgvsC):
-            allele_location = self.convertLocationHgvsC(hgvsC)
-            if allele_location:
-                effect.cds_location.CopyFrom(self.convertLocationHgvsC(hgvsC))
-        if allele_location is None and self.convertLocation(cdnaPos):
-                effect.cds_location.CopyFrom(self.convertLocation(cdnaPos))
+    def addCDSLocation(self, effect, hgvsCLocation, cdnaLocation):
+        if hgvsCLocation is not None:
+            effect.cds_location.CopyFrom(hgvsCLocation)
+        if hgvsCLocation is None and cdnaLocation is not None:
+            effect.cds_location.CopyFrom(cdnaLocation)
         else:
             # These are not stored in the VCF
             effect.cds_location.alternate_sequence = ""
             effect.cds_location.reference_sequence = ""
 
     def addProteinLocation(self, effect, protPos):
-        hgvsP = effect.hgvs_annotation.protein
-        protein_location = None
-        if not isUnspecified(hgvsP):
-            protein_location = self.convertLocationHgvsP(hgvsP)
-            if protein_location:
-                effect.protein_location.CopyFrom(
-                    self.convertLocationHgvsP(hgvsP))
-        if protein_location is None and self.convertLocation(protPos):
-            effect.protein_location.CopyFrom(self.convertLocation(protPos))
-
-    def addCDNALocation(self, effect, cdnaPos):
-        hgvsC = effect.hgvs_annotation.transcript
-        if self.convertLocation(cdnaPos):
-            effect.cdna_location.CopyFrom(self.convertLocation(cdnaPos))
-        if self.convertLocationHgvsC(hgvsC):
+        hgvsPLocation = self.convertLocationHgvsP(
+            effect.hgvs_annotation.protein)
+        if hgvsPLocation is not None:
+            effect.protein_location.CopyFrom(hgvsPLocation)
+        else:
+            protLocation = self.convertLocation(protPos)
+            if protLocation is not None:
+                effect.protein_location.CopyFrom(protLocation)
+
+    def addCDNALocation(self, effect, hgvsCLocation, cdnaLocation):
+        if cdnaLocation is not None:
+            effect.cdna_location.CopyFrom(cdnaLocation)
+        if hgvsCLocation is not None:
             effect.cdna_location.alternate_sequence = \
-                self.convertLocationHgvsC(hgvsC).alternate_sequence
+                hgvsCLocation.alternate_sequence
             effect.cdna_location.reference_sequence = \
-                self.convertLocationHgvsC(hgvsC).reference_sequence
+                hgvsCLocation.reference_sequence
 
     def addLocations(self, effect, protPos, cdnaPos):
         """
@@ -1289,8 +2012,13 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
         :param cdnaPos: String representing coding DNA location
         :return: effect protocol.TranscriptEffect
         """
-        self.addCDSLocation(effect, cdnaPos)
-        self.addCDNALocation(effect, cdnaPos)
+        # Each position and HGVS string is parsed once, and the results
+        # shared between the locations derived from them.
+        hgvsCLocation = self.convertLocationHgvsC(
+            effect.hgvs_annotation.transcript)
+        cdnaLocation = self.convertLocation(cdnaPos)
+        self.addCDSLocation(effect, hgvsCLocation, cdnaLocation)
+        self.addCDNALocation(effect, hgvsCLocation, cdnaLocation)
         self.addProteinLocation(effect, protPos)
         return effect
 
@@ -1304,27 +2032,51 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
         """
         effect = self._createGaTranscriptEffect()
         effect.hgvs_annotation.CopyFrom(protocol.HGVSAnnotation())
-        annDict = dict()
-        if self._annotationType == ANNOTATIONS_SNPEFF:
-            annDict = dict(zip(self. SNPEFF_FIELDS, annStr.split("|")))
-        elif self._annotationType == ANNOTATIONS_VEP_V82:
-            annDict = dict(zip(self.VEP_FIELDS, annStr.split("|")))
-        else:
-            annDict = dict(zip(self.CSQ_FIELDS, annStr.split("|")))
-        annDict["hgvs_annotation.genomic"] = hgvsG if hgvsG else u''
-        for key, val in annDict.items():
-            try:
-                protocol.deepSetAttr(effect, key, val)
-            except AttributeError:
-                if val and key not in self.EXCLUDED_FIELDS:
+        values = annStr.split("|")
+        numValues = len(values)
+        for index, key, parentName, name in self._getFieldPlan():
+            if index >= numValues:
+                break
+            val = values[index]
+            if name is None:
+                if val:
                     protocol.setAttribute(
                         effect.attributes.attr[key].values, val)
-        effect.effects.extend(self.convertSeqOntology(annDict.get('effects')))
+            elif parentName is None:
+                setattr(effect, name, val)
+            else:
+                setattr(getattr(effect, parentName), name, val)
+        effect.hgvs_annotation.genomic = hgvsG if hgvsG else u''
+        effect.effects.extend(self.convertSeqOntology(
+            self._getFieldValue(values, 'effects')))
         self.addLocations(
-            effect, annDict.get('protPos'), annDict.get('cdnaPos'))
+            effect, self._getFieldValue(values, 'protPos'),
+            self._getFieldValue(values, 'cdnaPos'))
         effect.id = self.getTranscriptEffectId(effect)
         return effect
 
+    def getTranscriptEffectIdFromString(self, annStr, hgvsG):
+        """
+        Returns the ID of the transcript effect that convertTranscriptEffect
+        returns for the specified ANN string, setting only the fields
+        from which the ID is derived.
+        :param annStr: String
+        :param hgvsG: String
+        :return: String
+        """
+        effect = self._createGaTranscriptEffect()
+        effect.hgvs_annotation.CopyFrom(protocol.HGVSAnnotation())
+        values = annStr.split("|")
+        for key in self.TRANSCRIPT_EFFECT_ID_FIELDS:
+            val = self._getFieldValue(values, key)
+            if val is not None:
+                protocol.deepSetAttr(effect, key, val)
+        effect.hgvs_annotation.genomic = hgvsG if hgvsG else u''
+        effect.effects.extend(self.convertSeqOntology(
+            self._getFieldValue(values, 'effects')))
+        effect.id = self.getTranscriptEffectId(effect)
+        return effect.id
+
     def convertSeqOntology(self, seqOntStr):
         """
         Splits a string of sequence ontology effects and creates
@@ -1337,11 +2089,13 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
             self._ontology.getGaTermByName(soName)
             for soName in seqOntStr.split('&')]
 
-    def convertVariantAnnotation(self, record):
+    def convertVariantAnnotation(self, record, effectNames=None):
         """
         Converts the specfied pysam variant record into a GA4GH variant
         annotation object using the specified function to convert the
-        transcripts.
+        transcripts. If effectNames are given, only the transcript effects
+        having an effect with one of these names are converted; the ID of
+        the annotation is still derived from all its transcript effects.
         """
         variant = self._variantSet.convertVariant(record, [])
         annotation = self._createGaVariantAnnotation()
@@ -1349,10 +2103,19 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
         gDots = record.info.get(b'HGVS.g')
         # Convert annotations from INFO field into TranscriptEffect
         transcriptEffects = []
-        annotations = record.info.get(b'ANN') or record.info.get(b'CSQ')
+        transcriptEffectIds = []
+        annotations = self._getAnnotations(record)
         for i, ann in enumerate(annotations):
             hgvsG = gDots[i % len(variant.alternate_bases)] if gDots else None
-            transcriptEffects.append(self.convertTranscriptEffect(ann, hgvsG))
+            if effectNames is None or any(
+                    name in effectNames for name in self._getEffectNames(ann)):
+                effect = self.convertTranscriptEffect(ann, hgvsG)
+                transcriptEffects.append(effect)
+                transcriptEffectIds.append(effect.id)
+            else:
+                transcriptEffectIds.append(
+                    self.getTranscriptEffectIdFromString(ann, hgvsG))
         annotation.transcript_effects.extend(transcriptEffects)
-        annotation.id = self.getVariantAnnotationId(variant, annotation)
+        annotation.id = self.getVariantAnnotationId(
+            variant, annotation, transcriptEffectIds)
         return variant, annotation
@@ -110,6 +110,14 @@ class AbstractDataRepository(object):
         """
         peers.Peer(announcement.get('url'))
 
+    def getVersionStamp(self):
+        """
+        Returns a value that changes whenever the data served from this
+        repository may have changed. Repositories held only in memory
+        never change, so this is None.
+        """
+        return None
+
     def getNumDatasets(self):
         """
         Returns the number of datasets in this data repository.
@@ -503,7 +511,7 @@ class SqlDataRepository(AbstractDataRepository):
         def __str__(self):
             return "{}.{}".format(self.major, self.minor)
 
-    version = SchemaVersion("2.1")
+    version = SchemaVersion("2.2")
     systemKeySchemaVersion = "schemaVersion"
     systemKeyCreationTimeStamp = "creationTimeStamp"
 
@@ -517,6 +525,7 @@ class SqlDataRepository(AbstractDataRepository):
         # Values filled in using the DB. These will all be None until
         # we have called load()
         self._schemaVersion = None
+        self._creationTimeStamp = None
         # Connection to the DB.
         self.database = models.SqliteDatabase(self._dbFilename, **{})
         models.databaseProxy.initialize(self.database)
@@ -742,6 +751,11 @@ class SqlDataRepository(AbstractDataRepository):
                 models.System.key == self.systemKeySchemaVersion).value
         except Exception:
             raise exceptions.RepoInvalidDatabaseException(self._dbFilename)
+        try:
+            self._creationTimeStamp = models.System.get(
+                models.System.key == self.systemKeyCreationTimeStamp).value
+        except models.System.DoesNotExist:
+            self._creationTimeStamp = None
         schemaVersion = self.SchemaVersion(self._schemaVersion)
         if schemaVersion.major != self.version.major:
             raise exceptions.RepoSchemaVersionMismatchException(
@@ -1110,12 +1124,15 @@ class SqlDataRepository(AbstractDataRepository):
             [protocol.toJsonDict(metadata) for metadata in
              variantSet.getMetadata()])
         urlMapJson = json.dumps(variantSet.getReferenceToDataUrlIndexMap())
+        if not self._hasVariantSetFormat():
+            self._addVariantSetFormat()
         try:
             models.Variantset.create(
                 id=variantSet.getId(),
                 datasetid=variantSet.getParentContainer().getId(),
                 referencesetid=variantSet.getReferenceSet().getId(),
                 name=variantSet.getLocalId(),
+                format=variantSet.getFormat(),
                 created=datetime.datetime.now(),
                 updated=datetime.datetime.now(),
                 metadata=metadataJson,
@@ -1126,13 +1143,44 @@ class SqlDataRepository(AbstractDataRepository):
         for callSet in variantSet.getCallSets():
             self.insertCallSet(callSet)
 
+    def _hasVariantSetFormat(self):
+        """
+        Returns True if the Variantset table has the format column, which
+        registries created before schema version 2.2 lack.
+        """
+        columns = self.database.get_columns(
+            models.Variantset._meta.db_table)
+        return "format" in [column.name for column in columns]
+
+    def _addVariantSetFormat(self):
+        """
+        Adds the format column to the Variantset table of a registry
+        created before schema version 2.2, all of whose variant sets are
+        VCF variant sets.
+        """
+        self.database.execute_sql(
+            "ALTER TABLE {} ADD COLUMN format TEXT DEFAULT '{}'".format(
+                models.Variantset._meta.db_table,
+                variants.VARIANT_SET_FORMAT_VCF))
+
     def _readVariantSetTable(self):
-        for variantSetRecord in models.Variantset.select():
+        query = models.Variantset.select()
+        if not self._hasVariantSetFormat():
+            # Older registries are read as they are, so that they can
+            # still be served from read-only storage.
+            query = models.Variantset.select(*[
+                field for field in models.Variantset._meta.sorted_fields
+                if field.name != "format"])
+        for variantSetRecord in query:
             dataset = self.getDataset(variantSetRecord.datasetid.id)
             referenceSet = self.getReferenceSet(
                 variantSetRecord.referencesetid.id)
-            variantSet = variants.HtslibVariantSet(
-                dataset, variantSetRecord.name)
+            if variantSetRecord.format == variants.VARIANT_SET_FORMAT_COLUMNAR:
+                variantSet = variants.ColumnarVariantSet(
+                    dataset, variantSetRecord.name)
+            else:
+                variantSet = variants.HtslibVariantSet(
+                    dataset, variantSetRecord.name)
             variantSet.setReferenceSet(referenceSet)
             variantSet.populateFromRow(variantSetRecord)
             assert variantSet.getId() == variantSetRecord.id
@@ -1407,6 +1455,19 @@ class SqlDataRepository(AbstractDataRepository):
         # exists?
         return os.path.exists(self._dbFilename)
 
+    def getVersionStamp(self):
+        """
+        Returns the schema version and creation time stamp of the registry
+        DB, along with the modification time and size of its file, which
+        change whenever the repo manager updates it.
+        """
+        try:
+            stat = os.stat(self._dbFilename)
+            fileStamp = stat.st_mtime, stat.st_size
+        except OSError:
+            fileStamp = None
+        return self._schemaVersion, self._creationTimeStamp, fileStamp
+
     def assertExists(self):
         if not self.exists():
             raise exceptions.RepoNotFoundException(self._dbFilename)
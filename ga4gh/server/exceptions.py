@@ -126,6 +126,33 @@ class BadPageTokenException(BadRequestException):
     message = "Request page token invalid"
 
 
+class BadFieldMaskException(BadRequestException):
+    def __init__(self, fieldName):
+        self.message = "Unknown field '{}' in field mask".format(fieldName)
+
+
+class UnsupportedQualityEncodingException(BadRequestException):
+    def __init__(self, qualityEncoding):
+        self.message = "Unsupported quality encoding '{}'".format(
+            qualityEncoding)
+
+
+class BadReadSamplingException(BadRequestException):
+    def __init__(self, maxReadsPerWindow, windowSize):
+        self.message = (
+            "Invalid read sampling of {} reads per window of {} bases; "
+            "both must be positive integers".format(
+                maxReadsPerWindow, windowSize))
+
+
+class BadCoverageRequestException(BadRequestException):
+    def __init__(self, binSize, numBins, maxBins):
+        self.message = (
+            "Invalid coverage request for {} bins of {} bases; the bin "
+            "size must be a positive integer and there can be at most "
+            "{} bins".format(numBins, binSize, maxBins))
+
+
 class BadIdentifierException(BadRequestException):
     def __init__(self, id_, msg=None):
         self.message = "The identifier provided is invalid: '{}' ".format(id_)
@@ -145,6 +172,12 @@ class InvalidJsonException(BadRequestException):
         self.message = "Cannot parse JSON: '{}'".format(jsonString)
 
 
+class InvalidProtobufException(BadRequestException):
+    def __init__(self, className):
+        self.message = "Cannot parse serialised protobuf {}".format(
+            className)
+
+
 class Validator(object):
     """
     Check that a JSON dictionary is a valid representation of a protocol
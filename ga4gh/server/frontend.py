@@ -8,6 +8,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
+import time
 import datetime
 import socket
 import urlparse
@@ -32,16 +33,21 @@ import ga4gh.server.exceptions as exceptions
 import ga4gh.server.datarepo as datarepo
 import ga4gh.server.auth as auth
 import ga4gh.server.network as network
+import ga4gh.server.metrics as metrics
+import ga4gh.server.timing as timing
 
 import ga4gh.schemas.protocol as protocol
 
-MIMETYPE = "application/json"
+MIMETYPE = backend.JSON_MIMETYPE
+PROTOBUF_MIMETYPE = backend.PROTOBUF_MIMETYPE
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4"
 SEARCH_ENDPOINT_METHODS = ['POST', 'OPTIONS']
 SECRET_KEY_LENGTH = 24
 
 app = flask.Flask(__name__)
 assert not hasattr(app, 'urls')
 app.urls = []
+app.metrics = None
 
 requires_auth = auth.auth_decorator(app)
 
@@ -264,6 +270,21 @@ def _configure_backend(app):
     theBackend.setRequestValidation(app.config["REQUEST_VALIDATION"])
     theBackend.setDefaultPageSize(app.config["DEFAULT_PAGE_SIZE"])
     theBackend.setMaxResponseLength(app.config["MAX_RESPONSE_LENGTH"])
+    theBackend.setVirtualOffsetPageTokens(
+        app.config["VARIANT_VIRTUAL_OFFSET_PAGE_TOKENS"])
+    theBackend.setCigarReferenceSequences(
+        app.config["CIGAR_REFERENCE_SEQUENCES"])
+    theBackend.setCursorCache(
+        app.config["CURSOR_CACHE_MAX_SIZE"], app.config["CURSOR_CACHE_TTL"])
+    theBackend.setCoverageTileCache(
+        app.config["COVERAGE_TILE_CACHE_DIRECTORY"],
+        app.config["COVERAGE_TILE_CACHE_MAX_TILES"])
+    theBackend.setStreamingResponses(
+        app.config["STREAMING_SEARCH_RESPONSES"])
+    theBackend.setResponseCache(
+        app.config["RESPONSE_CACHE_MAX_SIZE"],
+        app.config["RESPONSE_CACHE_TTL"],
+        app.config["RESPONSE_CACHE_ENDPOINTS"])
     return theBackend
 
 
@@ -294,6 +315,13 @@ def configure(configFile=None, baseConfig="ProductionConfig",
     app.serverStatus = ServerStatus()
 
     app.backend = _configure_backend(app)
+    app.metrics = None
+    metricsPath = app.config.get('METRICS_PATH')
+    if metricsPath:
+        app.metrics = metrics.Metrics()
+        if metricsPath not in [rule.rule for rule in app.url_map.iter_rules()]:
+            app.add_url_rule(metricsPath, 'getMetrics', getMetrics)
+    app.backend.setMetrics(app.metrics)
     if app.config.get('SECRET_KEY'):
         app.secret_key = app.config['SECRET_KEY']
     elif app.config.get('OIDC_PROVIDER'):
@@ -358,11 +386,82 @@ def configure(configFile=None, baseConfig="ProductionConfig",
             app.oidcClient.store_registration_info(response)
 
 
-def getFlaskResponse(responseString, httpStatus=200):
+def getFlaskResponse(responseString, httpStatus=200, mimetype=MIMETYPE):
     """
-    Returns a Flask response object for the specified data and HTTP status.
+    Returns a Flask response object for the specified data, HTTP status
+    and mimetype. The data may be a generator over the pieces of the
+    response, which are then sent to the client using chunked transfer
+    encoding.
     """
-    return flask.Response(responseString, status=httpStatus, mimetype=MIMETYPE)
+    return flask.Response(responseString, status=httpStatus, mimetype=mimetype)
+
+
+def getRequestMimetype(request):
+    """
+    Returns the mimetype of the body of the specified flask request,
+    which is JSON unless serialised protobuf is specified.
+    """
+    if request.mimetype == PROTOBUF_MIMETYPE:
+        return PROTOBUF_MIMETYPE
+    return MIMETYPE
+
+
+def getResponseMimetype(request):
+    """
+    Returns the mimetype of the response to the specified flask request.
+    This is serialised protobuf if the client accepts it in preference to
+    JSON, and JSON otherwise.
+    """
+    return request.accept_mimetypes.best_match(
+        [MIMETYPE, PROTOBUF_MIMETYPE], MIMETYPE)
+
+
+def getRequestFields(request):
+    """
+    Returns the comma-separated list of the fields of the objects to
+    return for the specified flask request, given by its fields query
+    parameter or X-Fields header, or None if all fields are wanted.
+    """
+    fields = request.args.get("fields")
+    if fields is None:
+        fields = request.headers.get("X-Fields")
+    return fields
+
+
+def getRequestQualityEncoding(request):
+    """
+    Returns the encoding of the base qualities of reads in the JSON
+    response to the specified flask request, given by its qualityEncoding
+    query parameter or X-Quality-Encoding header, or None if qualities
+    are to be written as lists of integers.
+    """
+    qualityEncoding = request.args.get("qualityEncoding")
+    if qualityEncoding is None:
+        qualityEncoding = request.headers.get("X-Quality-Encoding")
+    return qualityEncoding
+
+
+def getRequestReadSampling(request):
+    """
+    Returns the (maxReadsPerWindow, windowSize) pair giving the
+    downsampling of the reads in the response to the specified flask
+    request, from its maxReadsPerWindow and windowSize query parameters
+    or X-Max-Reads-Per-Window and X-Window-Size headers. Either value is
+    None if it is not given.
+    """
+    values = []
+    for parameterName, headerName in [
+            ("maxReadsPerWindow", "X-Max-Reads-Per-Window"),
+            ("windowSize", "X-Window-Size")]:
+        value = request.args.get(parameterName)
+        if value is None:
+            value = request.headers.get(headerName)
+        values.append(value)
+    try:
+        return tuple(
+            int(value) if value is not None else None for value in values)
+    except ValueError:
+        raise exceptions.BadReadSamplingException(*values)
 
 
 def handleHttpPost(request, endpoint):
@@ -370,30 +469,36 @@ def handleHttpPost(request, endpoint):
     Handles the specified HTTP POST request, which maps to the specified
     protocol handler endpoint and protocol request class.
     """
-    if request.mimetype and request.mimetype != MIMETYPE:
+    if request.mimetype and request.mimetype not in [
+            MIMETYPE, PROTOBUF_MIMETYPE]:
         raise exceptions.UnsupportedMediaTypeException()
+    requestMimetype = getRequestMimetype(request)
+    responseMimetype = getResponseMimetype(request)
     request = request.get_data()
-    if request == '' or request is None:
+    if requestMimetype == MIMETYPE and (request == '' or request is None):
         request = '{}'
-    responseStr = endpoint(request)
-    return getFlaskResponse(responseStr)
+    responseStr = endpoint(request, requestMimetype, responseMimetype)
+    return getFlaskResponse(responseStr, mimetype=responseMimetype)
 
 
 def handleList(endpoint, request):
     """
     Handles the specified HTTP GET request, mapping to a list request
     """
-    responseStr = endpoint(request.get_data())
-    return getFlaskResponse(responseStr)
+    responseMimetype = getResponseMimetype(request)
+    responseStr = endpoint(
+        request.get_data(), getRequestMimetype(request), responseMimetype)
+    return getFlaskResponse(responseStr, mimetype=responseMimetype)
 
 
-def handleHttpGet(id_, endpoint):
+def handleHttpGet(id_, endpoint, mimetype=MIMETYPE):
     """
     Handles the specified HTTP GET request, which maps to the specified
-    protocol handler endpoint and protocol request class
+    protocol handler endpoint and protocol request class, returning a
+    response in the specified mimetype.
     """
-    responseStr = endpoint(id_)
-    return getFlaskResponse(responseStr)
+    responseStr = endpoint(id_, mimetype)
+    return getFlaskResponse(responseStr, mimetype=mimetype)
 
 
 def handleHttpOptions():
@@ -428,6 +533,11 @@ def handleException(exception):
                 or serverException.httpStatus == 403:
             message += "Please try <a href=\"/login\">logging in</a>."
         return message
+    elif flask.request and \
+            getResponseMimetype(flask.request) == PROTOBUF_MIMETYPE:
+        return getFlaskResponse(
+            error.SerializeToString(), serverException.httpStatus,
+            PROTOBUF_MIMETYPE)
     else:
         responseStr = protocol.toJson(error)
         return getFlaskResponse(responseStr, serverException.httpStatus)
@@ -455,6 +565,108 @@ def startLogin():
     return flask.redirect(result.url)
 
 
+@app.before_request
+def startRequestTimer():
+    """
+    Records the time at which handling of the request started, if metrics
+    are enabled, and starts timing the stages of the request if request
+    timing or the slow request log are enabled.
+    """
+    if app.metrics is not None:
+        flask.g.requestStartTime = time.time()
+    if (app.config.get('REQUEST_TIMING') or
+            app.config.get('SLOW_REQUEST_THRESHOLD') is not None):
+        timing.startTimer()
+
+
+def _observeStreamedResponse(pieces, endpoint, httpStatus, startTime):
+    """
+    Yields the specified pieces of a streamed response, recording the
+    request in the metrics once the response is complete.
+    """
+    numBytes = 0
+    for piece in pieces:
+        numBytes += len(piece)
+        yield piece
+    app.metrics.observeRequest(
+        endpoint, httpStatus, time.time() - startTime, numBytes)
+
+
+@app.after_request
+def observeRequest(response):
+    """
+    Records the endpoint, HTTP status, latency and size of the response
+    in the metrics, if they are enabled.
+    """
+    startTime = getattr(flask.g, 'requestStartTime', None)
+    if app.metrics is None or startTime is None:
+        return response
+    endpoint = "unknown"
+    if flask.request.url_rule is not None:
+        endpoint = flask.request.url_rule.rule
+    if response.is_streamed:
+        response.response = _observeStreamedResponse(
+            response.response, endpoint, response.status_code, startTime)
+    else:
+        app.metrics.observeRequest(
+            endpoint, response.status_code, time.time() - startTime,
+            response.calculate_content_length() or 0)
+    return response
+
+
+def _logSlowRequest(timer, path):
+    """
+    Logs the stage durations recorded by the specified timer for the
+    request to the specified path, if the request took longer than the
+    configured SLOW_REQUEST_THRESHOLD.
+    """
+    threshold = app.config.get('SLOW_REQUEST_THRESHOLD')
+    elapsedTime = timer.getElapsedTime()
+    if threshold is not None and elapsedTime > threshold:
+        stages = " ".join(
+            "{}={:.3f}".format(name, seconds)
+            for name, seconds in timer.getDurations())
+        app.logger.warning("Slow request to {}: {:.3f}s ({})".format(
+            path, elapsedTime, stages))
+
+
+def _finishStreamedTiming(pieces, timer, path):
+    """
+    Yields the specified pieces of a streamed response, then stops the
+    specified timer and logs the request if it was slow.
+    """
+    try:
+        for piece in pieces:
+            yield piece
+    finally:
+        if timing.getTimer() is timer:
+            timing.stopTimer()
+        _logSlowRequest(timer, path)
+
+
+@app.after_request
+def addServerTiming(response):
+    """
+    Adds the stage durations of the request to the response in the
+    Server-Timing header if request timing is enabled, and logs the
+    request if it was slow. The body of a streamed response is produced
+    after the headers are sent, so their Server-Timing header only
+    covers the stages up to the first piece of the response.
+    """
+    timer = timing.getTimer()
+    if timer is None:
+        return response
+    if app.config.get('REQUEST_TIMING'):
+        response.headers['Server-Timing'] = timer.getServerTimingHeader()
+    if response.is_streamed:
+        response.response = _finishStreamedTiming(
+            response.response, timer, flask.request.path)
+    else:
+        timing.stopTimer()
+        _logSlowRequest(timer, flask.request.path)
+    return response
+
+
 @app.before_request
 def checkAuthentication():
     """
@@ -489,7 +701,8 @@ def handleFlaskGetRequest(id_, flaskRequest, endpoint):
     Invokes the specified endpoint to generate a response.
     """
     if flaskRequest.method == "GET":
-        return handleHttpGet(id_, endpoint)
+        return handleHttpGet(
+            id_, endpoint, getResponseMimetype(flaskRequest))
     else:
         raise exceptions.MethodNotAllowedException()
 
@@ -609,6 +822,17 @@ def logout():
     return flask.redirect(url)
 
 
+def getMetrics():
+    """
+    Returns the server metrics in the Prometheus text format. This view
+    is routed to the METRICS_PATH given in the configuration.
+    """
+    if app.metrics is None:
+        raise exceptions.PathNotFoundException()
+    return flask.Response(
+        app.metrics.getPrometheusText(), content_type=METRICS_CONTENT_TYPE)
+
+
 @app.route('/favicon.ico')
 @app.route('/robots.txt')
 def robots():
@@ -656,8 +880,19 @@ def searchReadGroupSets():
 
 @DisplayedRoute('/reads/search', postMethod=True)
 def searchReads():
+    maxReadsPerWindow, windowSize = getRequestReadSampling(flask.request)
+    return handleFlaskPostRequest(
+        flask.request, functools.partial(
+            app.backend.runSearchReads,
+            fields=getRequestFields(flask.request),
+            qualityEncoding=getRequestQualityEncoding(flask.request),
+            maxReadsPerWindow=maxReadsPerWindow, windowSize=windowSize))
+
+
+@DisplayedRoute('/reads/coverage', postMethod=True)
+def readsCoverage():
     return handleFlaskPostRequest(
-        flask.request, app.backend.runSearchReads)
+        flask.request, app.backend.runReadsCoverage)
 
 
 @DisplayedRoute('/referencesets/search', postMethod=True)
@@ -681,7 +916,9 @@ def searchVariantSets():
 @DisplayedRoute('/variants/search', postMethod=True)
 def searchVariants():
     return handleFlaskPostRequest(
-        flask.request, app.backend.runSearchVariants)
+        flask.request, functools.partial(
+            app.backend.runSearchVariants,
+            fields=getRequestFields(flask.request)))
 
 
 @DisplayedRoute('/variantannotationsets/search', postMethod=True)
@@ -0,0 +1,200 @@
+"""
+Collection of request metrics, which are served in the Prometheus text
+exposition format.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bisect
+import threading
+
+import ga4gh.server.datamodel as datamodel
+
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = [
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+# Upper bounds of the page size and items per response histogram buckets
+COUNT_BUCKETS = [0, 1, 10, 100, 1000, 10000]
+
+
+def _formatLabels(labels):
+    """
+    Returns the specified list of (name, value) pairs formatted as a
+    Prometheus label set.
+    """
+    if len(labels) == 0:
+        return ""
+    escaped = [
+        '{}="{}"'.format(name, "{}".format(value).replace(
+            "\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels]
+    return "{" + ",".join(escaped) + "}"
+
+
+def _formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Histogram(object):
+    """
+    A histogram of observed values, counted into buckets with the
+    specified upper bounds.
+    """
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._bucketCounts = [0] * len(buckets)
+        self._sum = 0
+        self._count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        if index < len(self._buckets):
+            self._bucketCounts[index] += 1
+        self._sum += value
+        self._count += 1
+
+    def getSamples(self, labels):
+        """
+        Returns the (suffix, labels, value) samples describing this
+        histogram, with the specified labels added to each sample.
+        """
+        samples = []
+        cumulativeCount = 0
+        for bound, count in zip(self._buckets, self._bucketCounts):
+            cumulativeCount += count
+            samples.append(
+                ("_bucket", labels + [("le", _formatValue(bound))],
+                 cumulativeCount))
+        samples.append(("_bucket", labels + [("le", "+Inf")], self._count))
+        samples.append(("_sum", labels, self._sum))
+        samples.append(("_count", labels, self._count))
+        return samples
+
+
+class Metrics(object):
+    """
+    Records the number, latency and size of the responses to the
+    requests made to each endpoint, along with the page size and number
+    of items of search responses. Further metrics are read at collection
+    time from the collector functions added to this object, each of which
+    returns a list of (name, type, help, samples) tuples, where samples
+    is a list of (labels, value) pairs.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requestCounts = {}
+        self._requestLatencies = {}
+        self._responseBytes = {}
+        self._pageSizes = {}
+        self._responseItems = {}
+        self._collectors = [fileHandleCacheCollector]
+
+    def addCollector(self, collector):
+        self._collectors.append(collector)
+
+    def observeRequest(self, endpoint, httpStatus, latency, numBytes):
+        """
+        Records a request to the specified endpoint, which was answered
+        with the specified HTTP status and number of bytes in the
+        specified number of seconds.
+        """
+        with self._lock:
+            key = endpoint, httpStatus
+            self._requestCounts[key] = self._requestCounts.get(key, 0) + 1
+            if endpoint not in self._requestLatencies:
+                self._requestLatencies[endpoint] = Histogram(LATENCY_BUCKETS)
+            self._requestLatencies[endpoint].observe(latency)
+            self._responseBytes[endpoint] = (
+                self._responseBytes.get(endpoint, 0) + numBytes)
+
+    def observeSearch(self, requestName, pageSize, numItems):
+        """
+        Records a search response to the request with the specified class
+        name, which asked for the specified page size and returned the
+        specified number of items.
+        """
+        with self._lock:
+            if requestName not in self._pageSizes:
+                self._pageSizes[requestName] = Histogram(COUNT_BUCKETS)
+                self._responseItems[requestName] = Histogram(COUNT_BUCKETS)
+            self._pageSizes[requestName].observe(pageSize)
+            self._responseItems[requestName].observe(numItems)
+
+    def _getHistogramSamples(self, histograms, labelName):
+        samples = []
+        for key, histogram in sorted(histograms.items()):
+            samples.extend(histogram.getSamples([(labelName, key)]))
+        return samples
+
+    def _getMetrics(self):
+        """
+        Returns the list of (name, type, help, samples) tuples describing
+        all metrics, where samples is a list of (suffix, labels, value)
+        tuples.
+        """
+        with self._lock:
+            metrics = [
+                ("ga4gh_requests_total", "counter",
+                 "Number of requests by endpoint and HTTP status.",
+                 [("", [("endpoint", endpoint), ("status", status)], count)
+                  for (endpoint, status), count in sorted(
+                      self._requestCounts.items())]),
+                ("ga4gh_request_duration_seconds", "histogram",
+                 "Time taken to answer requests by endpoint.",
+                 self._getHistogramSamples(
+                     self._requestLatencies, "endpoint")),
+                ("ga4gh_response_bytes_total", "counter",
+                 "Number of bytes in responses by endpoint.",
+                 [("", [("endpoint", endpoint)], numBytes)
+                  for endpoint, numBytes in sorted(
+                      self._responseBytes.items())]),
+                ("ga4gh_search_page_size", "histogram",
+                 "Page size of search requests by request type.",
+                 self._getHistogramSamples(self._pageSizes, "request")),
+                ("ga4gh_search_response_items", "histogram",
+                 "Number of items in search responses by request type.",
+                 self._getHistogramSamples(self._responseItems, "request")),
+            ]
+        for collector in self._collectors:
+            for name, type_, help_, samples in collector():
+                metrics.append((name, type_, help_, [
+                    ("", labels, value) for labels, value in samples]))
+        return metrics
+
+    def getPrometheusText(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for name, type_, help_, samples in self._getMetrics():
+            lines.append("# HELP {} {}".format(name, help_))
+            lines.append("# TYPE {} {}".format(name, type_))
+            for suffix, labels, value in samples:
+                lines.append("{}{}{} {}".format(
+                    name, suffix, _formatLabels(labels), _formatValue(value)))
+        return "\n".join(lines) + "\n"
+
+
+def fileHandleCacheCollector():
+    """
+    Returns the metrics describing the use of the file handle cache.
+    """
+    cache = datamodel.fileHandleCache
+    return [
+        ("ga4gh_file_handle_cache_handles", "gauge",
+         "Number of open file handles in the cache.",
+         [([], cache.getNumHandles())]),
+        ("ga4gh_file_handle_cache_hits_total", "counter",
+         "Number of file handles found in the cache.",
+         [([], cache.getHitCount())]),
+        ("ga4gh_file_handle_cache_misses_total", "counter",
+         "Number of file handles opened because they were not cached.",
+         [([], cache.getMissCount())]),
+        ("ga4gh_file_handle_cache_evictions_total", "counter",
+         "Number of file handles evicted from the cache.",
+         [([], cache.getEvictionCount())]),
+    ]
@@ -6,8 +6,11 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
+import time
 
 import ga4gh.server.exceptions as exceptions
+import ga4gh.server.response_builder as response_builder
 
 
 def _parsePageToken(pageToken, numValues):
@@ -68,11 +71,7 @@ class IntervalIterator(object):
         if not request.page_token:
             self._initialiseIteration()
         else:
-            # Set the search start point and the number of records to skip from
-            # the page token.
-            searchAnchor, objectsToSkip = _parsePageToken(
-                request.page_token, 2)
-            self._pickUpIteration(searchAnchor, objectsToSkip)
+            self._resumeIteration(request.page_token)
 
     def _extractProtocolObject(self, obj):
         """
@@ -80,6 +79,21 @@ class IntervalIterator(object):
         """
         return obj
 
+    def _resumeIteration(self, pageToken):
+        """
+        Resumes iteration from the specified page token.
+        """
+        # Set the search start point and the number of records to skip from
+        # the page token.
+        searchAnchor, objectsToSkip = _parsePageToken(pageToken, 2)
+        self._pickUpIteration(searchAnchor, objectsToSkip)
+
+    def _getNextPageToken(self):
+        """
+        Returns the page token that resumes iteration at the next object.
+        """
+        return "{}:{}".format(self._searchAnchor, self._distanceFromAnchor)
+
     def _initialiseIteration(self):
         """
         Starts a new iteration.
@@ -147,8 +161,7 @@ class IntervalIterator(object):
                 self._distanceFromAnchor = 0
             else:
                 self._distanceFromAnchor += 1
-            nextPageToken = "{}:{}".format(
-                self._searchAnchor, self._distanceFromAnchor)
+            nextPageToken = self._getNextPageToken()
         ret = self._extractProtocolObject(self._currentObject), nextPageToken
         self._currentObject = self._nextObject
         self._nextObject = next(self._searchIterator, None)
@@ -157,21 +170,45 @@ class IntervalIterator(object):
     def __iter__(self):
         return self
 
+    def close(self):
+        """
+        Closes the search iterator, releasing the file handle it reads
+        from.
+        """
+        if hasattr(self._searchIterator, "close"):
+            self._searchIterator.close()
+        self._currentObject = None
+        self._nextObject = None
+
 
 class ReadsIntervalIterator(IntervalIterator):
     """
-    An interval iterator for reads
+    An interval iterator for reads. Fields of the reads that are not in
+    the specified fieldMask may be left unset. If a referenceWindow is
+    given, the reference bases of the CIGAR units of the reads are read
+    from it. If a readSampler is given, only the reads it keeps are
+    returned. If a qualityEncoding is given, the reads are returned as
+    EncodedQualitiesValues holding their qualities in this encoding.
     """
-    def __init__(self, request, parentContainer, reference):
+    def __init__(
+            self, request, parentContainer, reference, fieldMask=None,
+            referenceWindow=None, readSampler=None, qualityEncoding=None):
         self._reference = reference
+        self._fieldMask = fieldMask
+        self._referenceWindow = referenceWindow
+        self._readSampler = readSampler
+        self._qualityEncoding = qualityEncoding
         super(ReadsIntervalIterator, self).__init__(request, parentContainer)
 
     def _search(self, start, end):
         return self._parentContainer.getReadAlignments(
-            self._reference, start, end)
+            self._reference, start, end, self._fieldMask,
+            self._referenceWindow, self._readSampler, self._qualityEncoding)
 
     @classmethod
     def _getStart(cls, readAlignment):
+        if isinstance(readAlignment, response_builder.EncodedQualitiesValue):
+            readAlignment = readAlignment.getValue()
         if readAlignment.alignment.position.position == 0:
             # unmapped read with mapped mate; see SAM standard 2.4.1
             return readAlignment.next_mate_position.position
@@ -181,6 +218,8 @@ class ReadsIntervalIterator(IntervalIterator):
 
     @classmethod
     def _getEnd(cls, readAlignment):
+        if isinstance(readAlignment, response_builder.EncodedQualitiesValue):
+            readAlignment = readAlignment.getValue()
         return (
             cls._getStart(readAlignment) +
             len(readAlignment.aligned_sequence))
@@ -188,12 +227,112 @@ class ReadsIntervalIterator(IntervalIterator):
 
 class VariantsIntervalIterator(IntervalIterator):
     """
-    An interval iterator for variants
+    An interval iterator for variants. When virtualOffsets is True and
+    the variant set supports it, page tokens take the form
+    anchor:skip:virtualOffset:fileIdentity, where virtualOffset is the
+    BGZF virtual offset at which the record of the first variant of the
+    next page begins. The next page then seeks a file handle of its own
+    to that offset and reads the records of the region sequentially from
+    there, rather than searching again from the anchor, and checks that
+    the first variant it reads is consistent with the anchor. Plain
+    anchor:skip tokens are always accepted, and are used as a fallback
+    whenever the offset cannot be trusted. Fields of the variants that
+    are not in the specified fieldMask may be left unset.
     """
+    def __init__(
+            self, request, parentContainer, virtualOffsets=False,
+            fieldMask=None):
+        self._fieldMask = fieldMask
+        self._useVirtualOffsets = (
+            virtualOffsets and parentContainer.supportsVirtualOffsets())
+        self._fileIdentity = None
+        self._nextObjectVirtualOffset = None
+        if self._useVirtualOffsets:
+            self._fileIdentity = parentContainer.getFileIdentity(
+                request.reference_name)
+            self._useVirtualOffsets = self._fileIdentity is not None
+        super(VariantsIntervalIterator, self).__init__(
+            request, parentContainer)
+
     def _search(self, start, end):
-        return self._parentContainer.getVariants(
-            self._request.reference_name, start, end,
-            self._request.call_set_ids)
+        if self._useVirtualOffsets:
+            return self._trackVirtualOffsets(
+                self._parentContainer.getVariantsWithOffsets(
+                    self._request.reference_name, start, end,
+                    self._request.call_set_ids, self._fieldMask))
+        else:
+            return self._parentContainer.getVariants(
+                self._request.reference_name, start, end,
+                self._request.call_set_ids, self._fieldMask)
+
+    def _trackVirtualOffsets(self, pairs):
+        """
+        Yields the variants from the specified (variant, virtualOffset)
+        pairs, recording the virtual offset at which the most recently
+        yielded variant begins. As the look-ahead object is always the
+        last one read, this is the offset of _nextObject.
+        """
+        try:
+            for variant, virtualOffset in pairs:
+                self._nextObjectVirtualOffset = virtualOffset
+                yield variant
+        finally:
+            pairs.close()
+
+    def _resumeIteration(self, pageToken):
+        if len(pageToken.split(":")) != 4:
+            super(VariantsIntervalIterator, self)._resumeIteration(pageToken)
+            return
+        searchAnchor, objectsToSkip, virtualOffset, fileIdentity = \
+            _parsePageToken(pageToken, 4)
+        if not (self._useVirtualOffsets and
+                fileIdentity == self._fileIdentity and
+                self._seekIteration(
+                    searchAnchor, objectsToSkip, virtualOffset)):
+            self._pickUpIteration(searchAnchor, objectsToSkip)
+
+    def _seekIteration(self, searchAnchor, objectsToSkip, virtualOffset):
+        """
+        Attempts to resume iteration by reading the records of the region
+        sequentially from the specified virtual offset. Returns False if
+        no record can be read there, or if the first one is not
+        consistent with the search anchor, in which case the offset does
+        not match the page token.
+        """
+        self._searchAnchor = searchAnchor
+        self._distanceFromAnchor = objectsToSkip
+        self._nextObjectVirtualOffset = virtualOffset
+        self._searchIterator = self._trackVirtualOffsets(
+            self._parentContainer.getVariantsFromOffset(
+                self._request.reference_name, self._request.start,
+                self._request.end if self._request.end != 0 else None,
+                virtualOffset, self._request.call_set_ids, self._fieldMask))
+        try:
+            obj = next(self._searchIterator, None)
+        except (ValueError, IOError, OSError):
+            obj = None
+        if obj is not None:
+            start = self._getStart(obj)
+            # Past the initial set of intervals, the next object always
+            # starts at the search anchor.
+            if start != searchAnchor and not (
+                    searchAnchor == self._request.start and
+                    start < searchAnchor):
+                obj = None
+        if obj is None:
+            self._searchIterator.close()
+            self._nextObjectVirtualOffset = None
+            return False
+        self._currentObject = obj
+        self._nextObject = next(self._searchIterator, None)
+        return True
+
+    def _getNextPageToken(self):
+        if self._nextObjectVirtualOffset is None:
+            return super(VariantsIntervalIterator, self)._getNextPageToken()
+        return "{}:{}:{}:{}".format(
+            self._searchAnchor, self._distanceFromAnchor,
+            self._nextObjectVirtualOffset, self._fileIdentity)
 
     @classmethod
     def _getStart(cls, variant):
@@ -218,8 +357,15 @@ class VariantAnnotationsIntervalIterator(IntervalIterator):
             self._effects = self._request.effects
 
     def _search(self, start, end):
+        # Annotations without any of the requested effects are dropped
+        # by the annotation set before they are converted.
+        effectTermIds = None
+        if len(self._request.effects) != 0:
+            effectTermIds = [
+                effect.term_id for effect in self._request.effects
+                if effect.term_id != ""]
         return self._parentContainer.getVariantAnnotations(
-            self._request.reference_name, start, end)
+            self._request.reference_name, start, end, effectTermIds)
 
     def _extractProtocolObject(self, pair):
         variant, annotation = pair
@@ -319,8 +465,7 @@ class SequenceIterator(object):
         self._nextPageTokenIndex = 0
         self._objectIndex = 0
         if self._request.page_token:
-            self._nextPageTokenIndex, = _parsePageToken(
-                self._request.page_token, 1)
+            self._resumeFromPageToken(self._request.page_token)
         self._numToReturn = self._request.page_size
         self._objectList = self._search()
         self._objectListLength = len(self._objectList)
@@ -345,15 +490,28 @@ class SequenceIterator(object):
         """
         raise NotImplementedError()
 
+    def _resumeFromPageToken(self, pageToken):
+        """
+        Sets up the iteration state described by the specified page token
+        """
+        self._nextPageTokenIndex, = _parsePageToken(pageToken, 1)
+
+    def _getNextPageToken(self):
+        """
+        Returns the page token that resumes iteration after the current
+        object
+        """
+        return str(self._nextPageTokenIndex)
+
     def next(self):
         if (self._numToReturn <= 0 or self._objectIndex >=
                 self._objectListLength):
             raise StopIteration()
         obj = self._objectList[self._objectIndex]
         self._nextPageTokenIndex += 1
-        nextPageToken = str(self._nextPageTokenIndex)
-        if self._objectIndex == self._objectListLength - 1:
-            nextPageToken = None
+        nextPageToken = None
+        if self._objectIndex < self._objectListLength - 1:
+            nextPageToken = self._getNextPageToken()
         preparedObj = self._prepare(obj)
         self._objectIndex += 1
         self._numToReturn -= 1
@@ -402,9 +560,35 @@ class FeaturesIterator(SequenceIterator):
         else:
             self._start = self._request.start
             self._end = self._request.end
-        self._startIndex = self._request.page_token
+        self._startIndex = None
+        self._lastKey = None
         self._maxResults = self._request.page_size
 
+    def _resumeFromPageToken(self, pageToken):
+        """
+        Page tokens are either the integer offset of the next feature, or
+        the referenceName:start:end:featureId key of the last feature
+        returned for FeatureSets that support keyset paging.
+        """
+        if ":" not in pageToken:
+            super(FeaturesIterator, self)._resumeFromPageToken(pageToken)
+            self._startIndex = self._nextPageTokenIndex
+            return
+        # Reference names may themselves contain colons
+        tokens = pageToken.rsplit(":", 3)
+        if len(tokens) != 4:
+            msg = "Invalid number of values in page token"
+            raise exceptions.BadPageTokenException(msg)
+        start, end, featureId = _parsePageToken(":".join(tokens[1:]), 3)
+        self._lastKey = tokens[0], start, end, featureId
+
+    def _getNextPageToken(self):
+        pageKey = self._featureSet.getPageKey(
+            self._objectList[self._objectIndex])
+        if pageKey is None:
+            return super(FeaturesIterator, self)._getNextPageToken()
+        return "{}:{}:{}:{}".format(*pageKey)
+
     def _search(self):
         iterator = list(self._featureSet.getFeatures(
             self._request.reference_name,
@@ -415,7 +599,8 @@ class FeaturesIterator(SequenceIterator):
             self._request.feature_types,
             self._parentId,
             self._request.name,
-            self._request.gene_symbol))
+            self._request.gene_symbol,
+            lastKey=self._lastKey))
         return iterator
 
     def _prepare(self, obj):
@@ -424,7 +609,9 @@ class FeaturesIterator(SequenceIterator):
 
 class ContinuousIterator(SequenceIterator):
     """
-    Iterates through continuous data
+    Iterates through continuous data. Page tokens hold the position on
+    the reference at which the next object starts, so that each page
+    reads only its own values from the underlying file.
     """
     def __init__(self, request, continuousSet):
         self._continuousSet = continuousSet
@@ -436,19 +623,27 @@ class ContinuousIterator(SequenceIterator):
         else:
             self._start = self._request.start
             self._end = self._request.end
-        self._startIndex = self._request.page_token
+        self._resumePosition = None
+        if self._request.page_token:
+            self._resumePosition, = _parsePageToken(
+                self._request.page_token, 1)
         self._maxResults = self._request.page_size
 
     def _search(self):
         iterator = list(self._continuousSet.getContinuous(
             self._request.reference_name,
             self._start,
-            self._end))
+            self._end,
+            self._resumePosition,
+            self._maxResults))
         return iterator
 
     def _prepare(self, obj):
         return obj
 
+    def _getNextPageToken(self):
+        return str(self._objectList[self._objectIndex + 1].start)
+
 
 class PeerIterator(SequenceIterator):
     """
@@ -473,3 +668,86 @@ class PeerIterator(SequenceIterator):
 
     def _prepare(self, obj):
         return obj.toProtocolElement()
+
+
+class CursorCache(object):
+    """
+    A bounded LRU registry of live iterators, keyed by the page token
+    they were suspended at and the normalised request that created them.
+    A search that presents the token can then continue from the open
+    iterator, rather than parsing the token and seeking afresh. Cursors
+    are evicted when the cache holds more than maxSize of them, or
+    when they have been idle for more than timeToLive seconds.
+    """
+    def __init__(self, maxSize, timeToLive):
+        if maxSize <= 0:
+            raise ValueError(
+                "The size of the cache must be a strictly positive value")
+        self._maxSize = maxSize
+        self._timeToLive = timeToLive
+        self._cursors = collections.OrderedDict()
+        self._hitCount = 0
+        self._missCount = 0
+        self._evictionCount = 0
+
+    def _evict(self, now):
+        """
+        Removes expired cursors, and then the least recently used cursors
+        until the cache is within its maximum size.
+        """
+        while len(self._cursors) > 0:
+            key, (iterator, lastUsed) = next(self._cursors.iteritems())
+            if (len(self._cursors) <= self._maxSize and
+                    now - lastUsed <= self._timeToLive):
+                break
+            del self._cursors[key]
+            self._closeCursor(iterator)
+            self._evictionCount += 1
+
+    def _closeCursor(self, iterator):
+        """
+        Closes the specified evicted iterator, if it can be closed, so that
+        the file handles it pins are released without waiting for it to
+        be garbage collected.
+        """
+        if hasattr(iterator, "close"):
+            iterator.close()
+
+    def add(self, requestKey, pageToken, iterator):
+        """
+        Suspends the specified iterator, which will resume iteration from
+        the specified page token of the specified request.
+        """
+        now = time.time()
+        entry = self._cursors.pop((requestKey, pageToken), None)
+        if entry is not None and entry[0] is not iterator:
+            self._closeCursor(entry[0])
+        self._cursors[requestKey, pageToken] = iterator, now
+        self._evict(now)
+
+    def take(self, requestKey, pageToken):
+        """
+        Removes and returns the iterator suspended at the specified page
+        token of the specified request, or None if there is no such
+        iterator.
+        """
+        now = time.time()
+        self._evict(now)
+        entry = self._cursors.pop((requestKey, pageToken), None)
+        if entry is None:
+            self._missCount += 1
+            return None
+        self._hitCount += 1
+        return entry[0]
+
+    def getNumCursors(self):
+        return len(self._cursors)
+
+    def getHitCount(self):
+        return self._hitCount
+
+    def getMissCount(self):
+        return self._missCount
+
+    def getEvictionCount(self):
+        return self._evictionCount
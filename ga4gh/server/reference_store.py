@@ -0,0 +1,142 @@
+"""
+A compiled store of the bases of a reference set, built when the
+reference set is added to the repository so that bases can be sliced
+from a memory map rather than read through a FASTA file handle. The
+memory map is backed by the page cache, and so is shared by all the
+server processes on a host. The store is a single file written next to
+the FASTA file, holding the bases of each reference as they are in the
+FASTA file, soft-masked lower case bases included, one byte per base,
+followed by a JSON description of their layout and a fixed-size trailer
+holding TRAILER_MAGIC and the offset of the JSON description as a
+uint64.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import mmap
+import os
+import struct
+
+
+FORMAT_VERSION = 2
+# Suffix added to the path of a FASTA file to give the path of its
+# reference store.
+REFERENCE_STORE_SUFFIX = ".bases"
+TRAILER_MAGIC = b"GA4GHREF"
+
+_trailer = struct.Struct(str("<8sQ"))
+
+
+def getReferenceStorePath(dataUrl):
+    """
+    Returns the path of the reference store of the specified FASTA file.
+    """
+    return dataUrl + REFERENCE_STORE_SUFFIX
+
+
+def getFileStamp(dataUrl):
+    """
+    Returns a string identifying the current version of the specified
+    FASTA file.
+    """
+    stat = os.stat(dataUrl)
+    return "{}:{}".format(stat.st_size, int(stat.st_mtime))
+
+
+class ReferenceStoreWriter(object):
+    """
+    Writes the reference store of the specified FASTA file to the
+    specified path. The bases of each reference are added in chunks, one
+    reference at a time. The store is written to a temporary file that
+    replaces any existing store when it is closed, so that servers
+    holding the existing store open keep reading it.
+    """
+    def __init__(self, path, dataUrl):
+        self._path = path
+        self._file = open(path + ".tmp", "wb")
+        self._offset = 0
+        self._fileStamp = getFileStamp(dataUrl)
+        self._references = {}
+        self._referenceName = None
+
+    def beginReference(self, name):
+        """
+        Starts the bases of the specified reference.
+        """
+        if name in self._references:
+            raise ValueError(
+                "The bases of reference '{}' were already added".format(name))
+        self._referenceName = name
+        self._references[name] = [self._offset, 0]
+
+    def addBases(self, bases):
+        """
+        Appends the specified bases to the current reference.
+        """
+        self._file.write(bases)
+        self._offset += len(bases)
+        self._references[self._referenceName][1] += len(bases)
+
+    def close(self):
+        """
+        Finishes the store by writing its description and trailer.
+        """
+        description = {
+            "formatVersion": FORMAT_VERSION,
+            "fileStamp": self._fileStamp,
+            "references": self._references,
+        }
+        self._file.write(json.dumps(description).encode("utf-8"))
+        self._file.write(_trailer.pack(TRAILER_MAGIC, self._offset))
+        self._file.close()
+        os.rename(self._file.name, self._path)
+
+
+class ReferenceStore(object):
+    """
+    The memory-mapped reference store read from the specified path.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as storeFile:
+            size = os.fstat(storeFile.fileno()).st_size
+            if size < _trailer.size:
+                raise ValueError("Invalid reference store '{}'".format(path))
+            self._map = mmap.mmap(
+                storeFile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, offset = _trailer.unpack_from(self._map, size - _trailer.size)
+        if magic != TRAILER_MAGIC:
+            raise ValueError("Invalid reference store '{}'".format(path))
+        description = json.loads(
+            self._map[offset:size - _trailer.size].decode("utf-8"))
+        if description["formatVersion"] != FORMAT_VERSION:
+            raise ValueError(
+                "Unsupported reference store version {} in '{}'".format(
+                    description["formatVersion"], path))
+        self._fileStamp = description["fileStamp"]
+        self._references = description["references"]
+
+    def close(self):
+        self._map.close()
+
+    def isCurrent(self, dataUrl):
+        """
+        Returns True if this store was built from the current version of
+        the specified FASTA file.
+        """
+        return self._fileStamp == getFileStamp(dataUrl)
+
+    def hasReference(self, name):
+        return name in self._references
+
+    def getBases(self, name, start, end):
+        """
+        Returns the bases of the specified reference from start
+        (inclusive) to end (exclusive), truncated at the end of the
+        reference.
+        """
+        offset, length = self._references[name]
+        start = max(0, min(start, length))
+        end = max(start, min(end, length))
+        return self._map[offset + start:offset + end]
@@ -102,6 +102,9 @@ class Variantset(BaseModel):
     dataurlindexmap = pw.TextField(db_column='dataUrlIndexMap')
     datasetid = pw.ForeignKeyField(
         db_column='datasetId', rel_model=Dataset, to_field='id')
+    # Registries created before schema 2.2 have no format column, and
+    # hold only VCF variant sets.
+    format = pw.TextField(default='vcf', null=True)
     id = pw.TextField(primary_key=True)
     metadata = pw.TextField(null=True)
     name = pw.TextField()
@@ -5,21 +5,123 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import base64
+import json
+
+import ga4gh.server.exceptions as exceptions
+
 import ga4gh.schemas.pb as pb
 import ga4gh.schemas.protocol as protocol
 
 
+PHRED33_QUALITY_ENCODING = "phred33"
+BASE64_QUALITY_ENCODING = "base64"
+QUALITY_ENCODINGS = [PHRED33_QUALITY_ENCODING, BASE64_QUALITY_ENCODING]
+QUALITY_FIELD_NAME = "aligned_quality"
+
+# Maps each quality byte to its Phred+33 character.
+_phred33Table = bytes(bytearray((i + 33) % 256 for i in range(256)))
+
+
+def encodeQualities(qualities, qualityEncoding):
+    """
+    Returns the specified sequence of base qualities as a string in the
+    specified encoding: either a Phred+33 string, as in the QUAL field of
+    SAM, or the base64 encoding of the qualities as bytes. The qualities
+    may be given as a list of integers or as an array of unsigned bytes,
+    such as the query_qualities of a pysam read.
+    """
+    data = bytes(bytearray(qualities))
+    if qualityEncoding == PHRED33_QUALITY_ENCODING:
+        return data.translate(_phred33Table).decode("latin-1")
+    elif qualityEncoding == BASE64_QUALITY_ENCODING:
+        return base64.b64encode(data).decode("ascii")
+    else:
+        raise exceptions.UnsupportedQualityEncodingException(
+            qualityEncoding)
+
+
+class EncodedQualitiesValue(object):
+    """
+    A value returned by an object generator together with its base
+    qualities, already written as a string in a quality encoding, or
+    None if it has none. The qualities are not set in the value itself,
+    so that reads converted for an encoded response are not copied to
+    remove them.
+    """
+    def __init__(self, value, encodedQualities):
+        self._value = value
+        self._encodedQualities = encodedQualities
+
+    def getValue(self):
+        return self._value
+
+    def getEncodedQualities(self):
+        return self._encodedQualities
+
+
+def _splitValue(value):
+    """
+    Returns the (protocolElement, encodedQualities) pair of the specified
+    value added to a response builder.
+    """
+    if isinstance(value, EncodedQualitiesValue):
+        return value.getValue(), value.getEncodedQualities()
+    return value, None
+
+
+def _getValueDescriptor(responseClass):
+    """
+    Returns the descriptor of the values listed in the specified
+    SearchResponse class.
+    """
+    valueListName = protocol.getValueListName(responseClass)
+    return responseClass.DESCRIPTOR.fields_by_name[
+        valueListName].message_type
+
+
+def parseFieldMask(responseClass, fields):
+    """
+    Returns the field mask given by the specified comma-separated list of
+    the fields of the values listed in the specified SearchResponse
+    class, as the frozenset of their protobuf field names. Fields may be
+    named by their protobuf or JSON names. Only top-level fields are
+    masked, so a path such as alignment.position keeps the whole of the
+    alignment field.
+    """
+    descriptor = _getValueDescriptor(responseClass)
+    fieldNames = {}
+    for field in descriptor.fields:
+        fieldNames[field.name] = field.name
+        fieldNames[field.camelcase_name] = field.name
+    fieldMask = set()
+    for path in fields.split(","):
+        name = path.strip().split(".")[0]
+        if name == "":
+            continue
+        if name not in fieldNames:
+            raise exceptions.BadFieldMaskException(name)
+        fieldMask.add(fieldNames[name])
+    return frozenset(fieldMask)
+
+
 class SearchResponseBuilder(object):
     """
     A class to allow sequential building of SearchResponse objects.
     """
-    def __init__(self, responseClass, pageSize, maxBufferSize):
+    def __init__(
+            self, responseClass, pageSize, maxBufferSize, fieldMask=None,
+            qualityEncoding=None):
         """
         Allocates a new SearchResponseBuilder for the specified
         responseClass, user-requested pageSize and the system mandated
         maxBufferSize (in bytes). The maxBufferSize is an
         approximate limit on the overall length of the serialised
-        response.
+        response. If a fieldMask is given, as returned by parseFieldMask,
+        only the masked fields of the values are included in the
+        response. If a qualityEncoding is given, the base qualities of
+        the values are written to the JSON response as a string in this
+        encoding rather than as a list of integers.
         """
         self._pageSize = pageSize
         self._maxBufferSize = maxBufferSize
@@ -28,6 +130,21 @@ class SearchResponseBuilder(object):
         self._protoObject = responseClass()
         self._valueListName = protocol.getValueListName(responseClass)
         self._bufferSize = self._protoObject.ByteSize()
+        valueDescriptor = _getValueDescriptor(responseClass)
+        self._clearedFields = []
+        self._encodedQualities = []
+        if fieldMask is not None:
+            self._clearedFields = [
+                str(field.name) for field in valueDescriptor.fields
+                if field.name not in fieldMask]
+        if (qualityEncoding is not None and
+                qualityEncoding not in QUALITY_ENCODINGS):
+            raise exceptions.UnsupportedQualityEncodingException(
+                qualityEncoding)
+        # The encoding only applies to values that have base qualities.
+        self._qualityEncoding = None
+        if QUALITY_FIELD_NAME in valueDescriptor.fields_by_name:
+            self._qualityEncoding = qualityEncoding
 
     def getPageSize(self):
         """
@@ -45,6 +162,13 @@ class SearchResponseBuilder(object):
         """
         return self._maxBufferSize
 
+    def getNumElements(self):
+        """
+        Returns the number of elements added to the value list for this
+        SearchResponseBuilder.
+        """
+        return self._numElements
+
     def getNextPageToken(self):
         """
         Returns the value of the nextPageToken for this
@@ -61,13 +185,26 @@ class SearchResponseBuilder(object):
     def addValue(self, protocolElement):
         """
         Appends the specified protocolElement to the value list for this
-        response.
+        response. The protocolElement may be an EncodedQualitiesValue.
         """
+        protocolElement, encodedQualities = _splitValue(protocolElement)
         self._numElements += 1
-        self._bufferSize += protocolElement.ByteSize()
         attr = getattr(self._protoObject, self._valueListName)
         obj = attr.add()
-        obj.CopyFrom(protocolElement)
+        self._copyMaskedValue(protocolElement, obj)
+        self._encodedQualities.append(encodedQualities)
+        self._bufferSize += obj.ByteSize()
+        if encodedQualities is not None:
+            self._bufferSize += len(encodedQualities)
+
+    def _copyMaskedValue(self, protocolElement, target):
+        """
+        Copies the fields of the specified protocolElement that are in the
+        field mask of this builder into the specified target.
+        """
+        target.CopyFrom(protocolElement)
+        for fieldName in self._clearedFields:
+            target.ClearField(fieldName)
 
     def isFull(self):
         """
@@ -84,11 +221,132 @@ class SearchResponseBuilder(object):
             (self._bufferSize >= self._maxBufferSize)
         )
 
+    def _valueToJson(self, protocolElement, encodedQualities=None):
+        """
+        Returns the specified value serialised as JSON, with its base
+        qualities in the quality encoding of this builder, if any. The
+        qualities of values that were not converted with them encoded, so
+        that encodedQualities is None, are encoded from the value.
+        """
+        if self._qualityEncoding is None:
+            return protocol.toJson(protocolElement)
+        if QUALITY_FIELD_NAME in self._clearedFields:
+            encodedQualities = None
+        elif encodedQualities is None:
+            qualities = getattr(protocolElement, QUALITY_FIELD_NAME)
+            if len(qualities) > 0:
+                encodedQualities = encodeQualities(
+                    qualities, self._qualityEncoding)
+                element = type(protocolElement)()
+                element.CopyFrom(protocolElement)
+                element.ClearField(str(QUALITY_FIELD_NAME))
+                protocolElement = element
+        if not encodedQualities:
+            return protocol.toJson(protocolElement)
+        s = protocol.toJson(protocolElement).strip()
+        qualityJson = '"{}": {}'.format(
+            protocolElement.DESCRIPTOR.fields_by_name[
+                QUALITY_FIELD_NAME].camelcase_name,
+            json.dumps(encodedQualities))
+        if s == "{}":
+            return "{" + qualityJson + "}"
+        return "{" + qualityJson + ", " + s[1:]
+
+    def _getJsonResponseStart(self):
+        """
+        Returns the opening of the JSON response and of its value list.
+        """
+        valueListField = self._protoObject.DESCRIPTOR.fields_by_name[
+            self._valueListName]
+        return '{{"{}": ['.format(valueListField.camelcase_name)
+
+    def _getJsonResponseEnd(self):
+        """
+        Returns the closing of the value list of the JSON response,
+        followed by the nextPageToken and the closing of the response.
+        """
+        s = "]"
+        if self._nextPageToken:
+            s += ', "nextPageToken": {}'.format(json.dumps(
+                pb.string(self._nextPageToken)))
+        return s + "}"
+
     def getSerializedResponse(self):
         """
         Returns a string version of the SearchResponse that has
         been built by this SearchResponseBuilder.
         """
+        if self._qualityEncoding is not None:
+            values = getattr(self._protoObject, self._valueListName)
+            return (
+                self._getJsonResponseStart() +
+                ", ".join(
+                    self._valueToJson(value, encodedQualities)
+                    for value, encodedQualities in zip(
+                        values, self._encodedQualities)) +
+                self._getJsonResponseEnd())
         self._protoObject.next_page_token = pb.string(self._nextPageToken)
         s = protocol.toJson(self._protoObject)
         return s
+
+    def getSerializedBinaryResponse(self):
+        """
+        Returns the SearchResponse that has been built by this
+        SearchResponseBuilder in the protobuf binary wire format.
+        """
+        self._protoObject.next_page_token = pb.string(self._nextPageToken)
+        return self._protoObject.SerializeToString()
+
+
+class StreamingSearchResponseBuilder(SearchResponseBuilder):
+    """
+    A SearchResponseBuilder that serialises each value as JSON when it
+    is added, rather than copying it into a single SearchResponse object.
+    The serialised response is taken from the builder in pieces, so that
+    it can be written to the client while the search is in progress.
+    """
+    def __init__(
+            self, responseClass, pageSize, maxBufferSize, fieldMask=None,
+            qualityEncoding=None):
+        super(StreamingSearchResponseBuilder, self).__init__(
+            responseClass, pageSize, maxBufferSize, fieldMask,
+            qualityEncoding)
+        self._pendingJson = [self._getJsonResponseStart()]
+
+    def addValue(self, protocolElement):
+        """
+        Serialises the specified protocolElement as the next member of
+        the value list for this response. The protocolElement may be an
+        EncodedQualitiesValue.
+        """
+        protocolElement, encodedQualities = _splitValue(protocolElement)
+        if self._numElements > 0:
+            self._pendingJson.append(", ")
+        self._numElements += 1
+        if len(self._clearedFields) > 0:
+            maskedElement = type(protocolElement)()
+            self._copyMaskedValue(protocolElement, maskedElement)
+            protocolElement = maskedElement
+        self._bufferSize += protocolElement.ByteSize()
+        if encodedQualities is not None:
+            self._bufferSize += len(encodedQualities)
+        self._pendingJson.append(
+            self._valueToJson(protocolElement, encodedQualities))
+
+    def takeSerializedValues(self):
+        """
+        Returns the part of the response serialised since the last call
+        to this method, beginning with the opening of the response and
+        its value list.
+        """
+        s = "".join(self._pendingJson)
+        self._pendingJson = []
+        return s
+
+    def getSerializedResponse(self):
+        """
+        Returns the remainder of the response following the values taken
+        by takeSerializedValues, which closes the value list and holds
+        the nextPageToken.
+        """
+        return self.takeSerializedValues() + self._getJsonResponseEnd()
@@ -0,0 +1,117 @@
+"""
+A cache of serialised responses, used by the backend to avoid repeating
+identical requests against data that has not changed.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import time
+
+
+class ResponseCache(object):
+    """
+    A byte-size-bounded LRU cache of serialised responses. Entries are
+    keyed by a tuple of strings identifying the request, and are evicted
+    when the total length of the keys and responses exceeds maxSize bytes,
+    or when they are more than timeToLive seconds old. Every entry is
+    made against a version stamp of the data repository; when a different
+    stamp is presented, all the entries are invalidated.
+    """
+    def __init__(self, maxSize, timeToLive):
+        if maxSize <= 0:
+            raise ValueError(
+                "The size of the cache must be a strictly positive value")
+        self._maxSize = maxSize
+        self._timeToLive = timeToLive
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._versionStamp = None
+        self._hitCount = 0
+        self._missCount = 0
+        self._evictionCount = 0
+        self._invalidationCount = 0
+
+    def _getEntrySize(self, key, response):
+        return sum(len(part) for part in key) + len(response)
+
+    def _removeEntry(self, key):
+        response, _ = self._entries.pop(key)
+        self._size -= self._getEntrySize(key, response)
+
+    def _checkVersionStamp(self, versionStamp):
+        """
+        Removes all entries if the specified version stamp differs from
+        the one the entries were made against.
+        """
+        if versionStamp != self._versionStamp:
+            if len(self._entries) > 0:
+                self._invalidationCount += 1
+            self._entries.clear()
+            self._size = 0
+            self._versionStamp = versionStamp
+
+    def _evict(self, now):
+        """
+        Removes expired entries, and then the least recently used entries
+        until the cache is within its maximum size.
+        """
+        while len(self._entries) > 0:
+            key, (response, created) = next(self._entries.iteritems())
+            if (self._size <= self._maxSize and
+                    now - created <= self._timeToLive):
+                break
+            self._removeEntry(key)
+            self._evictionCount += 1
+
+    def get(self, key, versionStamp):
+        """
+        Returns the response cached under the specified key for the data
+        repository at the specified version stamp, or None if there is no
+        such response.
+        """
+        self._checkVersionStamp(versionStamp)
+        self._evict(time.time())
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self._missCount += 1
+            return None
+        self._hitCount += 1
+        self._entries[key] = entry
+        return entry[0]
+
+    def put(self, key, versionStamp, response):
+        """
+        Caches the specified response under the specified key for the data
+        repository at the specified version stamp. Responses too large to
+        fit in the cache are not stored.
+        """
+        entrySize = self._getEntrySize(key, response)
+        if entrySize > self._maxSize:
+            return
+        self._checkVersionStamp(versionStamp)
+        if key in self._entries:
+            self._removeEntry(key)
+        now = time.time()
+        self._entries[key] = response, now
+        self._size += entrySize
+        self._evict(now)
+
+    def getNumEntries(self):
+        return len(self._entries)
+
+    def getSize(self):
+        return self._size
+
+    def getHitCount(self):
+        return self._hitCount
+
+    def getMissCount(self):
+        return self._missCount
+
+    def getEvictionCount(self):
+        return self._evictionCount
+
+    def getInvalidationCount(self):
+        return self._invalidationCount
@@ -20,6 +20,39 @@ class BaseConfig(object):
     REQUEST_VALIDATION = True
     DEFAULT_PAGE_SIZE = 100
     DATA_SOURCE = "empty://"
+    # Issue variant page tokens holding the BGZF virtual offset of the next
+    # record, from which the next page reads on instead of searching again.
+    VARIANT_VIRTUAL_OFFSET_PAGE_TOKENS = False
+    # Fill in the reference bases of the CIGAR units of reads, read from
+    # a window of the reference held for each search.
+    CIGAR_REFERENCE_SEQUENCES = False
+    # Number of open reads/variants/variant annotations search cursors to
+    # keep between pages (0 disables), and their idle lifetime in seconds.
+    CURSOR_CACHE_MAX_SIZE = 0
+    CURSOR_CACHE_TTL = 60
+    # Directory in which the tiles of reads coverage are cached (None
+    # disables), and the maximum number of tiles kept there.
+    COVERAGE_TILE_CACHE_DIRECTORY = None
+    COVERAGE_TILE_CACHE_MAX_TILES = 10000
+    # Write search responses to the client as each value is produced,
+    # rather than building the whole response in memory first.
+    STREAMING_SEARCH_RESPONSES = False
+    # Total size in bytes of the responses to cache (0 disables), their
+    # lifetime in seconds, and the requests whose responses are cached.
+    RESPONSE_CACHE_MAX_SIZE = 0
+    RESPONSE_CACHE_TTL = 600
+    RESPONSE_CACHE_ENDPOINTS = [
+        "SearchVariantsRequest", "SearchFeaturesRequest",
+        "ListReferenceBasesRequest"]
+    # Path at which request metrics are served in the Prometheus text
+    # format (e.g. "/metrics"); None disables metrics collection.
+    METRICS_PATH = None
+    # Report the time spent in each stage of a request (parse, fetch,
+    # convert, build, serialize) in the Server-Timing header.
+    REQUEST_TIMING = False
+    # Log the stage timings of requests taking longer than this number
+    # of seconds; None disables the slow request log.
+    SLOW_REQUEST_THRESHOLD = None
 
     # Options for the simulated backend.
     SIMULATED_BACKEND_RANDOM_SEED = 0
@@ -0,0 +1,151 @@
+"""
+Timing of the stages of request handling. A StageTimer is started for
+each request when timing is enabled, and the code handling the request
+charges the time it spends to named stages through the stage function,
+which does nothing when no timer has been started for the current
+thread.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import threading
+import time
+
+
+_local = threading.local()
+
+
+class _Stage(object):
+    """
+    Context manager charging the time spent within it to a stage of a
+    StageTimer.
+    """
+    def __init__(self, timer, name):
+        self._timer = timer
+        self._name = name
+
+    def __enter__(self):
+        self._timer.enter(self._name)
+
+    def __exit__(self, *args):
+        self._timer.exit()
+
+
+class _NullStage(object):
+    """
+    Context manager used when timing is disabled.
+    """
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+_nullStage = _NullStage()
+
+
+class StageTimer(object):
+    """
+    Accumulates the time spent in named stages. Stages may be nested, in
+    which case the time spent in the inner stage is not charged to the
+    outer one; the durations of the stages therefore never overlap.
+    """
+    def __init__(self):
+        self._startTime = time.time()
+        self._lastTime = self._startTime
+        self._durations = collections.OrderedDict()
+        self._stack = []
+
+    def _charge(self, now):
+        if len(self._stack) > 0:
+            name = self._stack[-1]
+            self._durations[name] += now - self._lastTime
+        self._lastTime = now
+
+    def enter(self, name):
+        """
+        Starts charging time to the stage with the specified name.
+        """
+        self._charge(time.time())
+        self._stack.append(name)
+        if name not in self._durations:
+            self._durations[name] = 0
+
+    def exit(self):
+        """
+        Stops charging time to the most recently entered stage, and
+        resumes charging the stage enclosing it, if any.
+        """
+        self._charge(time.time())
+        self._stack.pop()
+
+    def stage(self, name):
+        """
+        Returns a context manager charging the time spent within it to
+        the stage with the specified name.
+        """
+        return _Stage(self, name)
+
+    def getDurations(self):
+        """
+        Returns the list of (stage, seconds) pairs in the order in which
+        the stages were first entered.
+        """
+        self._charge(time.time())
+        return list(self._durations.items())
+
+    def getElapsedTime(self):
+        """
+        Returns the number of seconds since this timer was started.
+        """
+        return time.time() - self._startTime
+
+    def getServerTimingHeader(self):
+        """
+        Returns the durations of the stages as the value of a
+        Server-Timing HTTP header, in milliseconds.
+        """
+        durations = self.getDurations()
+        durations.append(("total", self.getElapsedTime()))
+        return ", ".join(
+            "{};dur={:.3f}".format(name, seconds * 1000)
+            for name, seconds in durations)
+
+
+def startTimer():
+    """
+    Starts a new timer for the current thread and returns it.
+    """
+    _local.timer = StageTimer()
+    return _local.timer
+
+
+def getTimer():
+    """
+    Returns the timer of the current thread, or None if there is none.
+    """
+    return getattr(_local, "timer", None)
+
+
+def stopTimer():
+    """
+    Removes the timer of the current thread and returns it, or None if
+    there is none.
+    """
+    timer = getTimer()
+    _local.timer = None
+    return timer
+
+
+def stage(name):
+    """
+    Returns a context manager charging the time spent within it to the
+    stage with the specified name of the current thread's timer.
+    """
+    timer = getattr(_local, "timer", None)
+    if timer is None:
+        return _nullStage
+    return _Stage(timer, name)
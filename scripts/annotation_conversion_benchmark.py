@@ -0,0 +1,83 @@
+"""
+Benchmark of the conversion of ANN/CSQ strings into GA4GH transcript
+effects, run over the annotated VCFs in the test data.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import time
+
+import glue
+
+glue.ga4ghImportGlue()
+
+# We need to turn off QA because of the import glue
+import ga4gh.server.datamodel.datasets as datasets  # NOQA
+import ga4gh.server.datamodel.ontologies as ontologies  # NOQA
+import ga4gh.server.datamodel.variants as variants  # NOQA
+
+
+VARIANTS_DIR = "tests/data/datasets/dataset1/variants"
+ONTOLOGY_FILE = "tests/data/ontologies/so-xp-simple.obo"
+DEFAULT_VCF_DIRS = [
+    VARIANTS_DIR + "/1KG_GRCh37_VEP_edit",
+    VARIANTS_DIR + "/1kg.17.ann.edit",
+    VARIANTS_DIR + "/1kg.3.annotations",
+]
+
+
+def getAnnotationSet(vcfDir, ontology):
+    """
+    Returns the variant annotation set of the VCF files in the specified
+    directory, and the list of pysam records they hold.
+    """
+    dataset = datasets.Dataset("benchmark")
+    variantSet = variants.HtslibVariantSet(dataset, "benchmark")
+    variantSet.populateFromDirectory(vcfDir)
+    annotationSet = variantSet.getVariantAnnotationSets()[0]
+    annotationSet.setOntology(ontology)
+    records = []
+    for referenceName in variantSet.getReferenceToDataUrlIndexMap():
+        records.extend(variantSet.getPysamVariants(referenceName, 0, 2**31))
+    return annotationSet, records
+
+
+def benchmark(annotationSet, records, repeatLimit):
+    """
+    Returns the number of transcript effects in the specified records,
+    and the minimum time taken over repeatLimit runs to convert them.
+    """
+    annotations = []
+    for record in records:
+        annotations.extend(annotationSet._getAnnotations(record) or [])
+    times = []
+    for _ in range(repeatLimit):
+        startTime = time.time()
+        for annStr in annotations:
+            annotationSet.convertTranscriptEffect(annStr, None)
+        times.append(time.time() - startTime)
+    return len(annotations), min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark of transcript effect conversion")
+    parser.add_argument(
+        'vcfDirs', nargs='*', default=DEFAULT_VCF_DIRS,
+        help='directories of annotated VCFs (default: the test data)')
+    parser.add_argument(
+        '--repeatLimit', type=int, default=5, metavar='N',
+        help='how many times to run each test case (default: %(default)s)')
+    args = parser.parse_args()
+    ontology = ontologies.Ontology("sequence_ontology")
+    ontology.populateFromFile(ONTOLOGY_FILE)
+    print("type\teffects\ttime (s)\teffects/s\tdirectory")
+    for vcfDir in args.vcfDirs:
+        annotationSet, records = getAnnotationSet(vcfDir, ontology)
+        numEffects, elapsedTime = benchmark(
+            annotationSet, records, args.repeatLimit)
+        print("{}\t{}\t{:.4f}\t{:.0f}\t{}".format(
+            annotationSet.getAnnotationType(), numEffects, elapsedTime,
+            numEffects / elapsedTime, vcfDir))
@@ -119,6 +119,11 @@ class Gff32Db(object):
         dbcur.execute((
             "create INDEX idx1 "
             "on feature(start, end, reference_name)"))
+        # Matches the ordering and keyset condition used to page through
+        # feature search results.
+        dbcur.execute((
+            "create INDEX idx2 "
+            "on feature(reference_name, start, end, id)"))
         dbcur.execute("PRAGMA INDEX_LIST('feature')")
 
         dbcur.close()
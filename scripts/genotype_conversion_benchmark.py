@@ -0,0 +1,139 @@
+"""
+Benchmark comparing the per-sample and batched conversion of VCF calls
+into GA4GH Call objects, for synthetic VCFs with increasing numbers of
+samples.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import pysam
+
+import glue
+
+glue.ga4ghImportGlue()
+
+# We need to turn off QA because of the import glue
+import ga4gh.server.datamodel.datasets as datasets  # NOQA
+import ga4gh.server.datamodel.variants as variants  # NOQA
+
+
+def writeVcf(fileName, numSamples, numRecords):
+    """
+    Writes a VCF with the specified numbers of samples and records, each
+    call having GT, GL and DP values, and returns the name of the
+    compressed and indexed file.
+    """
+    samples = ["S{}".format(j) for j in range(numSamples)]
+    with open(fileName, "w") as vcf:
+        vcf.write("##fileformat=VCFv4.1\n")
+        vcf.write("##contig=<ID=1,length=100000000>\n")
+        vcf.write(
+            '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+        vcf.write(
+            '##FORMAT=<ID=GL,Number=G,Type=Float,'
+            'Description="Genotype likelihoods">\n')
+        vcf.write(
+            '##FORMAT=<ID=DP,Number=1,Type=Integer,'
+            'Description="Read depth">\n')
+        vcf.write("#" + "\t".join([
+            "CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO",
+            "FORMAT"] + samples) + "\n")
+        for i in range(numRecords):
+            calls = [
+                "{}|{}:-0.1,-1.2,-3.4:{}".format(
+                    random.randint(0, 1), random.randint(0, 1),
+                    random.randint(0, 60))
+                for _ in samples]
+            vcf.write("\t".join([
+                "1", str(1000 + i * 10), ".", "A", "G", "50", "PASS", ".",
+                "GT:GL:DP"] + calls) + "\n")
+    return pysam.tabix_index(fileName, preset="vcf", force=True)
+
+
+def convertPerSample(variantSet, record, callSets):
+    """
+    Converts the calls of the specified record one sample at a time,
+    as convertVariant did before calls were converted in a batch.
+    """
+    variant = variantSet._createGaVariant()
+    for callSet in callSets:
+        pysamCall = record.samples[str(callSet.getSampleName())]
+        variant.calls.add().CopyFrom(
+            variantSet._convertGaCall(callSet, pysamCall))
+    return variant
+
+
+def convertBatched(variantSet, record, callSets):
+    """
+    Converts the calls of the specified record in a batch.
+    """
+    variant = variantSet._createGaVariant()
+    variantSet._addGaCalls(
+        variant, record, [callSet.getId() for callSet in callSets])
+    return variant
+
+
+def timeConversion(convert, variantSet, records, repeatLimit):
+    """
+    Returns the minimum time taken over repeatLimit runs to convert the
+    calls of all the specified records with the specified function.
+    """
+    callSets = variantSet.getCallSets()
+    times = []
+    for _ in range(repeatLimit):
+        startTime = time.time()
+        for record in records:
+            convert(variantSet, record, callSets)
+        times.append(time.time() - startTime)
+    return min(times)
+
+
+def benchmark(directory, numSamples, numRecords, repeatLimit):
+    dataUrl = writeVcf(
+        os.path.join(directory, "samples_{}.vcf".format(numSamples)),
+        numSamples, numRecords)
+    dataset = datasets.Dataset("benchmark")
+    variantSet = variants.HtslibVariantSet(dataset, "benchmark")
+    variantSet.populateFromFile([dataUrl], [dataUrl + ".tbi"])
+    records = list(variantSet.getPysamVariants("1", 0, 2**31))
+    perSampleTime = timeConversion(
+        convertPerSample, variantSet, records, repeatLimit)
+    batchedTime = timeConversion(
+        convertBatched, variantSet, records, repeatLimit)
+    return perSampleTime, batchedTime
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark of per-sample and batched call conversion")
+    parser.add_argument(
+        '--sampleCounts', type=int, nargs='+',
+        default=[1, 10, 100, 1000, 2500], metavar='N',
+        help='numbers of samples to benchmark (default: %(default)s)')
+    parser.add_argument(
+        '--numRecords', type=int, default=100, metavar='N',
+        help='number of VCF records to convert (default: %(default)s)')
+    parser.add_argument(
+        '--repeatLimit', type=int, default=3, metavar='N',
+        help='how many times to run each test case (default: %(default)s)')
+    args = parser.parse_args()
+    random.seed(1)
+    directory = tempfile.mkdtemp(prefix="ga4gh_genotype_benchmark")
+    try:
+        print("samples\tper-sample (s)\tbatched (s)\tspeedup")
+        for numSamples in args.sampleCounts:
+            perSampleTime, batchedTime = benchmark(
+                directory, numSamples, args.numRecords, args.repeatLimit)
+            print("{}\t{:.4f}\t{:.4f}\t{:.2f}".format(
+                numSamples, perSampleTime, batchedTime,
+                perSampleTime / batchedTime))
+    finally:
+        shutil.rmtree(directory)
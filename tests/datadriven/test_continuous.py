@@ -15,9 +15,12 @@ import ga4gh.server.datarepo as datarepo
 import ga4gh.server.datamodel.continuous as continuous
 import ga4gh.server.datamodel.datasets as datasets
 import ga4gh.server.exceptions as exceptions
+import ga4gh.server.paging as paging
 
 import tests.paths as paths
 
+import ga4gh.schemas.protocol as protocol
+
 
 class TestContinuous(unittest.TestCase):
     """
@@ -106,3 +109,43 @@ class TestContinuous(unittest.TestCase):
         generator = continuousObj.bigWigToProtocol(
                                             "chr&19", 49305602, 49308000)
         next(generator)
+
+    def testReadBigWigResume(self):
+        continuousObj = continuous.BigWigDataSource(self._bigWigFile)
+        # Split runs of values across objects, so that resuming mid-run
+        # is exercised.
+        continuousObj._MAX_VALUES = 2
+        start, end = 49304000, 49308000
+        allObjs = list(continuousObj.readValuesPyBigWig("chr19", start, end))
+        self.assertGreater(len(allObjs), 10)
+        for index, obj in enumerate(allObjs):
+            objs = list(continuousObj.readValuesPyBigWig(
+                "chr19", start, end, obj.start, 3))
+            self.assertEqual(objs, allObjs[index:index + 3])
+        objs = list(continuousObj.readValuesPyBigWig(
+            "chr19", start, end, end))
+        self.assertEqual(len(objs), 0)
+
+    def testContinuousIteratorPaging(self):
+        continuousSet = continuous.FileContinuousSet(
+            datasets.Dataset("testDs"), "testContinuous")
+        continuousSet.populateFromFile(self._bigWigFile)
+        request = protocol.SearchContinuousRequest()
+        request.reference_name = "chr19"
+        request.start = 49300000
+        request.end = 49310000
+        allObjs = list(continuousSet.getContinuous(
+            request.reference_name, request.start, request.end))
+        for pageSize in [1, 2, 4]:
+            request.page_size = pageSize
+            request.page_token = ""
+            objs = []
+            while True:
+                page = list(paging.ContinuousIterator(request, continuousSet))
+                self.assertLessEqual(len(page), pageSize)
+                objs.extend(obj for obj, pageToken in page)
+                pageToken = page[-1][1]
+                if pageToken is None:
+                    break
+                request.page_token = pageToken
+            self.assertEqual(objs, allObjs)
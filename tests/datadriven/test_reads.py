@@ -7,8 +7,11 @@ from __future__ import unicode_literals
 
 import collections
 import os
+import shutil
+import tempfile
 
 import ga4gh.server.backend as backend
+import ga4gh.server.coverage_index as coverage_index
 import ga4gh.server.datamodel as datamodel
 import ga4gh.server.datamodel.datasets as datasets
 import ga4gh.server.datamodel.reads as reads
@@ -87,6 +90,18 @@ class ReadGroupInfo(object):
             self.runTime = readGroupHeader.get('DT', None)
 
 
+class PatternReference(object):
+    """
+    A reference whose bases repeat a pattern, for reads whose reference
+    is not in the test data.
+    """
+    def getLength(self):
+        return 2**31
+
+    def getBases(self, start, end):
+        return "".join("ACGTTGCA"[i % 8] for i in range(start, end))
+
+
 class ReadGroupSetTest(datadriven.DataDrivenTest):
     """
     Data driven test for read group sets
@@ -276,6 +291,177 @@ class ReadGroupSetTest(datadriven.DataDrivenTest):
                 self.assertAlignmentListsEqual(
                     gaAlignments, alignments, readGroupInfo)
 
+    def testReadGroupSetReadGroupIds(self):
+        # reads of the whole set are assigned the read group of their tag
+        readGroupSet = self._gaObject
+        readGroupIds = dict(
+            (readGroup.getLocalId(), readGroup.getId())
+            for readGroup in readGroupSet.getReadGroups())
+        for reference in self._referenceSet.getReferences():
+            gaAlignments = list(readGroupSet.getReadAlignments(reference))
+            pysamAlignments = list(self._samFile.fetch(
+                reference.getLocalId().encode()))
+            self.assertEqual(len(gaAlignments), len(pysamAlignments))
+            for gaAlignment, pysamAlignment in zip(
+                    gaAlignments, pysamAlignments):
+                tags = dict(pysamAlignment.tags)
+                readGroupName = tags.get(
+                    'RG', reads.HtslibReadGroupSet.defaultReadGroupName)
+                self.assertEqual(
+                    gaAlignment.read_group_id, readGroupIds[readGroupName])
+
+    def testCigarReferenceSequences(self):
+        # reference bases of CIGAR units are read from the window
+        readGroupSet = self._gaObject
+        operations = [
+            protocol.CigarUnit.ALIGNMENT_MATCH, protocol.CigarUnit.DELETE,
+            protocol.CigarUnit.SEQUENCE_MATCH,
+            protocol.CigarUnit.SEQUENCE_MISMATCH]
+        consumingOperations = operations + [protocol.CigarUnit.SKIP]
+        for reference in self._referenceSet.getReferences():
+            window = references.ReferenceWindow(PatternReference())
+            for gaAlignment in readGroupSet.getReadAlignments(
+                    reference, referenceWindow=window):
+                if not gaAlignment.HasField("alignment"):
+                    continue
+                position = gaAlignment.alignment.position.position
+                for cigarUnit in gaAlignment.alignment.cigar:
+                    length = cigarUnit.operation_length
+                    if cigarUnit.operation in operations:
+                        self.assertEqual(
+                            cigarUnit.reference_sequence,
+                            PatternReference().getBases(
+                                position, position + length))
+                    else:
+                        self.assertEqual(cigarUnit.reference_sequence, "")
+                    if cigarUnit.operation in consumingOperations:
+                        position += length
+
+    def testReadSampler(self):
+        # sampled reads are a subset of the reads, at most one per window
+        readGroupSet = self._gaObject
+        readSampler = reads.ReadSampler(1, 100)
+        for reference in self._referenceSet.getReferences():
+            gaAlignments = list(readGroupSet.getReadAlignments(reference))
+            sampledAlignments = list(readGroupSet.getReadAlignments(
+                reference, readSampler=readSampler))
+            windows = set()
+            for gaAlignment in sampledAlignments:
+                self.assertIn(gaAlignment, gaAlignments)
+                if not gaAlignment.HasField("alignment"):
+                    continue
+                window = gaAlignment.alignment.position.position // 100
+                self.assertNotIn(window, windows)
+                windows.add(window)
+            if len(gaAlignments) > 0:
+                self.assertGreater(len(sampledAlignments), 0)
+
+    def _getCoverageRegions(self, binSize):
+        # yields a (reference, start, end) region of up to 100 bins from
+        # the first read of each reference with reads, aligned to the bins
+        lengths = dict(zip(self._samFile.references, self._samFile.lengths))
+        for reference in self._referenceSet.getReferences():
+            name = reference.getLocalId()
+            read = next(self._samFile.fetch(name.encode()), None)
+            if read is None:
+                continue
+            start = read.reference_start - read.reference_start % binSize
+            yield reference, start, min(start + 100 * binSize, lengths[name])
+
+    def testBinnedCoverage(self):
+        # the reads of the read groups are also counted in the read group
+        # set, which may hold reads of no read group
+        readGroupSet = self._gaObject
+        binSize = 1000
+        for reference, start, end in self._getCoverageRegions(binSize):
+            numBins = (end - start + binSize - 1) // binSize
+            depths = readGroupSet.getBinnedCoverage(
+                reference, start, end, binSize)
+            self.assertEqual(len(depths), numBins)
+            readGroupDepths = [0] * numBins
+            for readGroup in readGroupSet.getReadGroups():
+                for index, depth in enumerate(readGroup.getBinnedCoverage(
+                        reference, start, end, binSize)):
+                    readGroupDepths[index] += depth
+            for depth, readGroupDepth in zip(depths, readGroupDepths):
+                self.assertGreaterEqual(readGroupDepth, 0)
+                self.assertLessEqual(readGroupDepth, depth + 1e-9)
+
+    def testBinnedCoverageChunks(self):
+        # pysam counts at most coverageChunkSize bases at a time, however
+        # large the bins, and the depths do not depend on the chunks
+        readGroupSet = self._gaObject
+        samFile = readGroupSet.getFileHandle(readGroupSet.getDataUrl())
+        intervals = []
+
+        class RecordingSamFile(object):
+            def count_coverage(self, contig, start, end, **kwargs):
+                intervals.append((start, end))
+                return samFile.count_coverage(contig, start, end, **kwargs)
+
+        for reference, start, end in self._getCoverageRegions(1000):
+            depths = readGroupSet.getBinnedCoverage(reference, start, end, 7)
+            readGroupSet.getFileHandle = lambda dataUrl: RecordingSamFile()
+            readGroupSet.coverageChunkSize = 500
+            try:
+                self.assertEqual(
+                    readGroupSet.getBinnedCoverage(
+                        reference, start, end, 7), depths)
+                largeBinDepths = readGroupSet.getBinnedCoverage(
+                    reference, start, end, 10 ** 9)
+            finally:
+                del readGroupSet.getFileHandle
+                del readGroupSet.coverageChunkSize
+            self.assertEqual(len(largeBinDepths), 1)
+            for intervalStart, intervalEnd in intervals:
+                self.assertLessEqual(intervalEnd - intervalStart, 500)
+            del intervals[:]
+
+    def testCoverageIndex(self):
+        # the index is built from a copy of the BAM file, and counts every
+        # aligned base where pysam counts only A, C, G and T bases
+        directory = tempfile.mkdtemp(prefix="ga4gh_coverage_index")
+        try:
+            dataUrl = os.path.join(directory, "reads.bam")
+            shutil.copy(self._dataPath, dataUrl)
+            shutil.copy(self._dataPath + ".bai", dataUrl + ".bai")
+            readGroupSet = reads.HtslibReadGroupSet(self._dataset, "copy")
+            readGroupSet.populateFromFile(dataUrl)
+            binSize = 1024
+            regions = list(self._getCoverageRegions(binSize))
+            bamDepths = [
+                readGroupSet.getBinnedCoverage(*region + (binSize,))
+                for region in regions]
+            readGroupSet.buildCoverageIndex()
+            self.assertTrue(os.path.exists(
+                coverage_index.getCoverageIndexPath(dataUrl)))
+            numAlignedReads = 0
+            for readGroup in readGroupSet.getReadGroups():
+                self.assertGreaterEqual(readGroup.getNumAlignedReads(), 0)
+                numAlignedReads += readGroup.getNumAlignedReads()
+            self.assertLessEqual(
+                numAlignedReads, readGroupSet.getNumAlignedReads())
+            for region, depths in zip(regions, bamDepths):
+                indexedDepths = readGroupSet._getIndexedCoverage(
+                    *region + (binSize, None))
+                self.assertEqual(len(indexedDepths), len(depths))
+                for indexedDepth, depth in zip(indexedDepths, depths):
+                    self.assertGreaterEqual(indexedDepth, depth - 1e-3)
+            # the index is kept open until it is rebuilt
+            coverageIndex = readGroupSet.getCoverageIndex()
+            self.assertIs(readGroupSet.getCoverageIndex(), coverageIndex)
+            readGroupSet.buildCoverageIndex()
+            self.assertIsNot(readGroupSet.getCoverageIndex(), coverageIndex)
+            # an invalid index is treated as absent
+            indexPath = coverage_index.getCoverageIndexPath(dataUrl)
+            for contents in [b"", b"not a coverage index" * 4]:
+                os.remove(indexPath)
+                with open(indexPath, "wb") as indexFile:
+                    indexFile.write(contents)
+                self.assertIsNone(readGroupSet.getCoverageIndex())
+        finally:
+            shutil.rmtree(directory)
+
     def testGetReadAlignmentSearchRanges(self):
         # test that various range searches work
         readGroupSet = self._gaObject
@@ -7,6 +7,8 @@ from __future__ import unicode_literals
 
 import hashlib
 import os
+import shutil
+import tempfile
 import unittest
 
 # TODO it may be a bit circular to use pysam as our interface for
@@ -107,6 +109,59 @@ class ReferenceSetTest(datadriven.DataDrivenTest):
         referenceSetMd5 = referenceSet.getMd5Checksum()
         self.assertEqual(md5checksum, referenceSetMd5)
 
+    def testParallelChecksums(self):
+        # checksums computed in a pool from small chunks match those of
+        # the whole bases
+        referenceSet = references.HtslibReferenceSet("parallel")
+        referenceSet.fastaChunkSize = 7
+        progress = []
+        referenceSet.populateFromFile(
+            self._dataPath, numProcesses=2,
+            progress=lambda *args: progress.append(args))
+        gaReferences = self._gaObject.getReferences()
+        self.assertEqual(len(progress), len(gaReferences))
+        self.assertEqual(
+            sorted(numDone for _, numDone, _ in progress),
+            list(range(1, len(gaReferences) + 1)))
+        for gaReference, reference in zip(
+                gaReferences, referenceSet.getReferences()):
+            self.assertEqual(gaReference.getLocalId(), reference.getLocalId())
+            self.assertEqual(
+                gaReference.getMd5Checksum(), reference.getMd5Checksum())
+            self.assertEqual(gaReference.getLength(), reference.getLength())
+        self.assertEqual(
+            self._gaObject.getMd5Checksum(), referenceSet.getMd5Checksum())
+
+    def testReferenceStore(self):
+        # the store is compiled from a copy of the FASTA file, and serves
+        # the same bases, soft-masking included
+        directory = tempfile.mkdtemp(prefix="ga4gh_reference_store")
+        try:
+            dataUrl = os.path.join(directory, "reference.fa.gz")
+            for suffix in ["", ".fai", ".gzi"]:
+                shutil.copy(self._dataPath + suffix, dataUrl + suffix)
+            referenceSet = references.HtslibReferenceSet("copy")
+            referenceSet.populateFromFile(dataUrl)
+            self.assertIsNone(referenceSet.getReferenceStore())
+            referenceSet.compileReferenceStore()
+            self.assertIsNotNone(referenceSet.getReferenceStore())
+            for reference in referenceSet.getReferences():
+                bases = self._fastaFile.fetch(reference.getLocalId())
+                length = reference.getLength()
+                for start, end in [(0, length), (1, length // 2)]:
+                    self.assertEqual(
+                        reference.getBases(start, end), bases[start:end])
+                self.assertRaises(
+                    exceptions.ReferenceRangeErrorException,
+                    reference.getBases, 0, length + 1)
+            # a store is not served once its FASTA file is replaced
+            os.utime(dataUrl, (0, 0))
+            self.assertIsNone(referenceSet.getReferenceStore())
+            referenceSet.compileReferenceStore()
+            self.assertIsNotNone(referenceSet.getReferenceStore())
+        finally:
+            shutil.rmtree(directory)
+
     def doRangeTest(self, start=None, end=None):
         referenceSet = self._gaObject
         for gaReference in referenceSet.getReferences():
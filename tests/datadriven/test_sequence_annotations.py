@@ -5,11 +5,16 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
+import shutil
+import tempfile
+
 import ga4gh.server.datarepo as datarepo
 import ga4gh.server.datamodel as datamodel
 import ga4gh.server.datamodel.datasets as datasets
 import ga4gh.server.datamodel.references as references
 import ga4gh.server.datamodel.sequence_annotations as sequence_annotations
+import ga4gh.server.paging as paging
 import tests.datadriven as datadriven
 import tests.paths as paths
 
@@ -200,3 +205,58 @@ class FeatureSetTests(datadriven.DataDrivenTest):
             features.append(feature)
         self.assertEqual(len(features),
                          self._testData["sampleSiblings"])
+
+    def _getPagedFeatures(self, pageSize, pageToken=""):
+        request = protocol.SearchFeaturesRequest()
+        request.reference_name = self._testData["referenceName"]
+        request.start = self._testData["region"][0]
+        request.end = self._testData["region"][1]
+        request.page_size = pageSize
+        request.page_token = pageToken
+        features = []
+        nextPageToken = None
+        for feature, nextPageToken in paging.FeaturesIterator(
+                request, self._gaObject, None):
+            features.append(feature)
+        return features, nextPageToken
+
+    def testKeysetPaging(self):
+        allFeatures, _ = self._getPagedFeatures(1000)
+        pagedFeatures, pageToken = self._getPagedFeatures(3)
+        while pageToken is not None:
+            self.assertEqual(len(pageToken.split(":")), 4)
+            features, pageToken = self._getPagedFeatures(3, pageToken)
+            pagedFeatures.extend(features)
+        self.assertEqual(
+            [feature.id for feature in pagedFeatures],
+            [feature.id for feature in allFeatures])
+
+    def testPageIndex(self):
+        directory = tempfile.mkdtemp(prefix="ga4gh_feature_db")
+        try:
+            dbFile = os.path.join(directory, "features.db")
+            shutil.copy(self._dataPath, dbFile)
+            with sequence_annotations.Gff3DbBackend(dbFile) as dataSource:
+                dataSource.createPageIndex()
+                # Creating the index again has no effect.
+                dataSource.createPageIndex()
+                sql, sqlArgs = dataSource.featuresQuery(
+                    referenceName=self._testData["referenceName"],
+                    start=self._testData["region"][0],
+                    end=self._testData["region"][1],
+                    lastKey=(self._testData["referenceName"], 0, 0, 0))
+                plan = " ".join(
+                    str(row[-1]) for row in dataSource._dbconn.execute(
+                        "EXPLAIN QUERY PLAN " + sql, sqlArgs))
+            # The keyset condition and ordering are served by the index.
+            self.assertIn("idx2", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+        finally:
+            shutil.rmtree(directory)
+
+    def testIntegerPageToken(self):
+        allFeatures, _ = self._getPagedFeatures(1000)
+        features, _ = self._getPagedFeatures(2, "1")
+        self.assertEqual(
+            [feature.id for feature in features],
+            [feature.id for feature in allFeatures[1:3]])
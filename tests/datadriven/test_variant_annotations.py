@@ -7,6 +7,8 @@ from __future__ import unicode_literals
 
 import os
 import glob
+import shutil
+import tempfile
 
 import vcf
 
@@ -216,6 +218,83 @@ class VariantAnnotationSetTest(datadriven.DataDrivenTest):
                 self.assertValid(protocol.VariantAnnotation,
                                  protocol.toJson(gaVariantAnnotation))
 
+    def testEffectPreFilter(self):
+        end = datamodel.PysamDatamodelMixin.vcfMax
+        for referenceName in self._referenceNames:
+            pairs = list(self._gaObject.getVariantAnnotations(
+                referenceName, 0, end))
+            termIds = set(
+                effect.term_id for _, annotation in pairs
+                for transcriptEffect in annotation.transcript_effects
+                for effect in transcriptEffect.effects if effect.term_id)
+            for termId in list(termIds)[:5] + ["SO:notaterm"]:
+                expected = []
+                for variant, annotation in pairs:
+                    matching = [
+                        transcriptEffect
+                        for transcriptEffect in annotation.transcript_effects
+                        if termId in [
+                            effect.term_id
+                            for effect in transcriptEffect.effects]]
+                    if len(matching) > 0:
+                        expected.append((variant, annotation, matching))
+                filtered = list(self._gaObject.getVariantAnnotations(
+                    referenceName, 0, end, [termId]))
+                self.assertEqual(len(filtered), len(expected))
+                for (variant, annotation), (
+                        expectedVariant, expectedAnnotation,
+                        matching) in zip(filtered, expected):
+                    self.assertEqual(variant.id, expectedVariant.id)
+                    # IDs are unchanged by the removed transcript effects
+                    self.assertEqual(annotation.id, expectedAnnotation.id)
+                    self.assertEqual(
+                        list(annotation.transcript_effects), matching)
+
+    def testEffectIndex(self):
+        if not self._isAnnotated():
+            return
+        end = datamodel.PysamDatamodelMixin.vcfMax
+        tempDir = tempfile.mkdtemp(prefix="ga4gh_effect_index")
+        try:
+            dataPath = os.path.join(tempDir, "variants")
+            shutil.copytree(self._dataPath, dataPath)
+            annotationSet = self.getDataModelInstance(
+                "indexed", dataPath)
+            annotationSet.buildEffectIndexes()
+            for vcfFile in glob.glob(os.path.join(dataPath, "*.vcf.gz")):
+                indexPath = variants.getEffectIndexPath(vcfFile)
+                self.assertTrue(os.path.exists(indexPath))
+                # Only the effects, which searches filter by, are indexed
+                with variants.VariantEffectIndex(indexPath) as effectIndex:
+                    kinds = effectIndex._dbconn.execute(
+                        "SELECT DISTINCT kind FROM postings").fetchall()
+                self.assertLessEqual(
+                    set(kind for kind, in kinds),
+                    set([variants.VariantEffectIndex.EFFECT]))
+            for referenceName in self._referenceNames:
+                termIds = set(
+                    effect.term_id
+                    for _, annotation in self._gaObject.getVariantAnnotations(
+                        referenceName, 0, end)
+                    for transcriptEffect in annotation.transcript_effects
+                    for effect in transcriptEffect.effects if effect.term_id)
+                for termId in list(termIds)[:5] + ["SO:notaterm"]:
+                    for start, stop in [(0, end), (0, 100000)]:
+                        expected = list(self._gaObject.getVariantAnnotations(
+                            referenceName, start, stop, [termId]))
+                        indexed = list(annotationSet.getVariantAnnotations(
+                            referenceName, start, stop, [termId]))
+                        # IDs differ as the variant sets differ
+                        self.assertEqual(
+                            [(variant.start, variant.reference_bases,
+                              list(annotation.transcript_effects))
+                             for variant, annotation in indexed],
+                            [(variant.start, variant.reference_bases,
+                              list(annotation.transcript_effects))
+                             for variant, annotation in expected])
+        finally:
+            shutil.rmtree(tempDir)
+
     def _getPyvcfVariants(
             self, referenceName, startPosition=0, endPosition=2**30):
         """
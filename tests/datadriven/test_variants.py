@@ -8,7 +8,11 @@ from __future__ import unicode_literals
 import os
 import glob
 import hashlib
+import shutil
+import tempfile
+import unittest
 
+import pysam
 import vcf
 
 import ga4gh.server.datamodel as datamodel
@@ -16,6 +20,7 @@ import ga4gh.server.datamodel.datasets as datasets
 import ga4gh.server.datamodel.references as references
 import ga4gh.server.datamodel.variants as variants
 import ga4gh.server.exceptions as exceptions
+import ga4gh.server.paging as paging
 import tests.datadriven as datadriven
 import tests.paths as paths
 
@@ -473,6 +478,35 @@ class VariantSetTest(datadriven.DataDrivenTest):
                 for call, someId in zip(record.calls, somecall_set_ids):
                     self.assertEqual(call.call_set_id, someId)
 
+    def testSampleSubsetCalls(self):
+        variantSet = self._gaObject
+        end = datamodel.PysamDatamodelMixin.vcfMax
+        callSetIds = [cs.getId() for cs in variantSet.getCallSets()]
+        if len(callSetIds) < 2:
+            return
+        for reference_name in self._reference_names:
+            allVariants = list(variantSet.getVariants(
+                reference_name, 0, end, callSetIds))
+            for subset in [callSetIds[:1], callSetIds[-1:0:-1]]:
+                subsetVariants = list(variantSet.getVariants(
+                    reference_name, 0, end, subset))
+                self.assertEqual(len(subsetVariants), len(allVariants))
+                for subsetVariant, allVariant in zip(
+                        subsetVariants, allVariants):
+                    self.assertEqual(subsetVariant.id, allVariant.id)
+                    expectedCalls = [
+                        allVariant.calls[callSetIds.index(callSetId)]
+                        for callSetId in subset]
+                    self.assertEqual(
+                        list(subsetVariant.calls), expectedCalls)
+            # Handles are pooled by sample set, in any order
+            varFileName = variantSet._chromFileMap[reference_name]
+            self.assertIs(
+                variantSet._getVariantFileHandle(
+                    varFileName, callSetIds[:2]),
+                variantSet._getVariantFileHandle(
+                    varFileName, callSetIds[1::-1]))
+
     def testGetVariant(self):
         variantSet = self._gaObject
         for reference_name in self._reference_names:
@@ -511,6 +545,167 @@ class VariantSetTest(datadriven.DataDrivenTest):
                 with self.assertRaises(exceptions.ObjectNotFoundException):
                     variantSet.getVariant(compoundId)
 
+    def testGetVariantCache(self):
+        variantSet = self._gaObject
+        variantIds = []
+        for referenceName in self._reference_names:
+            for record in variantSet.getPysamVariants(
+                    referenceName, 0, 2**30):
+                variant = variantSet.convertVariant(record, [])
+                self.assertEqual(
+                    variantSet.hashPysamVariant(record),
+                    variantSet.hashVariant(variant))
+                variantIds.append(variant.id)
+        cacheSize = variantSet.variantCacheSize
+        variantSet.variantCacheSize = 2
+        try:
+            for variantId in variantIds[:3]:
+                compoundId = datamodel.VariantCompoundId.parse(variantId)
+                gotVariant = variantSet.getVariant(compoundId)
+                self.assertEqual(gotVariant.id, variantId)
+                self.assertIs(variantSet.getVariant(compoundId), gotVariant)
+                self.assertLessEqual(len(variantSet._variantCache), 2)
+        finally:
+            variantSet.variantCacheSize = cacheSize
+
+    def _pageVariants(self, request, pageSize, virtualOffsets):
+        """
+        Pages through the variants for the specified request, resuming
+        every pageSize variants from the page token, and returns the
+        list of variant IDs and the page tokens issued.
+        """
+        variantIds = []
+        pageTokens = []
+        while True:
+            iterator = paging.VariantsIntervalIterator(
+                request, self._gaObject, virtualOffsets)
+            pageToken = None
+            for _ in range(pageSize):
+                variant, pageToken = next(iterator, (None, None))
+                if variant is None:
+                    break
+                variantIds.append(variant.id)
+            if pageToken is None:
+                break
+            pageTokens.append(pageToken)
+            request.page_token = pageToken
+        return variantIds, pageTokens
+
+    def testVirtualOffsetPaging(self):
+        for reference_name in self._reference_names:
+            request = protocol.SearchVariantsRequest()
+            request.reference_name = reference_name
+            request.end = datamodel.PysamDatamodelMixin.vcfMax
+            expectedIds = [
+                variant.id for variant in self._gaObject.getVariants(
+                    reference_name, request.start, request.end, [])]
+            for pageSize in [1, 3, 10]:
+                request.page_token = ""
+                variantIds, pageTokens = self._pageVariants(
+                    request, pageSize, True)
+                self.assertEqual(variantIds, expectedIds)
+                for pageToken in pageTokens:
+                    self.assertEqual(len(pageToken.split(":")), 4)
+                # Virtual offset tokens are accepted when the option is
+                # off, and anchor:skip tokens when it is on.
+                for virtualOffsets in [True, False]:
+                    for pageToken in pageTokens:
+                        request.page_token = pageToken
+                        iterator = paging.VariantsIntervalIterator(
+                            request, self._gaObject, virtualOffsets)
+                        variant, _ = next(iterator)
+                        request.page_token = ":".join(
+                            pageToken.split(":")[:2])
+                        legacyIterator = paging.VariantsIntervalIterator(
+                            request, self._gaObject, not virtualOffsets)
+                        legacyVariant, _ = next(legacyIterator)
+                        self.assertEqual(variant.id, legacyVariant.id)
+
+    def testVirtualOffsetFileIdentityMismatch(self):
+        for reference_name in self._reference_names:
+            request = protocol.SearchVariantsRequest()
+            request.reference_name = reference_name
+            request.end = datamodel.PysamDatamodelMixin.vcfMax
+            iterator = paging.VariantsIntervalIterator(
+                request, self._gaObject, True)
+            variants = list(iterator)
+            if len(variants) < 3:
+                continue
+            pageToken = variants[1][1]
+            anchor, skip, virtualOffset, fileIdentity = pageToken.split(":")
+            # A stale offset from a different file falls back to the anchor.
+            request.page_token = ":".join(
+                [anchor, skip, "0", str(int(fileIdentity) + 1)])
+            iterator = paging.VariantsIntervalIterator(
+                request, self._gaObject, True)
+            self.assertEqual(
+                [variant.id for variant, _ in iterator],
+                [variant.id for variant, _ in variants[2:]])
+
+    def testBatchedCallConversion(self):
+        callSets = self._gaObject.getCallSets()
+        callSetIds = [callSet.getId() for callSet in callSets]
+        for reference_name in self._reference_names:
+            for record in self._gaObject.getPysamVariants(
+                    reference_name, 0, datamodel.PysamDatamodelMixin.vcfMax):
+                variant = self._gaObject.convertVariant(record, callSetIds)
+                self.assertEqual(len(variant.calls), len(callSets))
+                for call, callSet in zip(variant.calls, callSets):
+                    expected = self._gaObject._convertGaCall(
+                        callSet,
+                        record.samples[str(callSet.getSampleName())])
+                    self.assertEqual(call, expected)
+
+    def testColumnarStore(self):
+        variantSet = self._gaObject
+        callSetIds = [cs.getId() for cs in variantSet.getCallSets()]
+        directory = tempfile.mkdtemp(prefix="ga4gh_columnar_store")
+        try:
+            variantSet.compileColumnarStore(directory)
+            # The same name and parent give the same variant IDs
+            columnarSet = variants.ColumnarVariantSet(
+                variantSet.getParentContainer(), variantSet.getLocalId())
+            columnarSet.populateFromStore(directory)
+            self.assertEqual(
+                [cs.getId() for cs in columnarSet.getCallSets()], callSetIds)
+            self.assertEqual(
+                columnarSet.getMetadata(), variantSet.getMetadata())
+            columnarSet.checkConsistency()
+            for reference_name in self._reference_names:
+                for start, end in [(0, 2**30), (1000, 50000)]:
+                    for subset in [[], callSetIds, callSetIds[-1:0:-1]]:
+                        expected = list(variantSet.getVariants(
+                            reference_name, start, end, subset))
+                        for variant in expected:
+                            # Only GT and GL are kept in the store
+                            for call in variant.calls:
+                                call.ClearField(str("attributes"))
+                        got = list(columnarSet.getVariants(
+                            reference_name, start, end, subset))
+                        self.assertEqual(got, expected)
+                # Searches with no end, which the paging iterators pass as
+                # None for a request end of 0, run to the end of the
+                # reference.
+                expected = [
+                    variant.id for variant in variantSet.getVariants(
+                        reference_name, 1000, None)]
+                for end in [None, 0]:
+                    self.assertEqual(
+                        [variant.id for variant in columnarSet.getVariants(
+                            reference_name, 1000, end)],
+                        expected)
+                self.assertEqual(
+                    list(columnarSet.getVariants(reference_name, 2**30, 0)),
+                    [])
+                for variant in variantSet.getVariants(
+                        reference_name, 0, 2**30):
+                    compoundId = datamodel.VariantCompoundId.parse(
+                        variant.id)
+                    self.assertEqual(
+                        columnarSet.getVariant(compoundId).id, variant.id)
+        finally:
+            shutil.rmtree(directory)
+
     def _hashVariant(self, record):
         if record.ALT[0] is None:
             alts = tuple()
@@ -518,3 +713,171 @@ class VariantSetTest(datadriven.DataDrivenTest):
             alts = tuple([unicode(sub) for sub in record.ALT])
         hash_str = record.REF + str(alts)
         return hashlib.md5(hash_str).hexdigest()
+
+
+class FallbackVariantsIntervalIterator(paging.VariantsIntervalIterator):
+    """
+    A variants interval iterator that fails if a virtual offset page
+    token does not resume the search by seeking to its offset.
+    """
+    def _pickUpIteration(self, searchAnchor, objectsToSkip):
+        raise AssertionError("The page token fell back to the anchor")
+
+
+class TestVirtualOffsetPagingManyChunks(unittest.TestCase):
+    """
+    Pages through the variants of a VCF file spanning many BGZF blocks,
+    in which long records fall in larger index bins than the records
+    around them, so that searches read several index chunks.
+    """
+    numRecords = 20000
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp(prefix="ga4gh_variant_paging")
+        fileName = os.path.join(self._directory, "variants.vcf")
+        with open(fileName, "w") as vcfFile:
+            vcfFile.write("##fileformat=VCFv4.1\n")
+            vcfFile.write("##contig=<ID=1,length=100000000>\n")
+            vcfFile.write(
+                '##INFO=<ID=END,Number=1,Type=Integer,'
+                'Description="End position">\n')
+            vcfFile.write(
+                '##FORMAT=<ID=GT,Number=1,Type=String,'
+                'Description="Genotype">\n')
+            vcfFile.write("#" + "\t".join([
+                "CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER",
+                "INFO", "FORMAT", "S1", "S2"]) + "\n")
+            for i in range(self.numRecords):
+                position = 1000 + (i // 2) * 10
+                info = "."
+                if i % 500 == 0:
+                    info = "END={}".format(position + 200000)
+                vcfFile.write("\t".join([
+                    "1", str(position), "rs{}".format(i), "A", "G", "50",
+                    "PASS", info, "GT", "0|1", "1|1"]) + "\n")
+        pysam.tabix_index(fileName, preset="vcf")
+        self._variantSet = variants.HtslibVariantSet(
+            datasets.Dataset("ds"), "vs")
+        self._variantSet.populateFromDirectory(self._directory)
+        self._variantSet.setReferenceSet(
+            references.AbstractReferenceSet("test"))
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def _pageVariants(self, request, pageSize):
+        variantIds = []
+        iterator = paging.VariantsIntervalIterator(
+            request, self._variantSet, True)
+        while True:
+            pageToken = None
+            for _ in range(pageSize):
+                variant, pageToken = next(iterator, (None, None))
+                if variant is None:
+                    break
+                variantIds.append(variant.id)
+            if pageToken is None:
+                return variantIds
+            self.assertEqual(len(pageToken.split(":")), 4)
+            request.page_token = pageToken
+            iterator = FallbackVariantsIntervalIterator(
+                request, self._variantSet, True)
+
+    def testPaging(self):
+        for start, end in [(0, 0), (50000, 70000), (1000, 1000000)]:
+            expectedIds = [
+                variant.id for variant in self._variantSet.getVariants(
+                    "1", start, end if end != 0 else None)]
+            self.assertGreater(len(expectedIds), 0)
+            for pageSize in [7, 1000]:
+                request = protocol.SearchVariantsRequest()
+                request.reference_name = "1"
+                request.start = start
+                request.end = end
+                self.assertEqual(
+                    self._pageVariants(request, pageSize), expectedIds)
+
+    def testVariantsFromOffset(self):
+        for start, end in [(0, None), (50000, 70000)]:
+            pairs = list(self._variantSet.getVariantsWithOffsets(
+                "1", start, end))
+            self.assertIsNone(pairs[0][1])
+            for index in [1, 2, 500, len(pairs) - 1]:
+                virtualOffset = pairs[index][1]
+                self.assertEqual(
+                    list(self._variantSet.getVariantsFromOffset(
+                        "1", start, end, virtualOffset)),
+                    pairs[index:])
+
+    def testMismatchedVirtualOffset(self):
+        request = protocol.SearchVariantsRequest()
+        request.reference_name = "1"
+        request.start = 50000
+        request.end = 70000
+        pairs = list(paging.VariantsIntervalIterator(
+            request, self._variantSet, True))
+        anchor, skip, virtualOffset, fileIdentity = pairs[9][1].split(":")
+        # A token whose offset does not fall at the start of the next
+        # record falls back to the anchor.
+        request.page_token = ":".join(
+            [anchor, skip, str(int(virtualOffset) + 1), fileIdentity])
+        iterator = paging.VariantsIntervalIterator(
+            request, self._variantSet, True)
+        self.assertEqual(
+            [variant.id for variant, _ in iterator],
+            [variant.id for variant, _ in pairs[10:]])
+
+
+class TestMissingGenotypeLikelihoods(unittest.TestCase):
+    """
+    Checks that calls with missing GL values convert as they do one
+    sample at a time.
+    """
+    def setUp(self):
+        self._directory = tempfile.mkdtemp(prefix="ga4gh_variant_gl")
+        fileName = os.path.join(self._directory, "variants.vcf")
+        with open(fileName, "w") as vcfFile:
+            vcfFile.write("##fileformat=VCFv4.1\n")
+            vcfFile.write("##contig=<ID=1,length=100000>\n")
+            vcfFile.write(
+                '##FORMAT=<ID=GT,Number=1,Type=String,'
+                'Description="Genotype">\n')
+            vcfFile.write(
+                '##FORMAT=<ID=GL,Number=G,Type=Float,'
+                'Description="Genotype likelihoods">\n')
+            vcfFile.write(
+                '##FORMAT=<ID=DP,Number=1,Type=Integer,'
+                'Description="Read depth">\n')
+            vcfFile.write("#" + "\t".join([
+                "CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER",
+                "INFO", "FORMAT", "S1", "S2", "S3"]) + "\n")
+            for position, calls in [
+                    (100, ["0/1:-1,-0.5,-2:10", "1/1:.:5", "0/0"]),
+                    (200, ["0|1:.:.", "./.:.:3", "1|1:-3,-2,-0.1:7"])]:
+                vcfFile.write("\t".join([
+                    "1", str(position), ".", "A", "G", "50", "PASS", ".",
+                    "GT:GL:DP"] + calls) + "\n")
+        pysam.tabix_index(fileName, preset="vcf")
+        self._variantSet = variants.HtslibVariantSet(
+            datasets.Dataset("ds"), "vs")
+        self._variantSet.populateFromDirectory(self._directory)
+        self._variantSet.setReferenceSet(
+            references.AbstractReferenceSet("test"))
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def testBatchedCallConversion(self):
+        callSets = self._variantSet.getCallSets()
+        callSetIds = [callSet.getId() for callSet in callSets]
+        numMissing = 0
+        for record in self._variantSet.getPysamVariants("1", 0, 100000):
+            variant = self._variantSet.convertVariant(record, callSetIds)
+            self.assertEqual(len(variant.calls), len(callSets))
+            for call, callSet in zip(variant.calls, callSets):
+                expected = self._variantSet._convertGaCall(
+                    callSet, record.samples[str(callSet.getSampleName())])
+                self.assertEqual(call, expected)
+                if "GL" in call.attributes.attr:
+                    numMissing += 1
+        self.assertEqual(numMissing, 4)
@@ -12,12 +12,15 @@ import unittest
 import ga4gh.server.exceptions as exceptions
 import ga4gh.server.backend as backend
 import ga4gh.server.paging as paging
+import ga4gh.server.response_cache as response_cache
 import ga4gh.server.datarepo as datarepo
 import ga4gh.server.datamodel.datasets as datasets
 import ga4gh.server.datamodel.references as references
 
 import tests.paths as paths
 
+import ga4gh.schemas.protocol as protocol
+
 
 class TestAbstractBackend(unittest.TestCase):
     """
@@ -178,6 +181,238 @@ class TestSqlRepoTestData(unittest.TestCase):
             self.assertEqual(self._dataRepo.getReferenceSetByName(name), rs)
 
 
+class TestCursorCache(unittest.TestCase):
+    """
+    Tests the cursor cache used to continue interval searches.
+    """
+    def setUp(self):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        self._backend = backend.Backend(dataRepo)
+        dataset = dataRepo.getDatasetByIndex(0)
+        variantSetIds = [
+            dataset.getVariantSetByName(name).getId()
+            for name in ["vs_0", "vs_9"]]
+        # Two searches over each file, so that suspended cursors share
+        # their file handles with other searches.
+        self._searches = [
+            (variantSetId, start) for variantSetId in variantSetIds
+            for start in [0, 10500]]
+
+    def _searchVariants(self, search, pageToken):
+        request = protocol.SearchVariantsRequest()
+        request.variant_set_id, request.start = search
+        request.reference_name = "1"
+        request.end = 2**30
+        request.page_size = 7
+        request.page_token = pageToken
+        response = protocol.fromJson(
+            self._backend.runSearchVariants(protocol.toJson(request)),
+            protocol.SearchVariantsResponse)
+        return ([variant.id for variant in response.variants],
+                response.next_page_token)
+
+    def _searchAllVariants(self):
+        # Page through the searches in lockstep, so that each cursor is
+        # suspended while the other searches run.
+        variantIds = {}
+        pageTokens = dict.fromkeys(self._searches, "")
+        while len(pageTokens) > 0:
+            for search in list(pageTokens):
+                ids, pageToken = self._searchVariants(
+                    search, pageTokens[search])
+                variantIds.setdefault(search, []).extend(ids)
+                if pageToken:
+                    pageTokens[search] = pageToken
+                else:
+                    del pageTokens[search]
+        return variantIds
+
+    def testSearchVariants(self):
+        expected = self._searchAllVariants()
+        self._backend.setCursorCache(10, 60)
+        self.assertEqual(self._searchAllVariants(), expected)
+        cursorCache = self._backend.getCursorCache()
+        self.assertGreater(cursorCache.getHitCount(), 0)
+        self.assertEqual(cursorCache.getMissCount(), 0)
+        self.assertEqual(cursorCache.getNumCursors(), 0)
+
+    def testExpiredCursors(self):
+        expected = self._searchAllVariants()
+        self._backend.setCursorCache(10, -1)
+        self.assertEqual(self._searchAllVariants(), expected)
+        cursorCache = self._backend.getCursorCache()
+        self.assertEqual(cursorCache.getHitCount(), 0)
+        self.assertGreater(cursorCache.getMissCount(), 0)
+        self.assertGreater(cursorCache.getEvictionCount(), 0)
+
+    def testEvictLeastRecentlyUsed(self):
+        cursorCache = paging.CursorCache(2, 60)
+        for pageToken in ["1", "2", "3"]:
+            cursorCache.add("request", pageToken, pageToken)
+        self.assertEqual(cursorCache.getNumCursors(), 2)
+        self.assertEqual(cursorCache.getEvictionCount(), 1)
+        self.assertIsNone(cursorCache.take("request", "1"))
+        self.assertEqual(cursorCache.take("request", "3"), "3")
+        self.assertIsNone(cursorCache.take("other", "2"))
+        self.assertEqual(cursorCache.getHitCount(), 1)
+        self.assertEqual(cursorCache.getMissCount(), 2)
+        self.assertRaises(ValueError, paging.CursorCache, 0, 60)
+
+    def testEvictedCursorsClosed(self):
+        closed = []
+
+        def cursor(pageToken):
+            try:
+                yield pageToken
+            finally:
+                closed.append(pageToken)
+        cursorCache = paging.CursorCache(1, 60)
+        for pageToken in ["1", "2"]:
+            iterator = cursor(pageToken)
+            next(iterator)
+            cursorCache.add("request", pageToken, iterator)
+        self.assertEqual(closed, ["1"])
+
+    def testDisabled(self):
+        self._backend.setCursorCache(0, 60)
+        self.assertIsNone(self._backend.getCursorCache())
+
+
+class TestStreamingResponses(unittest.TestCase):
+    """
+    Tests that streamed search responses match those built in memory.
+    """
+    def setUp(self):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        self._backend = backend.Backend(dataRepo)
+        dataset = dataRepo.getDatasetByIndex(0)
+        self._variantSetId = dataset.getVariantSetByName("vs_0").getId()
+
+    def _searchVariants(self, pageToken):
+        request = protocol.SearchVariantsRequest()
+        request.variant_set_id = self._variantSetId
+        request.reference_name = "1"
+        request.end = 2**30
+        request.page_size = 7
+        request.page_token = pageToken
+        return self._backend.runSearchVariants(protocol.toJson(request))
+
+    def testSearchVariants(self):
+        pageToken = ""
+        while True:
+            self._backend.setStreamingResponses(False)
+            expected = protocol.fromJson(
+                self._searchVariants(pageToken),
+                protocol.SearchVariantsResponse)
+            self._backend.setStreamingResponses(True)
+            pieces = list(self._searchVariants(pageToken))
+            self.assertGreater(len(pieces), len(expected.variants))
+            response = protocol.fromJson(
+                "".join(pieces), protocol.SearchVariantsResponse)
+            self.assertEqual(response, expected)
+            pageToken = response.next_page_token
+            if not pageToken:
+                break
+
+    def testErrorBeforeStreaming(self):
+        # The datasets generator only parses the page token once iteration
+        # begins, which must happen before the response is returned.
+        self._backend.setStreamingResponses(True)
+        request = protocol.SearchDatasetsRequest()
+        request.page_token = "notValid"
+        self.assertRaises(
+            exceptions.BadPageTokenException,
+            self._backend.runSearchDatasets, protocol.toJson(request))
+
+
+class TestResponseCache(unittest.TestCase):
+    """
+    Tests the cache of search responses.
+    """
+    def setUp(self):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        self._backend = backend.Backend(dataRepo)
+        dataset = dataRepo.getDatasetByIndex(0)
+        self._variantSetId = dataset.getVariantSetByName("vs_0").getId()
+
+    def _searchVariants(self, start):
+        request = protocol.SearchVariantsRequest()
+        request.variant_set_id = self._variantSetId
+        request.reference_name = "1"
+        request.start = start
+        request.end = 2**30
+        request.page_size = 7
+        return self._backend.runSearchVariants(protocol.toJson(request))
+
+    def testSearchVariants(self):
+        expected = [self._searchVariants(start) for start in [0, 10500]]
+        self._backend.setResponseCache(
+            2**20, 60, ["SearchVariantsRequest"])
+        for _ in range(2):
+            self.assertEqual(
+                [self._searchVariants(start) for start in [0, 10500]],
+                expected)
+        responseCache = self._backend.getResponseCache()
+        self.assertEqual(responseCache.getMissCount(), 2)
+        self.assertEqual(responseCache.getHitCount(), 2)
+        self.assertEqual(responseCache.getNumEntries(), 2)
+        # Requests with the same fields share an entry however their JSON
+        # is formatted.
+        cacheKeys = [
+            self._backend._getResponseCacheKey(
+                protocol.fromJson(
+                    requestJson, protocol.SearchVariantsRequest),
+                backend.JSON_MIMETYPE)
+            for requestJson in [
+                '{"start": 1, "referenceName": "1"}',
+                '{ "referenceName":"1",\n "start":1 }']]
+        self.assertEqual(cacheKeys[0], cacheKeys[1])
+
+    def testEndpointNotCached(self):
+        self._backend.setResponseCache(
+            2**20, 60, ["SearchFeaturesRequest"])
+        self._searchVariants(0)
+        self._searchVariants(0)
+        responseCache = self._backend.getResponseCache()
+        self.assertEqual(responseCache.getNumEntries(), 0)
+        self.assertEqual(responseCache.getMissCount(), 0)
+
+    def testEvictions(self):
+        responseCache = response_cache.ResponseCache(10, 60)
+        responseCache.put(("a",), 1, "1234")
+        responseCache.put(("b",), 1, "1234")
+        self.assertEqual(responseCache.getSize(), 10)
+        self.assertEqual(responseCache.get(("a",), 1), "1234")
+        # The least recently used entry is evicted to make room
+        responseCache.put(("c",), 1, "1234")
+        self.assertIsNone(responseCache.get(("b",), 1))
+        self.assertEqual(responseCache.getEvictionCount(), 1)
+        # Responses larger than the cache are never stored
+        responseCache.put(("d",), 1, "1234567890")
+        self.assertIsNone(responseCache.get(("d",), 1))
+        # A new version stamp invalidates all entries
+        self.assertIsNone(responseCache.get(("a",), 2))
+        self.assertEqual(responseCache.getNumEntries(), 0)
+        self.assertEqual(responseCache.getInvalidationCount(), 1)
+        responseCache = response_cache.ResponseCache(10, -1)
+        responseCache.put(("a",), 1, "1234")
+        self.assertIsNone(responseCache.get(("a",), 1))
+        self.assertRaises(ValueError, response_cache.ResponseCache, 0, 60)
+
+    def testDisabled(self):
+        self._backend.setResponseCache(0, 60, ["SearchVariantsRequest"])
+        self.assertIsNone(self._backend.getResponseCache())
+
+    def testVersionStamp(self):
+        dataRepo = self._backend.getDataRepository()
+        self.assertEqual(
+            dataRepo.getVersionStamp(), dataRepo.getVersionStamp())
+        self.assertIsNone(datarepo.EmptyDataRepository().getVersionStamp())
+
+
 class TestTopLevelObjectGenerator(unittest.TestCase):
     """
     Tests the generator used for top level objects
@@ -0,0 +1,92 @@
+"""
+Tests the columnar store of variant records
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import shutil
+import tempfile
+import unittest
+
+import ga4gh.server.columnar_store as columnar_store
+
+
+class TestColumnarStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="ga4gh_columnar_store")
+        writer = columnar_store.ColumnarStoreWriter(
+            self.directory, ["S1", "S2"], [{"key": "version"}])
+        writer.beginContig("1", 2, 3)
+        writer.addRecord(10, 11, b"a", [
+            ((0, 1), True, [-0.5, -1.0, -2.0]), ((1,), False, [])])
+        writer.addRecord(10, 20, b"bc", [
+            ((None, 0), False, [-1.0, None, -3.0]), ((1, 1), True, [])])
+        writer.addRecord(30, 31, b"", [
+            ((0, 0), False, [-0.25]), ((0, 1), False, [-1.5])])
+        writer.beginContig("2", 1, 0)
+        writer.addRecord(5, 6, b"d", [((0,), False, []), ((1,), True, [])])
+        writer.close()
+        self.store = columnar_store.ColumnarStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testManifest(self):
+        self.assertEqual(self.store.getSampleNames(), ["S1", "S2"])
+        self.assertEqual(self.store.getMetadata(), [{"key": "version"}])
+        self.assertEqual(self.store.getContigNames(), ["1", "2"])
+        self.assertIsNone(self.store.getContig("3"))
+        self.assertEqual(self.store.getContig("1").getNumRecords(), 3)
+
+    def testRecordIndexes(self):
+        contig = self.store.getContig("1")
+        self.assertEqual(list(contig.getRecordIndexes(0, 100)), [0, 1, 2])
+        self.assertEqual(list(contig.getRecordIndexes(11, 30)), [1])
+        self.assertEqual(list(contig.getRecordIndexes(15, 16)), [1])
+        self.assertEqual(list(contig.getRecordIndexes(20, 30)), [])
+        self.assertEqual(list(contig.getRecordIndexes(30, 31)), [2])
+        self.assertEqual(list(contig.getRecordIndexes(31, 100)), [])
+        self.assertEqual(contig.getStart(1), 10)
+        self.assertEqual(contig.getEnd(1), 20)
+        self.assertEqual(contig.getMaxEnd(), 31)
+
+    def testSites(self):
+        contig = self.store.getContig("1")
+        self.assertEqual(
+            [contig.getSite(index) for index in range(3)],
+            [b"a", b"bc", b""])
+
+    def testCalls(self):
+        contig = self.store.getContig("1")
+        self.assertEqual(contig.getCalls(0, [0, 1]), [
+            ([0, 1], True, [-0.5, -1.0, -2.0]), ([1], False, [])])
+        calls = contig.getCalls(1, [1, 0])
+        self.assertEqual(calls[0], ([1, 1], True, []))
+        self.assertEqual(calls[1][0], [columnar_store.MISSING_ALLELE, 0])
+        self.assertEqual(calls[1][2][0], -1.0)
+        self.assertNotEqual(calls[1][2][1], calls[1][2][1])  # NaN
+        self.assertEqual(contig.getCalls(2, []), [])
+        self.assertEqual(
+            self.store.getContig("2").getCalls(0, [1]), [([1], True, [])])
+
+    def testManyAlleles(self):
+        writer = columnar_store.ColumnarStoreWriter(
+            self.directory, ["S1"])
+        writer.beginContig("1", 2, 0)
+        writer.addRecord(10, 11, b"", [((127, 300), False, [])])
+        writer.addRecord(12, 13, b"", [((32767,), False, [])])
+        writer.close()
+        contig = columnar_store.ColumnarStore(self.directory).getContig("1")
+        self.assertEqual(contig.getCalls(0, [0]), [([127, 300], False, [])])
+        self.assertEqual(contig.getCalls(1, [0]), [([32767], False, [])])
+
+    def testUnsortedRecords(self):
+        writer = columnar_store.ColumnarStoreWriter(
+            self.directory, ["S1"])
+        writer.beginContig("1", 1, 0)
+        writer.addRecord(10, 11, b"", [((0,), False, [])])
+        with self.assertRaises(ValueError):
+            writer.addRecord(9, 10, b"", [((0,), False, [])])
+        writer.close()
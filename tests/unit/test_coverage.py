@@ -0,0 +1,106 @@
+"""
+Tests the binned reads coverage and its tile cache
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import shutil
+import tempfile
+import unittest
+
+import ga4gh.server.coverage as coverage
+
+
+class FakeReference(object):
+
+    def __init__(self, length):
+        self._length = length
+
+    def getLocalId(self):
+        return "ref"
+
+    def getLength(self):
+        return self._length
+
+
+class FakeReadGroupSet(object):
+    """
+    A read group set whose depth at each position is the position
+    itself, recording the tiles it is asked for.
+    """
+    def __init__(self):
+        self.tiles = []
+
+    def getCoverageSourceKey(self):
+        return "fake.bam:1"
+
+    def getBinnedCoverage(self, reference, start, end, binSize):
+        self.tiles.append((start, end))
+        return [
+            sum(range(binStart, min(binStart + binSize, end))) / min(
+                binSize, end - binStart)
+            for binStart in range(start, end, binSize)]
+
+
+class TestCoverage(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="ga4gh_coverage")
+        self.reference = FakeReference(5000)
+        self.readGroupSet = FakeReadGroupSet()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testBinnedCoverage(self):
+        binStart, depths = coverage.getBinnedCoverage(
+            self.readGroupSet, self.reference, 15, 42, 10)
+        self.assertEqual(binStart, 10)
+        self.assertEqual(depths, [14.5, 24.5, 34.5, 44.5])
+        # Without a tile cache, only the bins of the request are computed.
+        self.assertEqual(self.readGroupSet.tiles, [(10, 50)])
+
+    def testLargeBins(self):
+        binStart, depths = coverage.getBinnedCoverage(
+            self.readGroupSet, self.reference, 4000, 4001, 10 ** 9)
+        self.assertEqual(binStart, 0)
+        self.assertEqual(depths, [2499.5])
+        self.assertEqual(self.readGroupSet.tiles, [(0, 5000)])
+
+    def testTiles(self):
+        binSize = 2
+        tileSize = binSize * coverage.BINS_PER_TILE
+        reference = FakeReference(4999)
+        tileCache = coverage.CoverageTileCache(self.directory, 10)
+        binStart, depths = coverage.getBinnedCoverage(
+            self.readGroupSet, reference, tileSize - 2, 4999, binSize,
+            tileCache)
+        self.assertEqual(binStart, tileSize - 2)
+        self.assertEqual(len(depths), (4999 - binStart + 1) // binSize)
+        self.assertEqual(depths[0], tileSize - 1.5)
+        # The last bin is truncated at the end of the reference.
+        self.assertEqual(depths[-1], 4998)
+        self.assertEqual(self.readGroupSet.tiles, [
+            (0, tileSize), (tileSize, 2 * tileSize), (2 * tileSize, 4999)])
+
+    def testTileCache(self):
+        tileCache = coverage.CoverageTileCache(self.directory, 10)
+        expected = coverage.getBinnedCoverage(
+            self.readGroupSet, self.reference, 0, 5000, 1, tileCache)
+        self.assertEqual(len(self.readGroupSet.tiles), 5)
+        self.readGroupSet.tiles = []
+        # The cache is shared by the handles of the same directory.
+        tileCache = coverage.CoverageTileCache(self.directory, 10)
+        self.assertEqual(
+            coverage.getBinnedCoverage(
+                self.readGroupSet, self.reference, 0, 5000, 1, tileCache),
+            expected)
+        self.assertEqual(self.readGroupSet.tiles, [])
+        coverage.getBinnedCoverage(
+            self.readGroupSet, self.reference, 0, 5000, 2, tileCache)
+        self.assertEqual(len(self.readGroupSet.tiles), 3)
+
+    def testBadTileCacheSize(self):
+        with self.assertRaises(ValueError):
+            coverage.CoverageTileCache(self.directory, 0)
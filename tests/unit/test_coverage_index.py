@@ -0,0 +1,95 @@
+"""
+Tests the coverage index of alignment files
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import ga4gh.server.coverage_index as coverage_index
+
+
+class TestCoverageIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="ga4gh_coverage_index")
+        self.dataUrl = os.path.join(self.directory, "reads.bam")
+        with open(self.dataUrl, "w") as dataFile:
+            dataFile.write("reads")
+        self.indexPath = coverage_index.getCoverageIndexPath(self.dataUrl)
+        writer = coverage_index.CoverageIndexWriter(
+            self.indexPath, self.dataUrl, ["RG1", "RG2"], [4, 8])
+        writer.beginReference("1", 18)
+        writer.countRead("RG1", True)
+        writer.addRead("RG1", [(0, 6)])
+        writer.countRead("RG2", True)
+        writer.addRead("RG2", [(2, 4), (10, 18)])
+        writer.countRead(None, True)
+        writer.addRead(None, [(16, 20)])
+        writer.beginReference("2", 8)
+        writer.countRead("RG1", False)
+        writer.close()
+        self.index = coverage_index.CoverageIndex(self.indexPath)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def testReadCounts(self):
+        self.assertEqual(self.index.getReadCounts(), (3, 1))
+        self.assertEqual(self.index.getReadCounts("RG1"), (1, 1))
+        self.assertEqual(self.index.getReadCounts("RG2"), (1, 0))
+
+    def testBinnedCoverage(self):
+        self.assertEqual(
+            self.index.getBinnedCoverage("RG1", "1", 0, 18, 4),
+            [1, 0.5, 0, 0, 0])
+        self.assertEqual(
+            self.index.getBinnedCoverage("RG2", "1", 0, 18, 8),
+            [0.25, 0.75, 1])
+        # The bins of all the reads count reads of no read group.
+        self.assertEqual(
+            self.index.getBinnedCoverage(None, "1", 8, 18, 8), [0.75, 2])
+        self.assertEqual(
+            self.index.getBinnedCoverage(None, "1", 0, 16, 16),
+            [(6 + 2 + 6) / 16])
+        self.assertEqual(
+            self.index.getBinnedCoverage("RG1", "2", 0, 8, 4), [0, 0])
+
+    def testUnavailableCoverage(self):
+        for args in [
+                ("RG3", "1", 0, 8, 4), ("RG1", "3", 0, 8, 4),
+                ("RG1", "1", 0, 8, 6), ("RG1", "1", 2, 8, 4),
+                ("RG1", "1", 0, 10, 4), ("RG1", "1", 0, 20, 4)]:
+            self.assertIsNone(self.index.getBinnedCoverage(*args))
+
+    def testIsCurrent(self):
+        self.assertTrue(self.index.isCurrent(self.dataUrl))
+        with open(self.dataUrl, "a") as dataFile:
+            dataFile.write("more reads")
+        self.assertFalse(self.index.isCurrent(self.dataUrl))
+
+    def testReplacedIndex(self):
+        # An index that is open keeps reading the file it was opened from
+        # when the index is rebuilt.
+        writer = coverage_index.CoverageIndexWriter(
+            self.indexPath, self.dataUrl, [], [4, 8])
+        writer.beginReference("1", 8)
+        writer.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            "reads.bam", "reads.bam.coverage"])
+        self.assertEqual(self.index.getReadCounts(), (3, 1))
+        index = coverage_index.CoverageIndex(self.indexPath)
+        try:
+            self.assertEqual(index.getReadCounts(), (0, 0))
+        finally:
+            index.close()
+
+    def testBadBinSizes(self):
+        with self.assertRaises(ValueError):
+            coverage_index.CoverageIndexWriter(
+                self.indexPath, self.dataUrl, [], [4, 6])
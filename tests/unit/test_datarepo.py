@@ -6,11 +6,13 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
+import sqlite3
 import tempfile
 import unittest
 
 import ga4gh.server.datarepo as datarepo
 import ga4gh.server.exceptions as exceptions
+import ga4gh.server.repo.models as models
 
 
 prefix = "ga4gh_datarepo_test"
@@ -60,6 +62,44 @@ class TestDataRepoVersion(AbstractDataRepoTest):
             anotherRepo.open(datarepo.MODE_READ)
 
 
+class TestDataRepoMigration(AbstractDataRepoTest):
+    """
+    Tests that registries created before the variant set format column
+    can still be read and updated.
+    """
+    def setUp(self):
+        super(TestDataRepoMigration, self).setUp()
+        repo = datarepo.SqlDataRepository(self._repoPath)
+        repo.open(datarepo.MODE_WRITE)
+        repo.initialise()
+        repo.close()
+        table = models.Variantset._meta.db_table
+        connection = sqlite3.connect(self._repoPath)
+        connection.execute("DROP TABLE {}".format(table))
+        connection.execute(
+            "CREATE TABLE {} (id TEXT PRIMARY KEY, attributes TEXT, "
+            "created TEXT, dataUrlIndexMap TEXT NOT NULL, "
+            "datasetId TEXT NOT NULL, metadata TEXT, name TEXT NOT NULL, "
+            "referenceSetId TEXT NOT NULL, updated TEXT)".format(table))
+        connection.execute(
+            "UPDATE {} SET value = '2.1' WHERE key = 'schemaVersion'".format(
+                models.System._meta.db_table))
+        connection.commit()
+        connection.close()
+
+    def testReadOldRegistry(self):
+        repo = datarepo.SqlDataRepository(self._repoPath)
+        repo.open(datarepo.MODE_READ)
+        self.assertEqual(repo._schemaVersion, "2.1")
+        self.assertFalse(repo._hasVariantSetFormat())
+
+    def testAddVariantSetFormat(self):
+        repo = datarepo.SqlDataRepository(self._repoPath)
+        repo.open(datarepo.MODE_WRITE)
+        repo._addVariantSetFormat()
+        self.assertTrue(repo._hasVariantSetFormat())
+
+
 class TestBadDatabase(AbstractDataRepoTest):
     """
     Tests that errors are thrown when an invalid database is used
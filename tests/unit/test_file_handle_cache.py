@@ -58,6 +58,42 @@ class TestFileHandleCache(datamodel.PysamFileHandleCache, unittest.TestCase):
         self.assertNotEqual(self._cache[topIndex][0], fileList[1])
         self.assertEquals(self._cache[0][0], fileList[1])
 
+    def testCounters(self):
+        self.setMaxCacheSize(1)
+        first = os.path.join(self._tempdir, str(uuid.uuid4()))
+        second = os.path.join(self._tempdir, str(uuid.uuid4()))
+        self._getFileHandle(first)
+        self._getFileHandle(first)
+        self._getFileHandle(second)
+        self.assertEqual(self.getNumHandles(), 1)
+        self.assertEqual(self.getHitCount(), 1)
+        self.assertEqual(self.getMissCount(), 2)
+        self.assertEqual(self.getEvictionCount(), 1)
+
+    def testEvictedHandlesClosed(self):
+        self.setMaxCacheSize(1)
+        first = os.path.join(self._tempdir, str(uuid.uuid4()))
+        second = os.path.join(self._tempdir, str(uuid.uuid4()))
+        third = os.path.join(self._tempdir, str(uuid.uuid4()))
+        firstHandle = self._getFileHandle(first)
+        self._getFileHandle(second)
+        self.assertTrue(firstHandle.closed)
+        # A pinned handle is only closed when its last pin is released.
+        secondHandle = self._getFileHandle(second)
+        self.pin(secondHandle)
+        self.pin(secondHandle)
+        self._getFileHandle(third)
+        self.assertFalse(secondHandle.closed)
+        self.unpin(secondHandle)
+        self.assertFalse(secondHandle.closed)
+        self.unpin(secondHandle)
+        self.assertTrue(secondHandle.closed)
+        # Handles still in the cache stay open when unpinned.
+        thirdHandle = self._getFileHandle(third)
+        self.pin(thirdHandle)
+        self.unpin(thirdHandle)
+        self.assertFalse(thirdHandle.closed)
+
     def testSetCacheMaxSize(self):
         self.assertRaises(ValueError, self.setMaxCacheSize, 0)
         self.assertRaises(ValueError, self.setMaxCacheSize, -1)
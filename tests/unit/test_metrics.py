@@ -0,0 +1,78 @@
+"""
+Tests the collection of request metrics
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import ga4gh.server.metrics as metrics
+
+
+class TestHistogram(unittest.TestCase):
+
+    def testSamples(self):
+        histogram = metrics.Histogram([1, 10])
+        for value in [0, 1, 5, 20]:
+            histogram.observe(value)
+        samples = histogram.getSamples([("endpoint", "/x")])
+        self.assertEqual(samples, [
+            ("_bucket", [("endpoint", "/x"), ("le", "1")], 2),
+            ("_bucket", [("endpoint", "/x"), ("le", "10")], 3),
+            ("_bucket", [("endpoint", "/x"), ("le", "+Inf")], 4),
+            ("_sum", [("endpoint", "/x")], 26),
+            ("_count", [("endpoint", "/x")], 4)])
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = metrics.Metrics()
+
+    def testRequests(self):
+        self.metrics.observeRequest("/reads/search", 200, 0.02, 100)
+        self.metrics.observeRequest("/reads/search", 200, 0.2, 50)
+        self.metrics.observeRequest("/reads/search", 404, 0.001, 10)
+        lines = self.metrics.getPrometheusText().splitlines()
+        self.assertIn(
+            'ga4gh_requests_total{endpoint="/reads/search",status="200"} 2',
+            lines)
+        self.assertIn(
+            'ga4gh_requests_total{endpoint="/reads/search",status="404"} 1',
+            lines)
+        self.assertIn(
+            'ga4gh_response_bytes_total{endpoint="/reads/search"} 160',
+            lines)
+        self.assertIn(
+            'ga4gh_request_duration_seconds_bucket'
+            '{endpoint="/reads/search",le="0.025"} 2', lines)
+        self.assertIn(
+            'ga4gh_request_duration_seconds_count'
+            '{endpoint="/reads/search"} 3', lines)
+
+    def testSearches(self):
+        self.metrics.observeSearch("SearchReadsRequest", 100, 100)
+        self.metrics.observeSearch("SearchReadsRequest", 100, 7)
+        lines = self.metrics.getPrometheusText().splitlines()
+        self.assertIn(
+            'ga4gh_search_page_size_sum{request="SearchReadsRequest"} 200',
+            lines)
+        self.assertIn(
+            'ga4gh_search_response_items_bucket'
+            '{request="SearchReadsRequest",le="10"} 1', lines)
+
+    def testCollectors(self):
+        def collector():
+            return [("test_total", "counter", "A test.", [([("a", 1)], 5)])]
+        self.metrics.addCollector(collector)
+        text = self.metrics.getPrometheusText()
+        self.assertIn("# HELP test_total A test.\n", text)
+        self.assertIn("# TYPE test_total counter\n", text)
+        self.assertIn('test_total{a="1"} 5\n', text)
+        self.assertIn("ga4gh_file_handle_cache_handles ", text)
+
+    def testLabelEscaping(self):
+        self.metrics.observeRequest('a"b\\c', 200, 0, 0)
+        self.assertIn(
+            'endpoint="a\\"b\\\\c"', self.metrics.getPrometheusText())
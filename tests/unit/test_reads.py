@@ -6,9 +6,11 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
 import unittest
 
 import ga4gh.server.datamodel.reads as reads
+import ga4gh.server.exceptions as exceptions
 
 import ga4gh.schemas.protocol as protocol
 
@@ -248,3 +250,77 @@ class TestSamFlags(unittest.TestCase):
             self.flag, reads.SamFlags.FIRST_IN_PAIR))
         self.assertTrue(reads.SamFlags.isFlagSet(
             self.flag, reads.SamFlags.FAILED_QUALITY_CHECK))
+
+
+FakeRead = collections.namedtuple(
+    "FakeRead", ["query_name", "reference_start", "reference_end"])
+
+
+class TestReadSampler(unittest.TestCase):
+    """
+    Tests the deterministic downsampling of reads to a maximum number of
+    reads per window.
+    """
+    def setUp(self):
+        self.reads = []
+        for position in range(0, 40, 2):
+            for suffix in "abc":
+                self.reads.append(FakeRead(
+                    "read{}{}".format(position, suffix), position,
+                    position + 5))
+        self.sampler = reads.ReadSampler(2, 10)
+
+    def getReads(self, start, end):
+        for read in self.reads:
+            if read.reference_start < end and read.reference_end > start:
+                yield read, "readGroupId"
+
+    def sample(self, start, end):
+        return [
+            read for read, readGroupId in self.sampler.sample(
+                self.getReads, start, end)]
+
+    def testMaxReadsPerWindow(self):
+        sampledReads = self.sample(0, 40)
+        for windowStart in range(0, 40, 10):
+            windowReads = [
+                read for read in self.reads
+                if windowStart <= read.reference_start < windowStart + 10]
+            expected = sorted(
+                windowReads, key=reads.ReadSampler.hashRead)[:2]
+            self.assertEqual(
+                [read for read in sampledReads
+                 if windowStart <= read.reference_start < windowStart + 10],
+                sorted(expected, key=self.reads.index))
+
+    def testConsistentSearches(self):
+        # Searches starting and ending anywhere keep the same reads.
+        sampledReads = self.sample(0, 40)
+        for start in range(0, 40, 3):
+            self.assertEqual(
+                self.sample(start, 40),
+                [read for read in sampledReads
+                 if read.reference_end > start])
+        for end in range(1, 40, 3):
+            self.assertEqual(
+                self.sample(0, end),
+                [read for read in sampledReads
+                 if read.reference_start < end])
+        self.assertEqual(self.sample(50, 60), [])
+
+    def testSinglePass(self):
+        # The reads are read in a single pass after probing for the
+        # first one.
+        intervals = []
+
+        def getReads(start, end):
+            intervals.append((start, end))
+            return self.getReads(start, end)
+
+        list(self.sampler.sample(getReads, 3, 37))
+        self.assertEqual(intervals, [(3, 37), (0, 40)])
+
+    def testBadParameters(self):
+        for maxReadsPerWindow, windowSize in [(0, 10), (10, 0), (-1, None)]:
+            with self.assertRaises(exceptions.BadReadSamplingException):
+                reads.ReadSampler(maxReadsPerWindow, windowSize)
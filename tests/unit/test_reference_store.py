@@ -0,0 +1,84 @@
+"""
+Tests the compiled store of reference bases
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import ga4gh.server.reference_store as reference_store
+
+
+class TestReferenceStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="ga4gh_reference_store")
+        self.dataUrl = os.path.join(self.directory, "reference.fa.gz")
+        with open(self.dataUrl, "w") as dataFile:
+            dataFile.write("bases")
+        self.storePath = reference_store.getReferenceStorePath(self.dataUrl)
+        writer = reference_store.ReferenceStoreWriter(
+            self.storePath, self.dataUrl)
+        writer.beginReference("1")
+        writer.addBases(b"ACgt")
+        writer.addBases(b"nN")
+        writer.beginReference("2")
+        writer.beginReference("3")
+        writer.addBases(b"TTA")
+        writer.close()
+        self.store = reference_store.ReferenceStore(self.storePath)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def testGetBases(self):
+        # soft-masked bases are kept as they are
+        self.assertEqual(self.store.getBases("1", 0, 6), b"ACgtnN")
+        self.assertEqual(self.store.getBases("1", 2, 4), b"gt")
+        self.assertEqual(self.store.getBases("1", 4, 10), b"nN")
+        self.assertEqual(self.store.getBases("2", 0, 1), b"")
+        self.assertEqual(self.store.getBases("3", 1, 3), b"TA")
+        self.assertTrue(self.store.hasReference("2"))
+        self.assertFalse(self.store.hasReference("4"))
+
+    def testIsCurrent(self):
+        self.assertTrue(self.store.isCurrent(self.dataUrl))
+        with open(self.dataUrl, "a") as dataFile:
+            dataFile.write("more bases")
+        self.assertFalse(self.store.isCurrent(self.dataUrl))
+
+    def testDuplicateReference(self):
+        writer = reference_store.ReferenceStoreWriter(
+            self.storePath + ".new", self.dataUrl)
+        writer.beginReference("1")
+        with self.assertRaises(ValueError):
+            writer.beginReference("1")
+        writer.close()
+
+    def testReplacedStore(self):
+        # A store that is open keeps reading the file it was opened from
+        # when the store is rebuilt.
+        writer = reference_store.ReferenceStoreWriter(
+            self.storePath, self.dataUrl)
+        writer.beginReference("1")
+        writer.addBases(b"GG")
+        writer.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            "reference.fa.gz", "reference.fa.gz.bases"])
+        self.assertEqual(self.store.getBases("1", 0, 6), b"ACgtnN")
+        store = reference_store.ReferenceStore(self.storePath)
+        try:
+            self.assertEqual(store.getBases("1", 0, 6), b"GG")
+        finally:
+            store.close()
+
+    def testInvalidStore(self):
+        with open(self.storePath, "wb") as storeFile:
+            storeFile.write(b"not a reference store")
+        with self.assertRaises(ValueError):
+            reference_store.ReferenceStore(self.storePath)
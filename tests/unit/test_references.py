@@ -91,3 +91,33 @@ class TestAbstractReference(unittest.TestCase):
             self.assertRaises(
                 exceptions.ReferenceRangeErrorException,
                 self._reference.checkQueryRange, badRange[0], badRange[1])
+
+
+class TestReferenceWindow(unittest.TestCase):
+    """
+    Unit tests for the window of reference bases used when filling in
+    the reference bases of reads.
+    """
+    def setUp(self):
+        referenceSet = references.AbstractReferenceSet('refSetId')
+        self._reference = references.SimulatedReference(
+            referenceSet, "ref", length=1000)
+        self._calls = []
+        getBases = self._reference.getBases
+
+        def countingGetBases(start, end):
+            self._calls.append((start, end))
+            return getBases(start, end)
+        self._reference.getBases = countingGetBases
+        self._window = references.ReferenceWindow(self._reference)
+        self._window.windowSize = 100
+
+    def testGetBases(self):
+        bases = self._reference.getBases(0, 1000)
+        self._calls = []
+        for start, end in [(10, 20), (50, 110), (109, 200), (990, 1010)]:
+            self.assertEqual(
+                self._window.getBases(start, end), bases[start:end])
+        self.assertEqual(self._window.getBases(1000, 1010), "")
+        self.assertEqual(
+            self._calls, [(10, 110), (109, 209), (990, 1000)])
@@ -8,6 +8,7 @@ from __future__ import unicode_literals
 import os
 import glob
 import shutil
+import sqlite3
 import tempfile
 import unittest
 
@@ -251,6 +252,36 @@ class TestAddFeatureSet(AbstractRepoManagerTest):
         # self.assertEqual(featureSet.getInfo(), "TODO")
         # self.assertEqual(featureSet.getSourceUrl(), "TODO")
 
+    def testAddFeatureSetCreatePageIndex(self):
+        directory = tempfile.mkdtemp(prefix="ga4gh_repoman_features")
+        try:
+            featuresPath = os.path.join(
+                directory, os.path.basename(paths.featuresPath))
+            shutil.copy(paths.featuresPath, featuresPath)
+            connection = sqlite3.connect(featuresPath)
+            connection.execute("DROP INDEX idx2")
+            connection.commit()
+            cmd = (
+                "add-featureset {} {} {} --referenceSetName={} "
+                "--ontologyName={}").format(
+                self._repoPath, self._datasetName, featuresPath,
+                self._referenceSetName, self._ontologyName)
+            # The DB is only modified when the index is asked for
+            self.runCommand(cmd)
+            query = (
+                "SELECT name FROM sqlite_master "
+                "WHERE type = 'index' AND name = 'idx2'")
+            self.assertEqual(connection.execute(query).fetchall(), [])
+            self.runCommand(
+                "remove-featureset {} {} {} -f".format(
+                    self._repoPath, self._datasetName,
+                    paths.featureSetName))
+            self.runCommand(cmd + " --createPageIndex")
+            self.assertEqual(len(connection.execute(query).fetchall()), 1)
+            connection.close()
+        finally:
+            shutil.rmtree(directory)
+
     def testAddFeatureSetNoReferenceSet(self):
         featuresPath = paths.featuresPath
         cmd = "add-featureset {} {} {} --ontologyName={}".format(
@@ -2,8 +2,10 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
 import unittest
 
+import ga4gh.server.exceptions as exceptions
 import ga4gh.server.response_builder as response_builder
 import ga4gh.schemas.protocol as protocol
 
@@ -108,3 +110,148 @@ class SearchResponseBuilderTest(unittest.TestCase):
             instance = protocol.fromJson(builder.getSerializedResponse(),
                                          responseClass)
             self.assertEqual(nextPageToken, instance.next_page_token)
+
+    def testStreamingIntegrity(self):
+        # Verifies that the pieces of a streamed response join to give
+        # exactly the values we put in across all subclasses of
+        # SearchResponse
+        for class_ in [responseClass for _, _, responseClass in
+                       protocol.postMethods]:
+            instance = class_()
+            valueList = getattr(instance, getValueListName(class_))
+            valueList.add()
+            valueList.add()
+            instance.next_page_token = "string"
+            builder = response_builder.StreamingSearchResponseBuilder(
+                class_, len(valueList), 2 ** 32)
+            pieces = []
+            for value in valueList:
+                builder.addValue(value)
+                pieces.append(builder.takeSerializedValues())
+            self.assertTrue(builder.isFull())
+            builder.setNextPageToken(instance.next_page_token)
+            pieces.append(builder.getSerializedResponse())
+            otherInstance = protocol.fromJson("".join(pieces), class_)
+            self.assertEqual(instance, otherInstance)
+
+    def testFieldMask(self):
+        responseClass = protocol.SearchReadsResponse
+        fieldMask = response_builder.parseFieldMask(
+            responseClass, "id, alignedSequence,alignment.position")
+        self.assertEqual(
+            fieldMask,
+            frozenset(["id", "aligned_sequence", "alignment"]))
+        alignment = protocol.ReadAlignment()
+        alignment.id = "read"
+        alignment.aligned_sequence = "ACGT"
+        alignment.aligned_quality.extend([1, 2, 3, 4])
+        alignment.alignment.position.position = 5
+        alignment.attributes.attr["NM"].values.add().int32_value = 1
+        expected = protocol.ReadAlignment()
+        expected.CopyFrom(alignment)
+        expected.ClearField(str("aligned_quality"))
+        expected.ClearField(str("attributes"))
+        for builderClass in [
+                response_builder.SearchResponseBuilder,
+                response_builder.StreamingSearchResponseBuilder]:
+            builder = builderClass(responseClass, 1, 2 ** 32, fieldMask)
+            builder.addValue(alignment)
+            pieces = []
+            if builderClass is response_builder.StreamingSearchResponseBuilder:
+                pieces.append(builder.takeSerializedValues())
+            pieces.append(builder.getSerializedResponse())
+            instance = protocol.fromJson("".join(pieces), responseClass)
+            self.assertEqual(list(instance.alignments), [expected])
+
+    def testBadFieldMask(self):
+        with self.assertRaises(exceptions.BadFieldMaskException):
+            response_builder.parseFieldMask(
+                protocol.SearchVariantsResponse, "calls,notAField")
+
+    def testEncodeQualities(self):
+        qualities = [0, 1, 40, 93]
+        self.assertEqual(
+            response_builder.encodeQualities(
+                qualities, response_builder.PHRED33_QUALITY_ENCODING),
+            "!\"I~")
+        self.assertEqual(
+            response_builder.encodeQualities(
+                qualities, response_builder.BASE64_QUALITY_ENCODING),
+            "AAEoXQ==")
+        with self.assertRaises(
+                exceptions.UnsupportedQualityEncodingException):
+            response_builder.encodeQualities(qualities, "notAnEncoding")
+
+    def testQualityEncoding(self):
+        responseClass = protocol.SearchReadsResponse
+        alignment = protocol.ReadAlignment()
+        alignment.id = "read"
+        alignment.aligned_sequence = "ACG"
+        alignment.aligned_quality.extend([30, 1, 1])
+        emptyAlignment = protocol.ReadAlignment()
+        for builderClass in [
+                response_builder.SearchResponseBuilder,
+                response_builder.StreamingSearchResponseBuilder]:
+            builder = builderClass(
+                responseClass, 2, 2 ** 32,
+                qualityEncoding=response_builder.PHRED33_QUALITY_ENCODING)
+            builder.addValue(alignment)
+            builder.addValue(emptyAlignment)
+            builder.setNextPageToken("token")
+            pieces = []
+            if builderClass is response_builder.StreamingSearchResponseBuilder:
+                pieces.append(builder.takeSerializedValues())
+            pieces.append(builder.getSerializedResponse())
+            response = json.loads("".join(pieces))
+            self.assertEqual(response["nextPageToken"], "token")
+            self.assertEqual(len(response["alignments"]), 2)
+            values = response["alignments"]
+            self.assertEqual(values[0]["alignedQuality"], "?\"\"")
+            self.assertEqual(values[0]["id"], "read")
+            self.assertNotIn("alignedQuality", values[1])
+
+    def testEncodedQualitiesValue(self):
+        # Qualities encoded as the values were converted are written
+        # without being set in the values.
+        responseClass = protocol.SearchReadsResponse
+        alignment = protocol.ReadAlignment()
+        alignment.id = "read"
+        for builderClass in [
+                response_builder.SearchResponseBuilder,
+                response_builder.StreamingSearchResponseBuilder]:
+            for fieldMask, expected in [
+                    (None, "?\"\""), (frozenset(["id"]), None)]:
+                builder = builderClass(
+                    responseClass, 3, 2 ** 32, fieldMask,
+                    response_builder.PHRED33_QUALITY_ENCODING)
+                builder.addValue(response_builder.EncodedQualitiesValue(
+                    alignment, "?\"\""))
+                builder.addValue(response_builder.EncodedQualitiesValue(
+                    alignment, None))
+                builder.addValue(alignment)
+                pieces = []
+                if (builderClass is
+                        response_builder.StreamingSearchResponseBuilder):
+                    pieces.append(builder.takeSerializedValues())
+                pieces.append(builder.getSerializedResponse())
+                values = json.loads("".join(pieces))["alignments"]
+                self.assertEqual(
+                    [value["id"] for value in values], ["read"] * 3)
+                self.assertEqual(values[0].get("alignedQuality"), expected)
+                self.assertNotIn("alignedQuality", values[1])
+                self.assertNotIn("alignedQuality", values[2])
+
+    def testQualityEncodingIgnored(self):
+        # Values without base qualities are serialised as usual
+        responseClass = protocol.SearchVariantsResponse
+        builder = response_builder.SearchResponseBuilder(
+            responseClass, 1, 2 ** 32,
+            qualityEncoding=response_builder.BASE64_QUALITY_ENCODING)
+        builder.addValue(protocol.Variant(id="variant"))
+        instance = protocol.fromJson(
+            builder.getSerializedResponse(), responseClass)
+        self.assertEqual(instance.variants[0].id, "variant")
+        with self.assertRaises(
+                exceptions.UnsupportedQualityEncodingException):
+            response_builder.SearchResponseBuilder(
+                responseClass, 1, 2 ** 32, qualityEncoding="notAnEncoding")
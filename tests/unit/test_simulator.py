@@ -169,3 +169,22 @@ class TestSimulatedReadGroupSet(unittest.TestCase):
         for readGroup in simulatedReadGroupSet.getReadGroups():
             alignments = list(readGroup.getReadAlignments())
             self.assertGreater(len(alignments), 0)
+
+    def testSearchOptions(self):
+        dataset = datasets.Dataset('dataset1')
+        referenceSet = references.SimulatedReferenceSet("srs1")
+        simulatedReadGroupSet = reads.SimulatedReadGroupSet(
+            dataset, "readGroupSetId", referenceSet, numAlignments=5)
+        readSampler = reads.ReadSampler(2)
+        for readGroup in simulatedReadGroupSet.getReadGroups():
+            alignments = list(readGroup.getReadAlignments())
+            sampledAlignments = list(readGroup.getReadAlignments(
+                readSampler=readSampler))
+            self.assertEqual(len(sampledAlignments), 2)
+            for alignment in sampledAlignments:
+                self.assertIn(alignment, alignments)
+            maskedAlignments = list(readGroup.getReadAlignments(
+                fieldMask=frozenset(["id"])))
+            self.assertEqual(len(maskedAlignments), len(alignments))
+            for alignment in maskedAlignments:
+                self.assertEqual(len(alignment.aligned_quality), 0)
@@ -0,0 +1,62 @@
+"""
+Tests the timing of request stages
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+import unittest
+
+import ga4gh.server.timing as timing
+
+
+class TestStageTimer(unittest.TestCase):
+
+    def tearDown(self):
+        timing.stopTimer()
+
+    def testNestedStages(self):
+        timer = timing.StageTimer()
+        with timer.stage("fetch"):
+            time.sleep(0.01)
+            with timer.stage("convert"):
+                time.sleep(0.02)
+        durations = timer.getDurations()
+        self.assertEqual([name for name, _ in durations], ["fetch", "convert"])
+        fetchTime, convertTime = [seconds for _, seconds in durations]
+        self.assertGreaterEqual(convertTime, 0.02)
+        # The time spent converting is not charged to fetching
+        self.assertLess(fetchTime, 0.02)
+        self.assertGreaterEqual(
+            timer.getElapsedTime(), fetchTime + convertTime)
+
+    def testRepeatedStages(self):
+        timer = timing.StageTimer()
+        for _ in range(3):
+            with timer.stage("build"):
+                time.sleep(0.005)
+        self.assertEqual(len(timer.getDurations()), 1)
+        self.assertGreaterEqual(timer.getDurations()[0][1], 0.015)
+
+    def testServerTimingHeader(self):
+        timer = timing.StageTimer()
+        with timer.stage("parse"):
+            pass
+        parts = timer.getServerTimingHeader().split(", ")
+        self.assertEqual(len(parts), 2)
+        self.assertTrue(parts[0].startswith("parse;dur="))
+        self.assertTrue(parts[1].startswith("total;dur="))
+
+    def testThreadTimer(self):
+        self.assertIsNone(timing.getTimer())
+        # Stages are ignored when no timer has been started
+        with timing.stage("parse"):
+            pass
+        timer = timing.startTimer()
+        self.assertIs(timing.getTimer(), timer)
+        with timing.stage("parse"):
+            pass
+        self.assertEqual([name for name, _ in timer.getDurations()], ["parse"])
+        self.assertIs(timing.stopTimer(), timer)
+        self.assertIsNone(timing.getTimer())
@@ -103,3 +103,47 @@ class TestHtslibVariantAnnotationSet(unittest.TestCase):
         expected = hashlib.md5("\t\t[]\t").hexdigest()
         hashed = self._variantAnnotationSet.getTranscriptEffectId(effect)
         self.assertEqual(hashed, expected)
+
+    def _convertTranscriptEffectByReflection(self, annotationSet, annStr):
+        """
+        Converts the specified ANN or CSQ string by setting each field
+        through protocol.deepSetAttr, as convertTranscriptEffect did
+        before its field plan was compiled.
+        """
+        effect = protocol.TranscriptEffect()
+        effect.hgvs_annotation.CopyFrom(protocol.HGVSAnnotation())
+        annDict = dict(zip(
+            annotationSet._getTranscriptEffectFields(), annStr.split("|")))
+        annDict["hgvs_annotation.genomic"] = ""
+        for key, val in annDict.items():
+            try:
+                protocol.deepSetAttr(effect, key, val)
+            except AttributeError:
+                if val and key not in annotationSet.EXCLUDED_FIELDS:
+                    protocol.setAttribute(
+                        effect.attributes.attr[key].values, val)
+        effect.effects.extend(
+            annotationSet.convertSeqOntology(annDict.get('effects')))
+        annotationSet.addLocations(
+            effect, annDict.get('protPos'), annDict.get('cdnaPos'))
+        effect.id = annotationSet.getTranscriptEffectId(effect)
+        return effect
+
+    def testConvertTranscriptEffect(self):
+        ontology = self._repo.getOntologyByName(paths.ontologyName)
+        for vcfDir in [
+                "tests/data/datasets/dataset1/variants/1kg.17.ann.edit",
+                "tests/data/datasets/dataset1/variants/1KG_GRCh37_VEP_edit"]:
+            self._createVariantAnnotationSet(vcfDir)
+            annotationSet = self._variantSet.getVariantAnnotationSets()[0]
+            annotationSet.setOntology(ontology)
+            for referenceName in (
+                    self._variantSet.getReferenceToDataUrlIndexMap()):
+                for record in self._variantSet.getPysamVariants(
+                        referenceName, 0, 2**31):
+                    for annStr in annotationSet._getAnnotations(record):
+                        self.assertEqual(
+                            annotationSet.convertTranscriptEffect(
+                                annStr, None),
+                            self._convertTranscriptEffectByReflection(
+                                annotationSet, annStr))
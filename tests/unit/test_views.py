@@ -5,9 +5,12 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
 import unittest
 import logging
 
+import werkzeug.datastructures
+
 import tests.paths as paths
 
 import ga4gh.server.datamodel as datamodel
@@ -30,7 +33,8 @@ class TestFrontend(unittest.TestCase):
             "SIMULATED_BACKEND_NUM_CALLS": 1,
             "SIMULATED_BACKEND_VARIANT_DENSITY": 1.0,
             "SIMULATED_BACKEND_NUM_VARIANT_SETS": 1,
-            "LANDING_MESSAGE_HTML": paths.landingMessageHtml
+            "LANDING_MESSAGE_HTML": paths.landingMessageHtml,
+            "METRICS_PATH": "/metrics",
             # "DEBUG" : True
         }
         frontend.reset()
@@ -405,6 +409,66 @@ class TestFrontend(unittest.TestCase):
         path = '/oauth2callback'
         self.assertEqual(501, self.app.get(path).status_code)
 
+    def testReadsSearchFieldMask(self):
+        request = protocol.SearchReadsRequest()
+        request.read_group_ids.append(self.readGroupId)
+        request.reference_id = self.referenceId
+        headers = {'Content-type': 'application/json'}
+        response = self.app.post(
+            '/reads/search?fields=id,alignedSequence', headers=headers,
+            data=protocol.toJson(request))
+        self.assertEqual(200, response.status_code)
+        alignments = protocol.fromJson(
+            response.data, protocol.SearchReadsResponse).alignments
+        self.assertEqual(len(alignments), 2)
+        for alignment in alignments:
+            self.assertNotEqual(alignment.id, "")
+            self.assertNotEqual(alignment.aligned_sequence, "")
+            self.assertEqual(len(alignment.aligned_quality), 0)
+            self.assertEqual(alignment.fragment_name, "")
+        headers['X-Fields'] = 'notAField'
+        response = self.app.post(
+            '/reads/search', headers=headers, data=protocol.toJson(request))
+        self.assertEqual(400, response.status_code)
+
+    def testReadsSearchQualityEncoding(self):
+        request = protocol.SearchReadsRequest()
+        request.read_group_ids.append(self.readGroupId)
+        request.reference_id = self.referenceId
+        headers = {
+            'Content-type': 'application/json',
+            'X-Quality-Encoding': 'phred33',
+        }
+        response = self.app.post(
+            '/reads/search', headers=headers, data=protocol.toJson(request))
+        self.assertEqual(200, response.status_code)
+        alignments = json.loads(response.data)["alignments"]
+        self.assertEqual(len(alignments), 2)
+        for alignment in alignments:
+            self.assertEqual(
+                len(alignment["alignedQuality"]),
+                len(alignment["alignedSequence"]))
+        response = self.app.post(
+            '/reads/search?qualityEncoding=notAnEncoding', headers=headers,
+            data=protocol.toJson(request))
+        self.assertEqual(400, response.status_code)
+
+    def testReadsCoverage(self):
+        request = protocol.SearchReadsRequest()
+        request.read_group_ids.append(self.readGroupId)
+        request.reference_id = self.referenceId
+        headers = {'Content-type': 'application/json'}
+        requestDict = json.loads(protocol.toJson(request))
+        requestDict["binSize"] = 0
+        response = self.app.post(
+            '/reads/coverage', headers=headers, data=json.dumps(requestDict))
+        self.assertEqual(400, response.status_code)
+        # Simulated read groups have no alignment file to count.
+        del requestDict["binSize"]
+        response = self.app.post(
+            '/reads/coverage', headers=headers, data=json.dumps(requestDict))
+        self.assertEqual(501, response.status_code)
+
     def testSearchUnmappedReads(self):
         response = self.sendReadsSearch(
             readGroupIds=[self.readGroupId], referenceId="")
@@ -552,6 +616,96 @@ class TestFrontend(unittest.TestCase):
         # An empty mimetype should work OK
         request = Mock()
         request.mimetype = None
+        request.accept_mimetypes = werkzeug.datastructures.MIMEAccept()
         request.get_data = lambda: "data"
-        response = frontend.handleHttpPost(request, lambda x: x)
+        response = frontend.handleHttpPost(
+            request, lambda x, requestMimetype, responseMimetype: x)
         self.assertEquals(response.get_data(), "data")
+        self.assertEquals(response.mimetype, frontend.MIMETYPE)
+
+    def testProtobufSearch(self):
+        request = protocol.SearchVariantSetsRequest()
+        request.dataset_id = self.datasetId
+        expected = protocol.fromJson(
+            self.sendVariantSetsSearch().data,
+            protocol.SearchVariantSetsResponse)
+        headers = {
+            'Content-type': frontend.PROTOBUF_MIMETYPE,
+            'Accept': frontend.PROTOBUF_MIMETYPE,
+        }
+        response = self.app.post(
+            '/variantsets/search', headers=headers,
+            data=request.SerializeToString())
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(response.mimetype, frontend.PROTOBUF_MIMETYPE)
+        responseData = protocol.SearchVariantSetsResponse()
+        responseData.ParseFromString(response.data)
+        self.assertEqual(responseData, expected)
+        # Protobuf requests may still ask for JSON responses
+        headers['Accept'] = frontend.MIMETYPE
+        response = self.app.post(
+            '/variantsets/search', headers=headers,
+            data=request.SerializeToString())
+        self.assertEqual(response.mimetype, frontend.MIMETYPE)
+        self.assertEqual(protocol.fromJson(
+            response.data, protocol.SearchVariantSetsResponse), expected)
+
+    def testProtobufGet(self):
+        path = "/datasets/{}".format(self.datasetId)
+        response = self.app.get(
+            path, headers={'Accept': frontend.PROTOBUF_MIMETYPE})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(response.mimetype, frontend.PROTOBUF_MIMETYPE)
+        dataset = protocol.Dataset()
+        dataset.ParseFromString(response.data)
+        self.assertEqual(dataset.id, self.datasetId)
+        # Clients accepting anything are sent JSON
+        response = self.app.get(path, headers={'Accept': '*/*'})
+        self.assertEqual(response.mimetype, frontend.MIMETYPE)
+
+    def testProtobufError(self):
+        headers = {
+            'Content-type': frontend.PROTOBUF_MIMETYPE,
+            'Accept': frontend.PROTOBUF_MIMETYPE,
+        }
+        # A length-delimited field that is longer than the message
+        truncated = b"\x0a\x05ab"
+        response = self.app.post(
+            '/variantsets/search', headers=headers, data=truncated)
+        self.assertEqual(400, response.status_code)
+        error = protocol.GAException()
+        error.ParseFromString(response.data)
+        self.assertEqual(
+            error.error_code,
+            exceptions.InvalidProtobufException.getErrorCode())
+
+    def testMetrics(self):
+        self.sendVariantSetsSearch()
+        response = self.app.get('/metrics')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            response.headers['Content-Type'], frontend.METRICS_CONTENT_TYPE)
+        text = response.data.decode('utf-8')
+        self.assertIn("# TYPE ga4gh_requests_total counter", text)
+        self.assertIn(
+            'ga4gh_requests_total{endpoint="/variantsets/search",'
+            'status="200"}', text)
+        self.assertIn(
+            'ga4gh_search_response_items_count'
+            '{request="SearchVariantSetsRequest"}', text)
+        self.assertIn("ga4gh_file_handle_cache_hits_total", text)
+
+    def testServerTiming(self):
+        response = self.sendVariantSetsSearch()
+        self.assertNotIn('Server-Timing', response.headers)
+        frontend.app.config['REQUEST_TIMING'] = True
+        try:
+            response = self.sendVariantSetsSearch()
+        finally:
+            frontend.app.config['REQUEST_TIMING'] = False
+        self.assertEqual(200, response.status_code)
+        stages = [
+            part.split(";")[0]
+            for part in response.headers['Server-Timing'].split(", ")]
+        for stage in ["parse", "fetch", "build", "serialize", "total"]:
+            self.assertIn(stage, stages)